@@ -59,6 +59,10 @@ def iterate(iter_):
 
 if __name__ == '__main__':
 	import sys
+	if sys.argv[1:2] in (['load'], ['bench']):
+		from jsonrpc import loadgen
+		sys.exit(loadgen.main(sys.argv[2:]))
+
 	parser = argparse.ArgumentParser()
 	parser.add_argument('-p', '--path', dest='path', help='path to the JSON-RPC server', nargs='?', default='/jsonrpc')
 	parser.add_argument('host', metavar='HOST')
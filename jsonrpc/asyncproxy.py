@@ -0,0 +1,532 @@
+#
+#  Copyright (c) 2011 Edward Langley
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#  Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+#  Redistributions in binary form must reproduce the above copyright
+#  notice, this list of conditions and the following disclaimer in the
+#  documentation and/or other materials provided with the distribution.
+#
+#  Neither the name of the project's author nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+#  TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+#  LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+#  NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#  SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+'''Asynchronous JSON-RPC proxies
+
+:class:`TxJSONRPCProxy` returns Deferreds and runs on the Twisted reactor,
+:class:`AsyncioJSONRPCProxy` returns futures for an asyncio (or trollius) event
+loop.  Both are called like :class:`jsonrpc.proxy.JSONRPCProxy` and use the same
+:class:`jsonrpc.proxy.ProxyEvents` hooks, but don't block, so a single process
+can keep many calls in flight.
+'''
+import cookielib
+import StringIO
+import time
+import urlparse
+import collections
+import functools
+
+from twisted.internet import defer, reactor
+from twisted.python import failure
+from twisted.web.client import Agent, CookieAgent, HTTPConnectionPool, FileBodyProducer, readBody
+from twisted.web.client import RequestNotSent
+from twisted.web.http_headers import Headers
+
+try:
+	import asyncio
+except ImportError:
+	try:
+		import trollius as asyncio
+	except ImportError:
+		asyncio = None
+
+import jsonrpc.jsonutil
+from jsonrpc import __version__
+from jsonrpc.proxy import JSONRPCProxy, NO_RESPONSE
+
+__all__ = ['BatchingProxy', 'TxJSONRPCProxy', 'AsyncioJSONRPCProxy']
+
+
+def _assemble(chunks, length):
+	'''put the (index, output) pairs from each chunk of a batch in order'''
+	result = [None] * length
+	for outputs in chunks:
+		for index, output in outputs:
+			result[index] = output
+	return result
+
+
+class _CallBatch(object):
+	'''the calls waiting for the next batch request'''
+	def __init__(self):
+		self.calls = []
+		self.timer = None
+
+
+class BatchingProxy(JSONRPCProxy):
+	'''The call batching shared by the asynchronous proxies
+
+	When :py:attr:`ProxyEvents.batch_window` is set, calls made within that many seconds
+	of the first one, up to :py:attr:`ProxyEvents.batch_size` of them, are sent to the
+	server in a single batch request.  Each call still gets back its own result,
+	matched to it by id.  Calls to :py:attr:`ProxyEvents.cached_methods` found in
+	:py:attr:`cache` are answered without a request.  Subclasses provide :py:meth:`_call`,
+	:py:meth:`_send_batch` and the future handling.
+	'''
+
+	def customize(self, eventhandler):
+		# calls waiting to be batched go out on the transport they were made on
+		if self.__dict__.get('_batch') is not None: self.flush()
+		return JSONRPCProxy.customize(self, eventhandler)
+
+	def _init_transport(self):
+		self._batch = _CallBatch() if self._eventhandler.batch_window is not None else None
+		self._init_cache()
+
+	def __call__(self, *args, **kwargs):
+		request = self._get_request(args, kwargs)
+		key = self._get_cachekey(request)
+		if key is not None:
+			respdata = self.cache.get(key)
+			if respdata is not None:
+				result = self._future()
+				try:
+					self._succeed(result, self._get_result(respdata))
+				except Exception, e:
+					self._fail(result, e)
+				return result
+
+		if self._batch is None:
+			return self._call(request, key)
+
+		result = self._future()
+		batch = self._batch
+		batch.calls.append( (request, result) )
+		if len(batch.calls) >= self._eventhandler.batch_size:
+			self.flush()
+		elif batch.timer is None:
+			batch.timer = self._later(self._eventhandler.batch_window, self._expire)
+		return result
+
+	def _expire(self):
+		self._batch.timer = None
+		self.flush()
+
+	def flush(self):
+		'''send the calls waiting to be batched without waiting for the window to end'''
+		batch = self._batch
+		if batch is None: return
+		if batch.timer is not None:
+			batch.timer.cancel()
+			batch.timer = None
+		calls, batch.calls = batch.calls, []
+		if calls:
+			postdata = jsonrpc.jsonutil.encode([request for request, _ in calls])
+			self._send_batch(postdata, calls)
+
+	def _distribute(self, respdata, calls):
+		'''settle the result of each call from the batch response'''
+		responses = self._match_responses(respdata, [request for request, _ in calls])
+		for (request, result), response in zip(calls, responses):
+			try:
+				if response is NO_RESPONSE:
+					value = response.get_result()
+				else:
+					self._cache_response(request, response)
+					value = self._eventhandler.proc_response(response).get_result()
+			except Exception, e:
+				self._fail(result, e)
+			else:
+				self._succeed(result, value)
+
+
+class TxJSONRPCProxy(BatchingProxy):
+	'''A JSON-RPC proxy whose calls return Deferreds
+
+	Requests go through a :class:`twisted.web.client.Agent` with a persistent
+	:class:`twisted.web.client.HTTPConnectionPool` shared by all the method proxies.
+	A request which couldn't be sent because a pooled connection was closed by the
+	server is retried once.  One which was sent is never retried, even if no response
+	came, as the server may have made the call.
+	'''
+
+	def _init_transport(self):
+		BatchingProxy._init_transport(self)
+		self._pool = HTTPConnectionPool(reactor, persistent=self._eventhandler.keepalive)
+		self._pool.maxPersistentPerHost = self._eventhandler.pool_size
+		self._pool.cachedConnectionTimeout = self._eventhandler.idle_timeout
+		self._agent = CookieAgent(Agent(reactor, pool=self._pool), cookielib.CookieJar())
+		self._headers = Headers({
+			'content-type': ['application/json'],
+			'user-agent': ['jsonrpc/'+__version__],
+		})
+
+	def close(self):
+		'''close the connections kept open to the server
+
+		:returns: a Deferred which fires once they are closed
+		'''
+		return self._pool.closeCachedConnections()
+
+	def _post(self, url, data):
+		d = self._request(url, data)
+		d.addErrback(self._ebRequest, url, data)
+		d.addCallback(readBody)
+		return d
+
+	def _request(self, url, data):
+		return self._agent.request('POST', url, self._headers, FileBodyProducer(StringIO.StringIO(data)))
+
+	def _ebRequest(self, failure, url, data):
+		# the server closed a pooled connection before the request went out, try again on another one
+		failure.trap(RequestNotSent)
+		return self._request(url, data)
+
+	def _call(self, request, key):
+		d = self._post(self._get_url(), jsonrpc.jsonutil.encode(request))
+		return d.addCallback(self._get_result, key)
+
+	def _send_batch(self, postdata, calls):
+		d = self._post(self._get_url(), postdata)
+		d.addCallback(self._distribute, calls)
+		d.addErrback(self._ebBatch, calls)
+
+	def _ebBatch(self, failure, calls):
+		for _, d in calls:
+			if not d.called: d.errback(failure)
+
+	def _future(self):
+		return defer.Deferred()
+
+	def _later(self, delay, func):
+		return reactor.callLater(delay, func)
+
+	def _succeed(self, d, value):
+		d.callback(value)
+
+	def _fail(self, d, exception):
+		d.errback(failure.Failure(exception))
+
+	def batch_call(self, methods, chunk_size=None, concurrency=1):
+		'''call several methods at once, see :py:meth:`jsonrpc.proxy.JSONRPCProxy.batch_call`
+
+		:returns: a Deferred firing with a list of pairs (result, error) where only one is not None
+		'''
+		requests = self._get_batch_requests(methods)
+		semaphore = defer.DeferredSemaphore(max(1, concurrency))
+		d = defer.gatherResults([
+			semaphore.run(self._post, self._get_url(), jsonrpc.jsonutil.encode(chunk))
+				.addCallback(self._get_batch_outputs, offset, chunk)
+					for offset, chunk in self._get_chunks(requests, chunk_size)
+		], consumeErrors=True)
+		d.addCallbacks(_assemble, lambda failure: failure.value.subFailure, (len(requests),))
+		return d
+
+
+if asyncio is not None:
+	ensure_future = getattr(asyncio, 'ensure_future', None) or getattr(asyncio, 'async')
+
+	def _chain(future, func, loop):
+		'''a future for func(future.result())'''
+		result = asyncio.Future(loop=loop)
+		def done(future):
+			if future.cancelled():
+				result.cancel()
+			elif future.exception() is not None:
+				result.set_exception(future.exception())
+			else:
+				try: result.set_result(func(future.result()))
+				except Exception, e: result.set_exception(e)
+		future.add_done_callback(done)
+		return result
+
+
+	def _gather_limited(calls, concurrency, loop):
+		'''call each of calls, which return futures, with at most concurrency of them unfinished
+
+		:returns: a future for the list of their results
+		'''
+		result = asyncio.Future(loop=loop)
+		results = [None] * len(calls)
+		pending = iter(enumerate(calls))
+		state = dict(running=0)
+		def launch():
+			for index, call in pending:
+				state['running'] += 1
+				call().add_done_callback(functools.partial(finished, index))
+				return
+			if state['running'] == 0 and not result.done():
+				result.set_result(results)
+		def finished(index, future):
+			state['running'] -= 1
+			if result.done(): return
+			if future.exception() is not None:
+				return result.set_exception(future.exception())
+			results[index] = future.result()
+			launch()
+		for _ in xrange(max(1, concurrency)): launch()
+		return result
+
+
+	class ConnectionClosed(IOError):
+		'''the server closed the connection before the response was complete'''
+
+
+	class HTTPClientProtocol(asyncio.Protocol):
+		'''A minimal HTTP/1.1 client connection, carrying one request at a time'''
+
+		def __init__(self, loop):
+			self.loop = loop
+			self.transport = None
+			self.response = None
+			#: True once the connection can't carry another request
+			self.closed = False
+
+		def connection_made(self, transport):
+			self.transport = transport
+
+		def close(self):
+			self.closed = True
+			if self.transport is not None:
+				self.transport.close()
+
+		def request(self, data):
+			''':returns: a future for the pair (status, body)'''
+			self.response = asyncio.Future(loop=self.loop)
+			#: set once the request has been written, after which it is never sent again
+			self.sent = False
+			#: set once any part of the response has arrived
+			self.received = False
+			self._buffer = b''
+			self._status = self._headers = self._length = self._chunk = None
+			self._chunked = False
+			self._body = []
+			if self.closed:
+				self.response.set_exception(ConnectionClosed('connection closed by server'))
+			else:
+				self.transport.write(data)
+				self.sent = True
+			return self.response
+
+		def data_received(self, data):
+			self.received = True
+			self._buffer += data
+			if self.response is None or self.response.done(): return
+			try:
+				self._parse()
+			except Exception, e:
+				self.close()
+				self.response.set_exception(e)
+
+		def connection_lost(self, exc):
+			self.closed = True
+			if self.response is None or self.response.done(): return
+			if self._headers is not None and self._length is None and not self._chunked:
+				# the body is delimited by the end of the connection
+				self._finish(self._buffer)
+			else:
+				self.response.set_exception(exc or ConnectionClosed('connection closed by server'))
+
+		def _finish(self, body):
+			if self._close: self.close()
+			self.response.set_result( (self._status, body) )
+
+		def _parse(self):
+			if self._headers is None:
+				end = self._buffer.find(b'\r\n\r\n')
+				if end < 0: return
+				head, self._buffer = self._buffer[:end].split(b'\r\n'), self._buffer[end+4:]
+				version, status = head[0].split(b' ', 2)[:2]
+				self._status = int(status)
+				self._headers = dict(
+					(name.strip().lower(), value.strip())
+						for name, _, value in (line.partition(b':') for line in head[1:])
+				)
+				self._close = version == b'HTTP/1.0' or self._headers.get(b'connection', b'').lower() == b'close'
+				if b'chunked' in self._headers.get(b'transfer-encoding', b'').lower():
+					self._chunked = True
+				elif b'content-length' in self._headers:
+					self._length = int(self._headers[b'content-length'])
+				else:
+					self._close = True
+
+			if self._chunked:
+				self._parse_chunks()
+			elif self._length is not None and len(self._buffer) >= self._length:
+				self._finish(self._buffer[:self._length])
+
+		def _parse_chunks(self):
+			while True:
+				if self._chunk is None:
+					end = self._buffer.find(b'\r\n')
+					if end < 0: return
+					self._chunk = int(self._buffer[:end].split(b';')[0], 16)
+					self._buffer = self._buffer[end+2:]
+				if self._chunk == 0:
+					# skip the trailer
+					if self._buffer.startswith(b'\r\n'): end = 0
+					else: end = self._buffer.find(b'\r\n\r\n')
+					if end < 0: return
+					return self._finish(b''.join(self._body))
+				if len(self._buffer) < self._chunk + 2: return
+				self._body.append(self._buffer[:self._chunk])
+				self._buffer = self._buffer[self._chunk+2:]
+				self._chunk = None
+
+
+	class AsyncioConnectionPool(object):
+		'''A bounded pool of idle :class:`HTTPClientProtocol` connections, keyed by (scheme, host, port)'''
+
+		def __init__(self, loop, maxsize=4, idle_timeout=30, ssl=None):
+			self.loop = loop
+			self.maxsize = maxsize
+			self.idle_timeout = idle_timeout
+			self.ssl = ssl
+			self._idle = collections.defaultdict(list)
+
+		def get(self, key):
+			''':returns: a future for the pair (connection, reused)'''
+			idle = self._idle[key]
+			while idle:
+				protocol, since = idle.pop()
+				if protocol.closed or time.time() - since > self.idle_timeout:
+					protocol.close()
+					continue
+				result = asyncio.Future(loop=self.loop)
+				result.set_result( (protocol, True) )
+				return result
+
+			scheme, host, port = key
+			ssl = (self.ssl or True) if scheme == 'https' else None
+			connect = self.loop.create_connection(lambda: HTTPClientProtocol(self.loop), host, port, ssl=ssl)
+			return _chain(ensure_future(connect, loop=self.loop), lambda connection: (connection[1], False), self.loop)
+
+		def put(self, key, protocol):
+			'''hand an idle connection back to the pool'''
+			idle = self._idle[key]
+			if protocol.closed or len(idle) >= self.maxsize:
+				protocol.close()
+			else:
+				idle.append( (protocol, time.time()) )
+
+		def close(self):
+			'''close every idle connection'''
+			idle, self._idle = self._idle, collections.defaultdict(list)
+			for protocols in idle.values():
+				for protocol, _ in protocols: protocol.close()
+
+
+	class AsyncioJSONRPCProxy(BatchingProxy):
+		'''A JSON-RPC proxy whose calls return asyncio futures
+
+		Requests are written over persistent connections from an
+		:class:`AsyncioConnectionPool` shared by all the method proxies.  A request
+		which couldn't be written because a pooled connection was already closed by
+		the server is retried on a new connection.  One which was written is never
+		retried, even if no response came, as the server may have made the call.
+		'''
+
+		#: the event loop to run on, by default the current one
+		loop = None
+
+		def _init_transport(self):
+			BatchingProxy._init_transport(self)
+			if self.loop is None:
+				self.loop = asyncio.get_event_loop()
+			self._pool = AsyncioConnectionPool(self.loop, self._eventhandler.pool_size, self._eventhandler.idle_timeout)
+
+		def close(self):
+			'''close the connections kept open to the server'''
+			self._pool.close()
+
+		def _post(self, url, data):
+			urlsp = urlparse.urlsplit(url)
+			key = (urlsp.scheme, urlsp.hostname, urlsp.port or (443 if urlsp.scheme == 'https' else 80))
+			path = urlsp.path or '/'
+			if urlsp.query: path = '{0}?{1}'.format(path, urlsp.query)
+			message = '\r\n'.join([
+				'POST {0} HTTP/1.1'.format(path),
+				'Host: {0}'.format(urlsp.netloc),
+				'Content-Type: application/json',
+				'User-Agent: jsonrpc/'+__version__,
+				'Content-Length: {0}'.format(len(data)),
+				'Connection: {0}'.format('keep-alive' if self._eventhandler.keepalive else 'close'),
+				'', data,
+			])
+
+			result = asyncio.Future(loop=self.loop)
+			def attempt():
+				self._pool.get(key).add_done_callback(connected)
+			def connected(future):
+				if future.exception() is not None:
+					return result.set_exception(future.exception())
+				protocol, reused = future.result()
+				protocol.request(message).add_done_callback(lambda response: responded(protocol, reused, response))
+			def responded(protocol, reused, response):
+				if response.exception() is not None:
+					protocol.close()
+					# the server closed a pooled connection before the request went out, try again on another one
+					if reused and not protocol.sent: return attempt()
+					return result.set_exception(response.exception())
+				if self._eventhandler.keepalive: self._pool.put(key, protocol)
+				else: protocol.close()
+				result.set_result(response.result()[1])
+			attempt()
+			return result
+
+		def _call(self, request, key):
+			future = self._post(self._get_url(), jsonrpc.jsonutil.encode(request))
+			return _chain(future, lambda respdata: self._get_result(respdata, key), self.loop)
+
+		def _send_batch(self, postdata, calls):
+			def done(future):
+				try:
+					self._distribute(future.result(), calls)
+				except Exception, e:
+					for _, result in calls: self._fail(result, e)
+			self._post(self._get_url(), postdata).add_done_callback(done)
+
+		def _future(self):
+			return asyncio.Future(loop=self.loop)
+
+		def _later(self, delay, func):
+			return self.loop.call_later(delay, func)
+
+		def _succeed(self, future, value):
+			if not future.done(): future.set_result(value)
+
+		def _fail(self, future, exception):
+			if not future.done(): future.set_exception(exception)
+
+		def batch_call(self, methods, chunk_size=None, concurrency=1):
+			'''call several methods at once, see :py:meth:`jsonrpc.proxy.JSONRPCProxy.batch_call`
+
+			:returns: a future for a list of pairs (result, error) where only one is not None
+			'''
+			requests = self._get_batch_requests(methods)
+			def send(offset, chunk):
+				future = self._post(self._get_url(), jsonrpc.jsonutil.encode(chunk))
+				return _chain(future, lambda respdata: self._get_batch_outputs(respdata, offset, chunk), self.loop)
+			sends = [ functools.partial(send, offset, chunk) for offset, chunk in self._get_chunks(requests, chunk_size) ]
+			return _chain(_gather_limited(sends, concurrency, self.loop), lambda chunks: _assemble(chunks, len(requests)), self.loop)
+
+	__all__.extend(['HTTPClientProtocol', 'AsyncioConnectionPool', 'ConnectionClosed'])
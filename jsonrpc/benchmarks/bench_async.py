@@ -0,0 +1,133 @@
+from __future__ import print_function
+#
+#  Copyright (c) 2011 Edward Langley
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#  Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+#  Redistributions in binary form must reproduce the above copyright
+#  notice, this list of conditions and the following disclaimer in the
+#  documentation and/or other materials provided with the distribution.
+#
+#  Neither the name of the project's author nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+#  TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+#  LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+#  NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#  SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+'''Load test example_server with blocking, Twisted and asyncio proxies
+
+Start ``python -m jsonrpc.example_server`` first.  Each client keeps up to
+--concurrency calls in flight; the blocking proxy needs a thread for each.
+'''
+import threading
+import time
+import Queue
+
+from twisted.internet import defer, reactor
+
+from jsonrpc.proxy import JSONRPCProxy, ProxyEvents
+from jsonrpc.asyncproxy import TxJSONRPCProxy, asyncio
+if asyncio is not None:
+	from jsonrpc.asyncproxy import AsyncioJSONRPCProxy
+
+def events(concurrency, window=None):
+	class LoadEvents(ProxyEvents):
+		pool_size = concurrency
+		batch_window = window
+	return LoadEvents
+
+def report(name, calls, elapsed):
+	print('%-10s %8d calls %8.2f s %10.1f calls/s' % (name, calls, elapsed, calls / elapsed))
+
+def run_threads(url, calls, concurrency):
+	proxy = type('Proxy', (JSONRPCProxy,), dict(_eventhandler=events(concurrency)))(url, path='')
+	work = Queue.Queue()
+	for i in xrange(calls): work.put(i)
+	def worker():
+		while True:
+			try: i = work.get_nowait()
+			except Queue.Empty: return
+			assert proxy.add(i, 1) == i+1
+	threads = [threading.Thread(target=worker) for _ in xrange(concurrency)]
+	start = time.time()
+	for thread in threads: thread.start()
+	for thread in threads: thread.join()
+	report('threads', calls, time.time() - start)
+	proxy.close()
+
+def run_asyncio(url, calls, concurrency, window=None):
+	loop = asyncio.new_event_loop()
+	cls = type('Proxy', (AsyncioJSONRPCProxy,), dict(_eventhandler=events(concurrency, window), loop=loop))
+	proxy = cls(url, path='')
+	pending = iter(xrange(calls))
+	finished = asyncio.Future(loop=loop)
+	state = dict(inflight=0)
+	def launch():
+		for i in pending:
+			state['inflight'] += 1
+			proxy.add(i, 1).add_done_callback(completed)
+			return
+		if state['inflight'] == 0 and not finished.done():
+			finished.set_result(None)
+	def completed(future):
+		future.result()
+		state['inflight'] -= 1
+		launch()
+	start = time.time()
+	for _ in xrange(concurrency): launch()
+	loop.run_until_complete(finished)
+	report('asyncio', calls, time.time() - start)
+	proxy.close()
+	loop.close()
+
+@defer.inlineCallbacks
+def run_twisted(url, calls, concurrency, window=None):
+	proxy = type('Proxy', (TxJSONRPCProxy,), dict(_eventhandler=events(concurrency, window)))(url, path='')
+	semaphore = defer.DeferredSemaphore(concurrency)
+	start = time.time()
+	results = yield defer.gatherResults([semaphore.run(proxy.add, i, 1) for i in xrange(calls)])
+	assert results == [i+1 for i in xrange(calls)]
+	report('twisted', calls, time.time() - start)
+	yield proxy.close()
+
+def main(url, calls=10000, concurrency=200, clients=('threads', 'asyncio', 'twisted'), window=None):
+	print('%s, up to %d calls in flight' % (url, concurrency))
+	if window is not None:
+		print('asyncio and twisted batch calls made within %g s' % window)
+	if 'threads' in clients:
+		run_threads(url, calls, concurrency)
+	if 'asyncio' in clients and asyncio is not None:
+		run_asyncio(url, calls, concurrency, window)
+	if 'twisted' in clients:
+		d = run_twisted(url, calls, concurrency, window)
+		d.addErrback(lambda failure: failure.printTraceback())
+		d.addBoth(lambda _: reactor.stop())
+		reactor.run()
+
+if __name__ == '__main__':
+	import argparse
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument('url', nargs='?', default='http://localhost:8007')
+	parser.add_argument('-n', '--calls', type=int, default=10000)
+	parser.add_argument('-c', '--concurrency', type=int, default=200)
+	parser.add_argument('--clients', nargs='+', default=['threads', 'asyncio', 'twisted'])
+	parser.add_argument('-w', '--batch-window', type=float, default=None)
+	args = parser.parse_args()
+	main(args.url, args.calls, args.concurrency, args.clients, args.batch_window)
@@ -0,0 +1,55 @@
+from __future__ import print_function
+#
+#  Copyright (c) 2011 Edward Langley
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#  Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+#  Redistributions in binary form must reproduce the above copyright
+#  notice, this list of conditions and the following disclaimer in the
+#  documentation and/or other materials provided with the distribution.
+#
+#  Neither the name of the project's author nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+#  TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+#  LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+#  NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#  SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+'''Requests per second for a lookup returning a few kilobytes, with and without :py:func:`jsonrpc.server.cacheable`'''
+from twisted.internet import defer
+
+from jsonrpc.server import JSON_RPC
+from jsonrpc.benchmarks.suite import BenchServer, rate, react
+
+@defer.inlineCallbacks
+def main(calls=20000, concurrency=100, keys=100):
+	resource = JSON_RPC().customize(BenchServer)
+	for method in ('lookup', 'cached_lookup'):
+		body = lambda n: '{"jsonrpc": "2.0", "params": [%d], "method": "%s", "id": 1}' % (n % keys, method)
+		result = yield rate(resource, body, calls, concurrency)
+		print('%-14s %10.1f requests/sec' % (method, result))
+	print(resource.eventhandler.cache.stats())
+
+if __name__ == '__main__':
+	import argparse
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument('-n', '--calls', type=int, default=20000)
+	parser.add_argument('-c', '--concurrency', type=int, default=100)
+	parser.add_argument('-k', '--keys', type=int, default=100, help='how many different params are looked up')
+	args = parser.parse_args()
+	react(main, args.calls, args.concurrency, args.keys)
@@ -0,0 +1,103 @@
+from __future__ import print_function
+#
+#  Copyright (c) 2011 Edward Langley
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#  Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+#  Redistributions in binary form must reproduce the above copyright
+#  notice, this list of conditions and the following disclaimer in the
+#  documentation and/or other materials provided with the distribution.
+#
+#  Neither the name of the project's author nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+#  TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+#  LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+#  NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#  SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+'''Time jsonutil.encode on batches of Responses holding custom classes'''
+import json
+import time
+import functools
+
+import jsonrpc.jsonutil
+from jsonrpc.common import Response
+
+class Point(object):
+	def __init__(self, x, y): self.x, self.y = x, y
+	def json_equivalent(self): return dict(x=self.x, y=self.y)
+
+class Tags(object):
+	def __init__(self, *tags): self.tags = tags
+	def __iter__(self): return iter(self.tags)
+
+class Opaque(object):
+	def __str__(self): return 'opaque'
+
+def payload(items):
+	return [
+		Response(id=i, result=dict(points=[Point(i, j) for j in range(10)], tags=Tags('a', 'b'), other=Opaque(), n=i))
+		for i in xrange(items)
+	]
+
+# jsonutil.encode_ before converters were cached per class, for comparison
+def legacy_dict_encode(obj):
+	items = getattr(obj, 'iteritems', obj.items)
+	return dict( (legacy_encode_(k),legacy_encode_(v)) for k,v in items() )
+
+def legacy_list_encode(obj):
+	return list(legacy_encode_(i) for i in obj)
+
+def legacy_safe_encode(obj):
+	try: json.dumps(obj)
+	except TypeError: obj = str(obj)
+	return obj
+
+def legacy_encode_(obj, **kw):
+	obj = getattr(obj, 'json_equivalent', lambda: obj)()
+	if hasattr(obj, 'items'):
+		func = legacy_dict_encode
+	elif hasattr(obj, '__iter__'):
+		func = legacy_list_encode
+	else:
+		func = legacy_safe_encode
+	return func(obj)
+
+legacy_encode = functools.partial(json.dumps, default=legacy_encode_)
+
+def timeit(encode, data, rounds):
+	start = time.time()
+	for _ in xrange(rounds): encode(data)
+	return (time.time() - start) / rounds
+
+def main(items=1000, rounds=10):
+	data = payload(items)
+	assert json.loads(legacy_encode(data)) == json.loads(jsonrpc.jsonutil.encode(data))
+
+	print('%d Responses, %d rounds' % (items, rounds))
+	for name, encode in [('legacy', legacy_encode), ('jsonutil', jsonrpc.jsonutil.encode)]:
+		print('%-10s %8.2f ms' % (name, timeit(encode, data, rounds) * 1000))
+
+if __name__ == '__main__':
+	import argparse
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument('-n', '--items', type=int, default=1000)
+	parser.add_argument('-r', '--rounds', type=int, default=10)
+	args = parser.parse_args()
+	main(args.items, args.rounds)
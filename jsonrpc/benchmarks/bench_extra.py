@@ -0,0 +1,83 @@
+from __future__ import print_function
+#
+#  Copyright (c) 2011 Edward Langley
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#  Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+#  Redistributions in binary form must reproduce the above copyright
+#  notice, this list of conditions and the following disclaimer in the
+#  documentation and/or other materials provided with the distribution.
+#
+#  Neither the name of the project's author nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+#  TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+#  LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+#  NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#  SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+'''Time to dispatch 1000-item batches whose requests carry large extra members
+
+The second figure is a simulation, not a run of the old code: it times a copy.deepcopy of
+each request's extra, the per-call copy the server used to make, on its own.  Adding it to the
+dispatch time approximates what a batch cost before.'''
+import copy
+import time
+
+from twisted.web.test.requesthelper import DummyRequest
+
+import jsonrpc.common
+import jsonrpc.jsonutil
+from jsonrpc.server import JSON_RPC
+from jsonrpc.benchmarks.suite import BenchServer
+
+def batch(items, extra_size):
+	meta = [dict(key=i, value='x' * 16) for i in xrange(extra_size)]
+	return jsonrpc.jsonutil.encode([
+		dict(jsonrpc='2.0', method='count', params=[i], id=i, meta=meta) for i in xrange(items)
+	])
+
+def main(items=1000, extra_size=100, rounds=20):
+	resource = JSON_RPC().customize(BenchServer)
+	body = batch(items, extra_size)
+
+	dispatch = deepcopy = 0
+	for _ in xrange(rounds):
+		contents = jsonrpc.common.Request.from_json(jsonrpc.jsonutil.decode(body))
+
+		start = time.time()
+		resource._action(DummyRequest(['']), contents)
+		dispatch += time.time() - start
+
+		# simulates the per-call copy of extra the server used to make on top of that
+		start = time.time()
+		for rpcrequest in contents: copy.deepcopy(rpcrequest.extra)
+		deepcopy += time.time() - start
+
+	print('%d items, %d element extra members, %d rounds' % (items, extra_size, rounds))
+	print('dispatch                      %8.2f ms/batch' % (dispatch / rounds * 1000))
+	print('deepcopy of extra (simulated) %8.2f ms/batch' % (deepcopy / rounds * 1000))
+
+if __name__ == '__main__':
+	import argparse
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument('-n', '--items', type=int, default=1000)
+	parser.add_argument('-s', '--extra-size', type=int, default=100)
+	parser.add_argument('-r', '--rounds', type=int, default=20)
+	args = parser.parse_args()
+	main(args.items, args.extra_size, args.rounds)
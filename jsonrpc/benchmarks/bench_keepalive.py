@@ -0,0 +1,67 @@
+from __future__ import print_function
+#
+#  Copyright (c) 2011 Edward Langley
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#  Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+#  Redistributions in binary form must reproduce the above copyright
+#  notice, this list of conditions and the following disclaimer in the
+#  documentation and/or other materials provided with the distribution.
+#
+#  Neither the name of the project's author nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+#  TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+#  LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+#  NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#  SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+'''Time sequential small calls through JSONRPCProxy with and without keep-alive'''
+import time
+
+from jsonrpc.proxy import JSONRPCProxy, ProxyEvents
+from jsonrpc.benchmarks.suite import BenchServer, Context
+
+class ClosingEvents(ProxyEvents):
+	keepalive = False
+
+class ClosingProxy(JSONRPCProxy):
+	_eventhandler = ClosingEvents
+
+def timeit(proxy, calls):
+	start = time.time()
+	for i in xrange(calls):
+		assert proxy.inline_add(i, 1) == i+1
+	return (time.time() - start) / calls
+
+def main(calls=1000):
+	context = Context()
+	url = context.listen(BenchServer)
+	print('%d sequential calls' % calls)
+	for name, cls in [('connection per call', ClosingProxy), ('keep-alive', JSONRPCProxy)]:
+		proxy = cls(url, path='')
+		print('%-20s %8.3f ms/call' % (name, timeit(proxy, calls) * 1000))
+		proxy.close()
+	context.stop()
+
+if __name__ == '__main__':
+	import argparse
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument('-n', '--calls', type=int, default=1000)
+	args = parser.parse_args()
+	main(args.calls)
@@ -0,0 +1,99 @@
+from __future__ import print_function
+#
+#  Copyright (c) 2011 Edward Langley
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#  Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+#  Redistributions in binary form must reproduce the above copyright
+#  notice, this list of conditions and the following disclaimer in the
+#  documentation and/or other materials provided with the distribution.
+#
+#  Neither the name of the project's author nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+#  TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+#  LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+#  NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#  SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+'''Memory and time for a batch of 100,000 requests and their responses as :py:mod:`jsonrpc.common` objects
+
+The messages are compared with the same classes without ``__slots__``, i.e. with a ``__dict__`` per
+object, as they used to be.  Memory is the bytes per message of the objects themselves, not counting the
+values they hold, which are the same either way.  Time is for making the requests from the decoded batch
+and for encoding the responses, with plain results and with results already encoded as
+:py:class:`jsonrpc.jsonutil.RawJSON`.
+'''
+import sys
+import timeit
+
+import jsonrpc.jsonutil
+from jsonrpc.common import Request, Response
+from jsonrpc.jsonutil import RawJSON
+
+class DictRequest(Request):
+	pass
+
+class DictResponse(Response):
+	pass
+
+def batch(size):
+	return jsonrpc.jsonutil.decode(jsonrpc.jsonutil.encode([
+		dict(jsonrpc='2.0', method='add', params=dict(a=i, b=1), id=i) for i in xrange(size)
+	]))
+
+def footprint(objects):
+	''':returns: the bytes per object of the objects and their __dict__s'''
+	total = 0
+	for obj in objects:
+		total += sys.getsizeof(obj)
+		if hasattr(obj, '__dict__'): total += sys.getsizeof(obj.__dict__)
+	return total / float(len(objects))
+
+def best(func, repeat):
+	return min(timeit.repeat(func, number=1, repeat=repeat))
+
+def main(size=100000, repeat=5):
+	calls = batch(size)
+	print('%d calls' % size)
+	print('%-16s %12s %12s' % ('', 'slots', '__dict__'))
+
+	requests = [ Request.from_list(calls), DictRequest.from_list(calls) ]
+	print('%-16s %10.1f B %10.1f B' % ('request', footprint(requests[0]), footprint(requests[1])))
+	responses = [
+		[ cls(request.id, request.kwargs['a'] + request.kwargs['b']) for request in requests[0] ]
+			for cls in (Response, DictResponse)
+	]
+	print('%-16s %10.1f B %10.1f B' % ('response', footprint(responses[0]), footprint(responses[1])))
+
+	print('%-16s %10.1fms %10.1fms' % ('from_list',
+		best(lambda: Request.from_list(calls), repeat) * 1000,
+		best(lambda: DictRequest.from_list(calls), repeat) * 1000))
+	print('%-16s %10.1fms %10.1fms' % ('encode_list',
+		best(lambda: Response.encode_list(responses[0]), repeat) * 1000,
+		best(lambda: Response.encode_list(responses[1]), repeat) * 1000))
+
+	raw = [ Response(response.id, RawJSON(jsonrpc.jsonutil.encode(response.result))) for response in responses[0] ]
+	print('%-16s %10.1fms' % ('encode_list, raw', best(lambda: Response.encode_list(raw), repeat) * 1000))
+
+if __name__ == '__main__':
+	import argparse
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument('-n', '--size', type=int, default=100000, help='the calls in the batch')
+	parser.add_argument('-r', '--repeat', type=int, default=5)
+	args = parser.parse_args()
+	main(args.size, args.repeat)
@@ -0,0 +1,421 @@
+from __future__ import print_function
+#
+#  Copyright (c) 2011 Edward Langley
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#  Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+#  Redistributions in binary form must reproduce the above copyright
+#  notice, this list of conditions and the following disclaimer in the
+#  documentation and/or other materials provided with the distribution.
+#
+#  Neither the name of the project's author nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+#  TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+#  LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+#  NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#  SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+'''Reproducible timings of the hot paths of the server and the client, saved as JSON so that runs can be compared
+
+	% python -m jsonrpc.benchmarks.suite -o before.json
+	  (make a change)
+	% python -m jsonrpc.benchmarks.suite -o after.json --compare before.json
+
+Everything runs offline in this process, against the methods of :py:mod:`jsonrpc.example_server`: the
+in-memory benchmarks render requests on a :py:class:`jsonrpc.server.JSON_RPC` resource directly, the loopback
+ones go through :py:class:`jsonrpc.proxy.JSONRPCProxy` to a server listening on 127.0.0.1.  The payloads are
+generated from a fixed seed, so every run times the same work.
+
+Each benchmark is timed ``--repeat`` times, each time running it for as many loops as fill ``--min-time``
+seconds, and the median seconds per operation is what runs are compared on.
+'''
+import gc
+import os
+import re
+import sys
+import json
+import zlib
+import time
+import random
+import timeit
+import platform
+import StringIO
+import threading
+import subprocess
+import collections
+
+import twisted
+from twisted.internet import reactor, defer, threads
+from twisted.web import server
+from twisted.web.test.requesthelper import DummyRequest
+
+import jsonrpc
+import jsonrpc.common
+import jsonrpc.jsonutil
+from jsonrpc.server import ServerEvents, JSON_RPC, expose, cacheable, execution_policy, INLINE, THREAD, ASYNC
+from jsonrpc.proxy import JSONRPCProxy
+from jsonrpc.example_server import ExampleServer
+
+#: name -> (setup, items, timed), see :py:func:`benchmark`
+BENCHMARKS = collections.OrderedDict()
+
+def benchmark(name, items=1, timed=False):
+	'''Register a benchmark.  The decorated function takes the :py:class:`Context`, and returns a function
+	which runs the operation once.
+
+	:param items: how many items, e.g. calls of a batch, an operation handles
+	:param timed: the function returned takes a number of loops instead, runs the operation that many
+		times and returns the seconds it took'''
+	def _inner(setup):
+		BENCHMARKS[name] = (setup, items, timed)
+		return setup
+	return _inner
+
+def _timer(func):
+	def timer(loops):
+		start = timeit.default_timer()
+		for _ in xrange(loops): func()
+		return timeit.default_timer() - start
+	return timer
+
+
+class QuietServer(ExampleServer):
+	'''The example server's methods, without its logging'''
+	def log(self, responses, txrequest, error):
+		pass
+
+#: what :py:meth:`BenchServer.lookup` returns, a few kilobytes
+RECORD = dict(('field%d' % i, ['value'] * 10) for i in range(50))
+
+class BenchServer(ServerEvents):
+	'''The methods the benchmark scripts call'''
+	@expose
+	@execution_policy(THREAD)
+	def thread_add(self, a, b):
+		return a+b
+
+	@expose
+	@execution_policy(INLINE)
+	def inline_add(self, a, b):
+		return a+b
+
+	@expose
+	@execution_policy(ASYNC)
+	def async_add(self, a, b):
+		return defer.succeed(a+b)
+
+	@expose
+	@execution_policy(INLINE)
+	def count(self, *args, **kwargs):
+		return len(kwargs)
+
+	@expose
+	def lookup(self, key):
+		time.sleep(0.001)
+		return dict(RECORD, key=key)
+
+	@expose
+	@cacheable
+	def cached_lookup(self, key):
+		return self.lookup(key)
+
+
+def render(resource, body):
+	'''render a request with the given body on resource
+
+	:returns: a Deferred which fires when the response is finished'''
+	request = DummyRequest([''])
+	request.content = StringIO.StringIO(body)
+	finished = request.notifyFinish()
+	resource.render(request)
+	return finished
+
+@defer.inlineCallbacks
+def rate(resource, body, calls, concurrency):
+	'''render `calls` requests, the nth with the body `body(n)`, keeping at most `concurrency` in flight
+
+	:returns: requests per second'''
+	start = time.time()
+	for n in xrange(0, calls, concurrency):
+		yield defer.DeferredList([render(resource, body(n+i)) for i in xrange(concurrency)])
+	defer.returnValue(calls / (time.time() - start))
+
+def react(main, *args):
+	'''run the reactor until the Deferred main(*args) returns has fired'''
+	def _run():
+		d = main(*args)
+		d.addErrback(lambda f: f.printTraceback())
+		d.addBoth(lambda _: reactor.stop())
+	reactor.callWhenRunning(_run)
+	reactor.run()
+
+class Context(object):
+	'''What the benchmarks share: the payloads, and the reactor and loopback server, started when first needed'''
+	def __init__(self, seed=0):
+		self.random = random.Random(seed)
+		self._thread = None
+		self._proxy = None
+
+	def start(self):
+		if self._thread is None:
+			self._thread = threading.Thread(target=reactor.run, kwargs=dict(installSignalHandlers=False))
+			self._thread.daemon = True
+			self._thread.start()
+
+	def stop(self):
+		if self._proxy is not None: self._proxy.close()
+		if self._thread is not None:
+			reactor.callFromThread(reactor.stop)
+			self._thread.join()
+
+	def call(self, func, *a, **kw):
+		'''run func on the reactor thread, waiting for the Deferred it returns'''
+		self.start()
+		return threads.blockingCallFromThread(reactor, func, *a, **kw)
+
+	def listen(self, events):
+		''':returns: the url of a server for the methods of events, listening on 127.0.0.1'''
+		site = server.Site(JSON_RPC().customize(events))
+		port = self.call(reactor.listenTCP, 0, site, interface='127.0.0.1')
+		return 'http://127.0.0.1:%d' % port.getHost().port
+
+	@property
+	def proxy(self):
+		'''a keep-alive proxy to the example server methods, served on 127.0.0.1'''
+		if self._proxy is None:
+			self._proxy = JSONRPCProxy(self.listen(QuietServer), path='')
+		return self._proxy
+
+	def record(self):
+		'''a record of the kind a method might return'''
+		r = self.random
+		return dict(
+			id=r.randint(0, 1 << 30),
+			name=u''.join(r.choice(u'abcdefgh\xe9\u4e2d') for _ in xrange(12)),
+			score=r.random(),
+			active=r.random() < 0.5,
+			tags=[r.choice(['red', 'green', 'blue']) for _ in xrange(3)],
+			parent=None,
+		)
+
+	def calls(self, count):
+		'''a batch of calls to the example server's methods'''
+		return [
+			dict(jsonrpc='2.0', method=self.random.choice(['add', 'subtract']),
+				params=[self.random.randint(0, 1000), self.random.randint(0, 1000)], id=i)
+			for i in xrange(count)
+		]
+
+
+## jsonutil
+
+def _payloads(context):
+	return collections.OrderedDict([
+		('request', dict(jsonrpc='2.0', method='add', params=[1, 2], id=1)),
+		('record', context.record()),
+		('records_1000', [context.record() for _ in xrange(1000)]),
+	])
+
+for _name, _items in (('request', 1), ('record', 1), ('records_1000', 1000)):
+	def _encode(context, name=_name):
+		data = _payloads(context)[name]
+		return lambda: jsonrpc.jsonutil.encode(data)
+	benchmark('jsonutil.encode.%s' % _name, _items)(_encode)
+
+	def _decode(context, name=_name):
+		data = jsonrpc.jsonutil.encode(_payloads(context)[name])
+		return lambda: jsonrpc.jsonutil.decode(data)
+	benchmark('jsonutil.decode.%s' % _name, _items)(_decode)
+
+
+## common
+
+@benchmark('common.Request.from_dict')
+def _from_dict(context):
+	content = dict(jsonrpc='2.0', method='add', params=dict(a=1, b=2), id=1, meta=context.record())
+	return lambda: jsonrpc.common.Request.from_dict(content)
+
+@benchmark('common.Response.json_equivalent')
+def _json_equivalent(context):
+	response = jsonrpc.common.Response(id=1, result=context.record())
+	return lambda: response.json_equivalent()
+
+@benchmark('common.Request.from_list.batch_100000', items=100000)
+def _from_list(context):
+	calls = jsonrpc.jsonutil.decode(jsonrpc.jsonutil.encode(context.calls(100000)))
+	return lambda: jsonrpc.common.Request.from_list(calls)
+
+@benchmark('common.Response.encode_list.batch_100000', items=100000)
+def _encode_list(context):
+	responses = [ jsonrpc.common.Response(id=i, result=context.random.randint(0, 1000)) for i in xrange(100000) ]
+	return lambda: jsonrpc.common.Response.encode_list(responses)
+
+@benchmark('common.Response.encode_list.raw_100000', items=100000)
+def _encode_list_raw(context):
+	responses = [
+		jsonrpc.common.Response(id=i, result=jsonrpc.jsonutil.RawJSON(jsonrpc.jsonutil.encode(context.random.randint(0, 1000))))
+			for i in xrange(100000)
+	]
+	return lambda: jsonrpc.common.Response.encode_list(responses)
+
+
+## server, in memory
+
+@defer.inlineCallbacks
+def _render(resource, body, loops):
+	start = timeit.default_timer()
+	for _ in xrange(loops):
+		yield render(resource, body)
+	defer.returnValue(timeit.default_timer() - start)
+
+def _render_timer(context, body):
+	resource = JSON_RPC().customize(QuietServer)
+	return lambda loops: context.call(_render, resource, body, loops)
+
+@benchmark('server.render.call', timed=True)
+def _render_call(context):
+	return _render_timer(context, jsonrpc.jsonutil.encode(context.calls(1)[0]))
+
+for _size in (1, 100, 10000, 100000):
+	def _render_batch(context, size=_size):
+		return _render_timer(context, jsonrpc.jsonutil.encode(context.calls(size)))
+	benchmark('server.render.batch_%d' % _size, items=_size, timed=True)(_render_batch)
+
+
+## client and server over loopback
+
+@benchmark('loopback.call')
+def _loopback_call(context):
+	proxy = context.proxy
+	return lambda: proxy.add(1, 2)
+
+for _size in (1, 100, 10000):
+	def _loopback_batch(context, size=_size):
+		proxy = context.proxy
+		methods = [ (call['method'], (call['params'], {})) for call in context.calls(size) ]
+		return lambda: proxy.batch_call(methods)
+	benchmark('loopback.batch_%d' % _size, items=_size)(_loopback_batch)
+
+
+## client
+
+class CannedProxy(JSONRPCProxy):
+	'''Answers every call with the same response, to time the proxy on its own'''
+	def _post(self, url, data):
+		return StringIO.StringIO('{"jsonrpc": "2.0", "id": 1, "result": 3}')
+
+@benchmark('proxy.call')
+def _proxy_call(context):
+	proxy = CannedProxy('http://127.0.0.1:1', path='')
+	return lambda: proxy.add(1, 2)
+
+
+def measure(timer, repeat=5, min_time=0.2):
+	'''Time an operation: find how many loops last at least min_time seconds, then time that many loops `repeat` times
+
+	:returns: dict of the seconds per operation, and how it was measured'''
+	loops = 1
+	while True:
+		elapsed = timer(loops)
+		if elapsed >= min_time or loops >= 1 << 24: break
+		loops = max(loops * 2, int(loops * min_time / max(elapsed, 1e-9) * 1.1))
+
+	enabled = gc.isenabled()
+	gc.disable()
+	try:
+		times = sorted(timer(loops) / loops for _ in xrange(repeat))
+	finally:
+		if enabled: gc.enable()
+
+	mean = sum(times) / len(times)
+	return dict(
+		seconds=times[len(times) // 2], best=times[0], mean=mean,
+		stdev=(sum((t - mean) ** 2 for t in times) / len(times)) ** 0.5,
+		repeat=repeat, loops=loops,
+	)
+
+def environment():
+	''':returns: a dict describing what the benchmarks ran on'''
+	try:
+		revision = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(__file__),
+			stderr=open(os.devnull, 'w')).strip()
+	except (OSError, subprocess.CalledProcessError):
+		revision = None
+	return dict(
+		python=platform.python_version(), implementation=platform.python_implementation(),
+		platform=platform.platform(), machine=platform.machine(), host=platform.node(),
+		twisted=twisted.__version__, jsonrpc=jsonrpc.__version__,
+		json_backend=jsonrpc.jsonutil.get_backend().name, revision=revision,
+		time=time.strftime('%Y-%m-%dT%H:%M:%S'),
+	)
+
+def run(names=None, repeat=5, min_time=0.2, seed=0, out=sys.stdout):
+	'''Run the benchmarks, or those named, printing each result as it is ready
+
+	:returns: a dict with 'environment' and 'benchmarks' items'''
+	context = Context(seed)
+	results = collections.OrderedDict()
+	try:
+		for name, (setup, items, timed) in BENCHMARKS.items():
+			if names is not None and name not in names: continue
+			# each benchmark gets the same payloads whichever others run
+			context.random.seed(seed ^ zlib.crc32(name))
+			timer = setup(context)
+			if not timed: timer = _timer(timer)
+			result = measure(timer, repeat, min_time)
+			result['items'] = items
+			results[name] = result
+			print('%-42s %14.3f us %12.3f us/item' % (name, result['seconds'] * 1e6, result['seconds'] * 1e6 / items), file=out)
+	finally:
+		context.stop()
+	return dict(environment=environment(), options=dict(repeat=repeat, min_time=min_time, seed=seed), benchmarks=results)
+
+def compare(old, new, out=sys.stdout):
+	'''Print how the median times of new compare to those of old, both results of :py:func:`run`'''
+	print('%-42s %14s %14s %8s' % ('', 'old us', 'new us', 'change'), file=out)
+	for name, result in new['benchmarks'].items():
+		before = old['benchmarks'].get(name)
+		if before is None: continue
+		change = result['seconds'] / before['seconds'] - 1
+		print('%-42s %14.3f %14.3f %+7.1f%%' % (name, before['seconds'] * 1e6, result['seconds'] * 1e6, change * 100), file=out)
+
+if __name__ == '__main__':
+	import argparse
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('-o', '--output', help='write the results to this JSON file')
+	parser.add_argument('-c', '--compare', help='compare the results with those in this JSON file')
+	parser.add_argument('-k', '--filter', help='only run the benchmarks whose names match this regular expression')
+	parser.add_argument('-r', '--repeat', type=int, default=5)
+	parser.add_argument('-t', '--min-time', type=float, default=0.2, help='seconds each timing lasts at least')
+	parser.add_argument('-s', '--seed', type=int, default=0)
+	parser.add_argument('-l', '--list', action='store_true', help='list the benchmarks')
+	args = parser.parse_args()
+
+	names = list(BENCHMARKS)
+	if args.filter: names = [name for name in names if re.search(args.filter, name)]
+	if args.list:
+		print('\n'.join(names))
+		sys.exit()
+
+	results = run(names, args.repeat, args.min_time, args.seed)
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump(results, f, indent=2)
+	if args.compare:
+		with open(args.compare) as f:
+			compare(json.load(f), results)
@@ -0,0 +1,162 @@
+#
+#  Copyright (c) 2011 Edward Langley
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#  Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+#  Redistributions in binary form must reproduce the above copyright
+#  notice, this list of conditions and the following disclaimer in the
+#  documentation and/or other materials provided with the distribution.
+#
+#  Neither the name of the project's author nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+#  TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+#  LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+#  NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#  SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+'''An LRU cache with expiry for the encoded results of :py:func:`jsonrpc.server.cacheable` methods
+
+Entries are keyed on the method name and the parameters, encoded with :py:func:`jsonrpc.jsonutil.canonical`
+so that params which are equal give the same key.  The least recently used entries are dropped when the cache
+holds too many entries or too many bytes.
+'''
+import time
+import threading
+import collections
+
+import jsonrpc.jsonutil
+from jsonrpc.utilities import public
+
+@public
+class ResultCache(object):
+	'''Encoded results by (method, params)
+
+	It may be used from any thread; :py:meth:`invalidate` is typically called from inside methods.
+
+	:param max_entries: the most entries kept, None for no limit
+	:param max_bytes: the most bytes of keys and results kept, None for no limit
+	:param clock: returns the time in seconds, for testing'''
+
+	def __init__(self, max_entries=1024, max_bytes=16 << 20, clock=time.time):
+		self.max_entries = max_entries
+		self.max_bytes = max_bytes
+		self.clock = clock
+
+		# key -> (data, expires, size), oldest first
+		self._entries = collections.OrderedDict()
+		# method name -> set of keys, so that a method's entries can be dropped together
+		self._bymethod = {}
+		self._lock = threading.Lock()
+
+		#: the bytes held
+		self.size = 0
+		self.hits = self.misses = self.evictions = self.expirations = 0
+
+	@staticmethod
+	def key(method, args=(), kwargs=None):
+		'''The key a call is cached under'''
+		return method, jsonrpc.jsonutil.canonical([args, kwargs or {}])
+
+	def get(self, key):
+		'''Look a result up, counting a hit or a miss
+
+		:returns: the encoded result, or None if it isn't cached or has expired'''
+		with self._lock:
+			entry = self._entries.pop(key, None)
+			if entry is None:
+				self.misses += 1
+				return None
+
+			data, expires, size = entry
+			if expires is not None and expires <= self.clock():
+				self._forget(key, size, popped=True)
+				self.expirations += 1
+				self.misses += 1
+				return None
+
+			# reinserting moves it to the recently used end
+			self._entries[key] = entry
+			self.hits += 1
+			return data
+
+	def set(self, key, data, ttl=None):
+		'''Store an encoded result for ttl seconds, or until it is evicted if ttl is None.
+		Results too large to fit at all aren't stored.'''
+		size = len(key[0]) + len(key[1]) + len(data)
+		if self.max_bytes is not None and size > self.max_bytes: return
+		expires = None if ttl is None else self.clock() + ttl
+
+		with self._lock:
+			old = self._entries.pop(key, None)
+			if old is not None: self.size -= old[2]
+
+			self._entries[key] = (data, expires, size)
+			self._bymethod.setdefault(key[0], set()).add(key)
+			self.size += size
+
+			while self._entries and (
+					(self.max_entries is not None and len(self._entries) > self.max_entries) or
+					(self.max_bytes is not None and self.size > self.max_bytes)):
+				oldkey, (_, _, oldsize) = self._entries.popitem(last=False)
+				self._forget(oldkey, oldsize, popped=True)
+				self.evictions += 1
+
+	def invalidate(self, method=None, key=None):
+		'''Drop cached results: all of them, those of a method, or the one under key
+
+		:returns: the number of entries dropped'''
+		with self._lock:
+			if method is None:
+				count = len(self._entries)
+				self._entries.clear()
+				self._bymethod.clear()
+				self.size = 0
+				return count
+
+			if key is not None:
+				keys = [key]
+			else:
+				keys = list(self._bymethod.get(method, ()))
+
+			count = 0
+			for key in keys:
+				entry = self._entries.get(key)
+				if entry is not None:
+					self._forget(key, entry[2])
+					count += 1
+			return count
+
+	def _forget(self, key, size, popped=False):
+		if not popped: self._entries.pop(key, None)
+		self.size -= size
+		keys = self._bymethod.get(key[0])
+		if keys is not None:
+			keys.discard(key)
+			if not keys: del self._bymethod[key[0]]
+
+	def __len__(self):
+		return len(self._entries)
+
+	def stats(self):
+		'''The counters and the current size of the cache
+
+		:returns: dict'''
+		with self._lock:
+			return dict(hits=self.hits, misses=self.misses, evictions=self.evictions,
+				expirations=self.expirations, entries=len(self._entries), bytes=self.size)
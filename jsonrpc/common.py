@@ -71,16 +71,40 @@ class MethodNotFound(RPCError):
 	code = -32601
 	msg = "Procedure not found."
 
+@public
+class InvalidParams(RPCError):
+	'''Raise this when the params don't fit the method's signature'''
+	code = -32602
+	msg = "Invalid params."
+
+	def __init__(self, detail=None):
+		if detail is not None:
+			self.msg = '{0} {1}'.format(self.msg, detail)
+
 @public
 class ParseError(RPCError):
 	'''Raise this when the request contains invalid JSON'''
 	code = -32700
 	msg = "Parse error."
 
+@public
+class ServerBusy(RPCError):
+	'''Raised when the server has too many calls waiting to accept another one'''
+	code = -32000
+	msg = "Server busy."
+
+@public
+class RequestTooLarge(RPCError):
+	'''Raised when the request body or the batch is larger than the server accepts'''
+	code = -32001
+	msg = "Request too large."
+
 codemap = {0: RPCError}
 codemap.update( (e.code, e) for e in RPCError.__subclasses__() )
 
-class JsonInstantiate:
+class JsonInstantiate(object):
+	__slots__ = ()
+
 	@classmethod
 	def from_json(cls, json):
 		data = json
@@ -97,7 +121,20 @@ class JsonInstantiate:
 		return [cls.from_dict(r) for r in responses]
 
 
-class Request(object, JsonInstantiate):
+#: the members of a request object defined by the spec
+_MEMBERS = frozenset(['jsonrpc', 'id', 'method', 'params'])
+
+
+class Request(JsonInstantiate):
+	'''A JSON-RPC request
+
+	:py:attr:`extra` holds the top level members which aren't part of the spec, the server passes them
+	to the method as keyword arguments.  It is not copied for each call, so treat it as read only.
+	The same goes for :py:attr:`kwargs` of a request made by :py:meth:`from_dict`, which is usually the
+	params of the decoded request.  Their names may be unicode, which Python 2.7 accepts as keyword
+	arguments.'''
+	__slots__ = ('version', 'id', 'method', 'args', 'kwargs', 'extra')
+
 	def __init__(self, id, method, args=None, kwargs=None, extra=None, version='2.0'):
 		self.version = version
 		self.id = id
@@ -108,23 +145,19 @@ class Request(object, JsonInstantiate):
 
 	@classmethod
 	def from_dict(cls, content):
-		version = content.pop('jsonrpc', None)
-		id = content.pop('id', None)
-
-		method = content.pop('method', None)
-
-		kwargs = content.pop('params', {})
-		args = ()
+		'''Make a request from a decoded request object, without changing or copying it'''
+		get = content.get
+		args, kwargs = (), get('params', {})
 		if not isinstance(kwargs, dict):
-			args = tuple(kwargs)
-			kwargs = {}
-		else:
-			args = kwargs.pop('__args', args)
+			args, kwargs = tuple(kwargs), {}
+		elif '__args' in kwargs:
+			args = kwargs['__args']
+			kwargs = dict( (k, v) for k, v in kwargs.iteritems() if k != '__args' )
 
-		args = args
-		kwargs = dict( (str(k), v) for k,v in kwargs.items() )
-		extra = content
-		return cls(id, method, args, kwargs, extra, version)
+		extra = None
+		if not _MEMBERS.issuperset(content):
+			extra = dict( (k, v) for k, v in content.iteritems() if k not in _MEMBERS )
+		return cls(get('id'), get('method'), args, kwargs, extra, get('jsonrpc'))
 
 
 	def check(self):
@@ -141,8 +174,8 @@ class Request(object, JsonInstantiate):
 
 		params = self.args
 		if self.args and self.kwargs:
-			self.kwargs['__args'] = self.args
-		if self.kwargs:
+			params = dict(self.kwargs, __args=self.args)
+		elif self.kwargs:
 			params = self.kwargs
 
 		return dict(
@@ -154,7 +187,13 @@ class Request(object, JsonInstantiate):
 
 
 
-class Response(object, JsonInstantiate):
+class Response(JsonInstantiate):
+	'''A JSON-RPC response
+
+	The result may be a :py:class:`jsonrpc.jsonutil.RawJSON` holding it already encoded, which
+	:py:meth:`encode` writes in as it is.'''
+	__slots__ = ('version', 'id', 'result', 'error')
+
 	def __init__(self, id=None, result=None, error=None, version='2.0'):
 		self.version = version
 		self.id = id
@@ -172,12 +211,33 @@ class Response(object, JsonInstantiate):
 		return cls(id, result, error, version)
 
 	def json_equivalent(self):
-		res = dict(jsonrpc=self.version, id=self.id)
 		if self.error is None:
-			res['result'] = self.result
-		else:
-			res['error'] = self.error
-		return res
+			return {'jsonrpc': self.version, 'id': self.id, 'result': self.result}
+		return {'jsonrpc': self.version, 'id': self.id, 'error': self.error}
+
+	def encode(self):
+		''':returns: the response as UTF-8 encoded JSON'''
+		if self.error is None and isinstance(self.result, jsonrpc.jsonutil.RawJSON):
+			id = self.id
+			# most ids are ints, which don't need the encoder
+			id = str(id) if type(id) in (int, long) else jsonrpc.jsonutil.encode_bytes(id)
+			if self.version == '2.0':
+				return '{"jsonrpc": "2.0", "id": %s, "result": %s}' % (id, self.result)
+			return '{"jsonrpc": %s, "id": %s, "result": %s}' % (
+				jsonrpc.jsonutil.encode_bytes(self.version), id, self.result)
+		return jsonrpc.jsonutil.encode_bytes(self)
+
+	@staticmethod
+	def encode_list(responses):
+		''':returns: a batch of responses as UTF-8 encoded JSON, encoding each one on its own only if
+			one of them has a :py:class:`jsonrpc.jsonutil.RawJSON` result'''
+		for response in responses:
+			if isinstance(getattr(response, 'result', None), jsonrpc.jsonutil.RawJSON):
+				return '[' + ', '.join(
+					response.encode() if isinstance(response, Response) else jsonrpc.jsonutil.encode_bytes(response)
+						for response in responses
+				) + ']'
+		return jsonrpc.jsonutil.encode_bytes(responses)
 
 	def get_result(self):
 		'''get result and raise any errors'''
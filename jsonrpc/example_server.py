@@ -36,7 +36,7 @@ from twisted.internet import reactor, ssl
 from twisted.web import server
 import traceback
 
-from jsonrpc.server import ServerEvents, JSON_RPC
+from jsonrpc.server import ServerEvents, JSON_RPC, expose
 
 class ExampleServer(ServerEvents):
 	# inherited hooks
@@ -50,30 +50,26 @@ class ExampleServer(ServerEvents):
 			msg = self._get_msg(responses)
 			print(txrequest, msg)
 
-	def findmethod(self, method, args=None, kwargs=None):
-		if method in self.methods:
-			return getattr(self, method)
-		else:
-			return None
-
 	# helper methods
-	methods = set(['add', 'subtract'])
 	def _get_msg(self, response):
 		print('response', repr(response))
 		return ' '.join(str(x) for x in [response.id, response.result or response.error])
 
+	@expose
 	def subtract(self, a, b):
 		return a-b
 
+	@expose
 	def add(self, a, b):
 		return a+b
 
-root = JSON_RPC().customize(ExampleServer)
-site = server.Site(root)
+if __name__ == '__main__':
+	root = JSON_RPC().customize(ExampleServer)
+	site = server.Site(root)
 
 
-# 8007 is the port you want to run under. Choose something >1024
-PORT = 8007
-print('Listening on port %d...' % PORT)
-reactor.listenTCP(PORT, site)
-reactor.run()
+	# 8007 is the port you want to run under. Choose something >1024
+	PORT = 8007
+	print('Listening on port %d...' % PORT)
+	reactor.listenTCP(PORT, site)
+	reactor.run()
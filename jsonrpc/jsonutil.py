@@ -45,9 +45,18 @@ it behave like demjson
 - if it is iterable, it will be made into a list
 
 - otherwise 'str' will be called on the object, and that result will be used
+
+Other types can be given a converter with :py:func:`register_encoder`.
+
+The encoding and decoding is done by a backend, see :py:func:`set_backend`.  The backend is
+chosen when the module is imported, from the JSONRPC_JSON_BACKEND environment variable,
+or 'json' (the standard library) if it isn't set.
 """
-__all__ = ['encode', 'decode']
+__all__ = ['encode', 'decode', 'encode_bytes', 'canonical', 'RawJSON', 'iterarray', 'register_encoder', 'Backend', 'register_backend', 'set_backend', 'get_backend', 'backends']
 
+import os
+import re
+import inspect
 import functools
 
 try:
@@ -56,32 +65,255 @@ except ImportError:
 	import simplejson as json
 
 
+_scalars = (basestring, int, long, float, bool, type(None))
+
 def dict_encode(obj):
 	items = getattr(obj, 'iteritems', obj.items)
-	return dict( (encode_(k),encode_(v)) for k,v in items() )
+	return dict( (k if isinstance(k, _scalars) else encode_(k), v) for k,v in items() )
 
 def list_encode(obj):
-	return list(encode_(i) for i in obj)
+	return list(obj)
 
 def safe_encode(obj):
 	'''Always return something, even if it is useless for serialization'''
-	try: json.dumps(obj)
-	except TypeError: obj = str(obj)
+	return str(obj)
+
+def json_equivalent(obj):
+	return obj.json_equivalent()
+
+def identity(obj):
 	return obj
 
+def dynamic_encode(obj):
+	'''For classes which don't define any of the methods, in case the instance provides them'''
+	if hasattr(obj, 'json_equivalent'): func = json_equivalent
+	elif hasattr(obj, 'items'): func = dict_encode
+	elif hasattr(obj, '__iter__'): func = list_encode
+	else: func = safe_encode
+	return func(obj)
+
+# converters registered with register_encoder, and the converter found for each class so far
+_encoders = {}
+_cache = {}
+
+def register_encoder(cls, func):
+	'''Use func(obj) to make instances of cls, and of its subclasses, serializable
+
+	func needs to return something closer to JSON, it doesn't have to convert any objects inside it'''
+	_encoders[cls] = func
+	_cache.clear()
+
+def _resolve(cls):
+	for base in inspect.getmro(cls):
+		if base in _encoders: return _encoders[base]
+
+	if cls in (str, unicode, int, long, float, bool, type(None), dict, list, tuple): return identity
+	elif hasattr(cls, 'json_equivalent'): return json_equivalent
+	elif hasattr(cls, 'items'): return dict_encode
+	elif hasattr(cls, '__iter__'): return list_encode
+	return dynamic_encode
+
 def encode_(obj, **kw):
-	obj = getattr(obj, 'json_equivalent', lambda: obj)()
-	func = lambda x: x
-	if hasattr(obj, 'items'):
-		func = dict_encode
-	elif hasattr(obj, '__iter__'):
-		func = list_encode
-	else:
-		func = safe_encode
+	'''Convert obj one step towards JSON, following the conventions described at the top of this module.
+	The converter is looked up once per class.'''
+	cls = getattr(obj, '__class__', type(obj))
+	try:
+		func = _cache[cls]
+	except KeyError:
+		func = _cache[cls] = _resolve(cls)
 	return func(obj)
 
 
-encode = functools.partial(json.dumps, default=encode_)
-decode = json.loads
+def to_native(obj):
+	'''Convert obj into dicts, lists and scalars, for backends which can't call back into :py:func:`encode_`'''
+	if isinstance(obj, _scalars): return obj
+	elif isinstance(obj, dict):
+		return dict( (k if isinstance(k, _scalars) else to_native(k), to_native(v)) for k,v in obj.iteritems() )
+	elif isinstance(obj, (list, tuple)):
+		return [to_native(i) for i in obj]
+	return to_native(encode_(obj))
+
+
+class Backend(object):
+	'''Base class for the codecs :py:func:`encode` and :py:func:`decode` use
+
+	Subclasses import their library in __init__, raising ImportError if it isn't available,
+	and must follow the conventions described at the top of this module'''
+
+	#: the name to register the backend under
+	name = None
+
+	def dumps(self, obj, **kw):
+		'''Return obj as a JSON str'''
+		raise NotImplementedError
+
+	def dumps_bytes(self, obj):
+		'''Return obj as UTF-8 encoded JSON'''
+		result = self.dumps(obj)
+		if isinstance(result, unicode): result = result.encode('utf-8')
+		return result
+
+	def loads(self, data):
+		raise NotImplementedError
+
+class StdlibBackend(Backend):
+	'''The standard library's json module, or simplejson if it is missing'''
+	name = 'json'
+
+	def __init__(self):
+		self.dumps = functools.partial(json.dumps, default=encode_)
+		self.loads = json.loads
+
+class SimplejsonBackend(StdlibBackend):
+	name = 'simplejson'
+
+	def __init__(self):
+		import simplejson
+		self.dumps = functools.partial(simplejson.dumps, default=encode_)
+		self.loads = simplejson.loads
+
+class UjsonBackend(Backend):
+	'''ujson 2 or later, which needs Python 3.  ujson 1.x rounds floats, so it isn't accepted'''
+	name = 'ujson'
+
+	def __init__(self):
+		import ujson
+		# ujson 1.x rounds floats to at most 15 significant digits
+		if int(ujson.__version__.split('.')[0]) < 2:
+			raise ImportError('ujson >= 2 is required')
+		self.ujson = ujson
+		self.loads = ujson.loads
+
+	def dumps(self, obj, **kw):
+		kw.setdefault('escape_forward_slashes', False)
+		return self.ujson.dumps(to_native(obj), **kw)
+
+class OrjsonBackend(Backend):
+	'''orjson, which needs Python 3.  It only produces bytes, so :py:meth:`dumps_bytes` is the fast one here'''
+	name = 'orjson'
+
+	def __init__(self):
+		import orjson
+		self.orjson = orjson
+		self.loads = orjson.loads
+
+	def dumps_bytes(self, obj):
+		return self.orjson.dumps(obj, default=encode_, option=self.orjson.OPT_NON_STR_KEYS)
+
+	def dumps(self, obj, **kw):
+		return self.dumps_bytes(obj).decode('utf-8')
+
+class RapidjsonBackend(Backend):
+	'''python-rapidjson, which needs Python 3'''
+	name = 'rapidjson'
+
+	def __init__(self):
+		import rapidjson
+		self.rapidjson = rapidjson
+		self.loads = rapidjson.loads
+
+	def dumps(self, obj, **kw):
+		kw.setdefault('mapping_mode', self.rapidjson.MM_COERCE_KEYS_TO_STRINGS)
+		return self.rapidjson.dumps(obj, default=encode_, **kw)
+
+
+_backends = {}
+
+def register_backend(backend):
+	'''Make a :py:class:`Backend` subclass available to :py:func:`set_backend` under its name'''
+	_backends[backend.name] = backend
+	return backend
+
+for _backend in (StdlibBackend, SimplejsonBackend, UjsonBackend, OrjsonBackend, RapidjsonBackend):
+	register_backend(_backend)
+
+def backends():
+	'''Return the names of the registered backends, whether or not they can be used'''
+	return sorted(_backends)
+
+_backend = None
+
+def get_backend():
+	'''Return the :py:class:`Backend` in use'''
+	return _backend
+
+def set_backend(name):
+	'''Use the named backend for :py:func:`encode`, :py:func:`encode_bytes` and :py:func:`decode`
+
+	Code which imported those functions by name keeps using the old backend.
+
+	:raises KeyError: if no backend has that name
+	:raises ImportError: if the backend's library can't be imported'''
+	global _backend, encode, encode_bytes, decode
+	backend = _backends[name]()
+	_backend = backend
+	encode, encode_bytes, decode = backend.dumps, backend.dumps_bytes, backend.loads
+	return backend
+
+set_backend(os.environ.get('JSONRPC_JSON_BACKEND', 'json'))
+
+_whitespace = re.compile(r'[ \t\n\r]*')
+
+def canonical(obj):
+	'''Encode obj the same way every time, whatever the backend: keys sorted and no whitespace.
+	Equal values give equal strings, so the result can be used as a key.'''
+	return json.dumps(obj, sort_keys=True, separators=(',', ':'), default=encode_)
+
+class RawJSON(str):
+	'''A value which has already been encoded, and is written out as it is by the server.
+	The backends don't know about it, they would encode it as a string.'''
+	__slots__ = ()
+
+
+def iterarray(fp, chunksize=65536):
+	'''Decode the JSON array in the file object fp one element at a time, without reading all of it
+
+	:raises ValueError: if the data is not a JSON array'''
+	decoder = json.JSONDecoder()
+	buf, pos, eof, size = '', 0, False, chunksize
+	# what comes next: '[', the first value or ']', a value, ',' or ']'
+	START, FIRST, VALUE, AFTER, END = range(5)
+	state = START
+
+	while True:
+		pos = _whitespace.match(buf, pos).end()
+		if pos == len(buf):
+			if eof:
+				if state != END: raise ValueError('unexpected end of data')
+				return
+			chunk = fp.read(size)
+			eof = not chunk
+			buf, pos = buf[pos:] + chunk, 0
+			continue
+
+		char = buf[pos]
+		if state == START:
+			if char != '[': raise ValueError('expected a JSON array')
+			state, pos = FIRST, pos+1
+		elif state == END:
+			raise ValueError('extra data after the array')
+		elif char == ']' and state in (FIRST, AFTER):
+			state, pos = END, pos+1
+		elif state == AFTER:
+			if char != ',': raise ValueError("expected ',' or ']'")
+			state, pos = VALUE, pos+1
+		else:
+			try:
+				value, end = decoder.raw_decode(buf, pos)
+			except ValueError:
+				end = None
+
+			# a value which runs to the end of what has been read so far may be cut short, e.g. a number
+			if end is None or (end == len(buf) and not eof):
+				if eof: raise ValueError('invalid JSON value in the array')
+				chunk = fp.read(size)
+				eof = not chunk
+				buf, pos = buf[pos:] + chunk, 0
+				# read more at a time, so that a large value isn't decoded over and over
+				size *= 2
+				continue
+
+			yield value
+			state, pos, size = AFTER, end, chunksize
 
 __version__ = "$Revision: 1.2 $".split(":")[1][:-1].strip()
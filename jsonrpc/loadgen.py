@@ -0,0 +1,277 @@
+from __future__ import print_function
+#
+#  Copyright (c) 2011 Edward Langley
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#  Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+#  Redistributions in binary form must reproduce the above copyright
+#  notice, this list of conditions and the following disclaimer in the
+#  documentation and/or other materials provided with the distribution.
+#
+#  Neither the name of the project's author nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+#  TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+#  LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+#  NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#  SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+'''A load generator for JSON-RPC servers, run with ``python -m jsonrpc load URL``
+
+It sends a mix of single calls and batch requests to one method, either closed loop, with a fixed
+number of clients each making its next request when the last one is answered, or open loop, starting
+requests at a fixed rate whether or not earlier ones have been answered.  It reports the throughput,
+the latency percentiles of each kind of request, and the JSON-RPC errors by code, apart from
+transport errors.
+
+For example, against :py:mod:`jsonrpc.example_server`:
+
+	% python -m jsonrpc load http://localhost:8007/jsonrpc -c 32 -d 30 --batch-fraction 0.1 --batch-size 50
+	% python -m jsonrpc load http://localhost:8007/jsonrpc --rate 2000 -d 30
+'''
+import sys
+import json
+import random
+import argparse
+import collections
+
+from twisted.internet import defer, reactor, task
+
+import jsonrpc.common
+from jsonrpc.utilities import public
+from jsonrpc.proxy import ProxyEvents
+from jsonrpc.asyncproxy import TxJSONRPCProxy
+
+#: the percentiles reported
+PERCENTILES = (50, 90, 99, 99.9)
+
+@public
+def percentile(values, p):
+	'''The nearest-rank p-th percentile of a sorted list'''
+	if not values: return None
+	rank = int(len(values) * p / 100.0 + 0.5)
+	return values[min(max(rank, 1), len(values)) - 1]
+
+def substitute(params, payload):
+	'''Replace the strings '$payload' in params, at any depth, with payload'''
+	if params == '$payload': return payload
+	elif isinstance(params, list): return [substitute(item, payload) for item in params]
+	elif isinstance(params, dict): return dict( (k, substitute(v, payload)) for k, v in params.items() )
+	return params
+
+@public
+class LoadStats(object):
+	'''What happened to the requests of a run'''
+	def __init__(self):
+		self.start = self.end = None
+		#: kind ('call' or 'batch') -> list of request latencies in seconds
+		self.latencies = collections.defaultdict(list)
+		self.calls = 0
+		#: JSON-RPC error code -> count, for calls answered with an error
+		self.errors = collections.Counter()
+		#: exception class name -> count, for requests which got no JSON-RPC response
+		self.failures = collections.Counter()
+		#: open loop requests not started because too many were in flight
+		self.dropped = 0
+
+	def record(self, kind, latency, calls, codes=()):
+		self.latencies[kind].append(latency)
+		self.calls += calls
+		self.errors.update(codes)
+
+	def summary(self):
+		''':returns: a dict of the totals, rates and latency percentiles, in seconds'''
+		elapsed = (self.end - self.start) if self.start is not None else 0
+		requests = sum(len(values) for values in self.latencies.values())
+		latency = {}
+		for kind, values in sorted(self.latencies.items()) + [('all', sum(self.latencies.values(), []))]:
+			values = sorted(values)
+			if not values: continue
+			latency[kind] = dict(('p%s' % p, percentile(values, p)) for p in PERCENTILES)
+			latency[kind].update(count=len(values), mean=sum(values) / len(values), max=values[-1])
+		return dict(
+			elapsed=elapsed, requests=requests, calls=self.calls,
+			requests_per_second=requests / elapsed if elapsed else None,
+			calls_per_second=self.calls / elapsed if elapsed else None,
+			errors=dict(self.errors), failures=dict(self.failures), dropped=self.dropped, latency=latency,
+		)
+
+def report(summary, out=sys.stdout):
+	'''Print a summary from :py:meth:`LoadStats.summary`'''
+	print('%d requests, %d calls in %.2fs' % (summary['requests'], summary['calls'], summary['elapsed']), file=out)
+	if summary['elapsed']:
+		print('%.1f requests/s, %.1f calls/s' % (summary['requests_per_second'], summary['calls_per_second']), file=out)
+	columns = ['p%s' % p for p in PERCENTILES] + ['max']
+	print('%-8s %8s' % ('latency', 'count') + ''.join('%10s' % c for c in columns), file=out)
+	for kind in ('call', 'batch', 'all'):
+		row = summary['latency'].get(kind)
+		if row is None: continue
+		print('%-8s %8d' % (kind, row['count']) + ''.join('%8.2fms' % (row[c] * 1000) for c in columns), file=out)
+	for code, count in sorted(summary['errors'].items()):
+		print('error %s: %d calls' % (code, count), file=out)
+	for name, count in sorted(summary['failures'].items()):
+		print('failed %s: %d requests' % (name, count), file=out)
+	if summary['dropped']:
+		print('dropped: %d requests' % summary['dropped'], file=out)
+
+@public
+class LoadGenerator(object):
+	'''Drive a server with calls to one method through a :py:class:`jsonrpc.asyncproxy.TxJSONRPCProxy`
+
+	:param proxy: the proxy, e.g. from :py:func:`make_proxy`
+	:param method: the method called
+	:param params: a list or dict of params
+	:param concurrency: the number of clients, or for an open loop the most requests in flight
+	:param duration: seconds to start requests for
+	:param rate: start this many requests a second (open loop), None for a closed loop
+	:param batch_fraction: the fraction of requests which are batches
+	:param batch_size: the calls in each batch
+	:param seed: seeds the choice between calls and batches'''
+	def __init__(self, proxy, method, params=(), concurrency=10, duration=10, rate=None,
+			batch_fraction=0, batch_size=10, seed=0):
+		self.proxy = proxy
+		self.method = method
+		self.params = params
+		self.concurrency = concurrency
+		self.duration = duration
+		self.rate = rate
+		self.batch_fraction = batch_fraction
+		self.batch_size = batch_size
+		self.random = random.Random(seed)
+
+		if isinstance(params, dict):
+			self._call = (), params
+		else:
+			self._call = tuple(params), {}
+		self._batch = [ (method, self._call) ] * batch_size
+		self._inflight = 0
+		self.stats = LoadStats()
+
+	def run(self):
+		''':returns: a Deferred firing with the :py:class:`LoadStats` once all the requests are answered'''
+		self.stats.start = reactor.seconds()
+		self._deadline = self.stats.start + self.duration
+		d = self._open() if self.rate else self._closed()
+		@d.addCallback
+		def _done(_):
+			self.stats.end = reactor.seconds()
+			return self.stats
+		return d
+
+	def _closed(self):
+		@defer.inlineCallbacks
+		def client():
+			while reactor.seconds() < self._deadline:
+				yield self._request()
+		return defer.gatherResults([client() for _ in xrange(self.concurrency)])
+
+	def _open(self):
+		pending = []
+		def tick(count):
+			for _ in xrange(count):
+				if self._inflight >= self.concurrency:
+					self.stats.dropped += 1
+				else:
+					pending.append(self._request())
+			if reactor.seconds() >= self._deadline: loop.stop()
+		loop = task.LoopingCall.withCount(tick)
+		d = loop.start(1.0 / self.rate, now=True)
+		d.addCallback(lambda _: defer.DeferredList(pending))
+		return d
+
+	def _request(self):
+		'''Make a request, recording it once it is answered
+
+		:returns: a Deferred which never fails'''
+		self._inflight += 1
+		start = reactor.seconds()
+		if self.batch_fraction and self.random.random() < self.batch_fraction:
+			d = self.proxy.batch_call(self._batch)
+			d.addCallback(self._cbBatch, start)
+		else:
+			args, kwargs = self._call
+			d = self.proxy.call(self.method, *args, **kwargs)
+			d.addCallbacks(self._cbCall, self._ebCall, (start,), None, (start,))
+		d.addErrback(self._ebRequest)
+		return d
+
+	def _done(self):
+		self._inflight -= 1
+		return reactor.seconds()
+
+	def _cbCall(self, _, start):
+		self.stats.record('call', self._done() - start, 1)
+
+	def _ebCall(self, failure, start):
+		failure.trap(jsonrpc.common.RPCError)
+		self.stats.record('call', self._done() - start, 1, [failure.value.code])
+
+	def _cbBatch(self, outputs, start):
+		codes = [ error.get('code') for _, error in outputs if error is not None ]
+		self.stats.record('batch', self._done() - start, len(outputs), codes)
+
+	def _ebRequest(self, failure):
+		self._done()
+		self.stats.failures[failure.type.__name__] += 1
+
+@public
+def make_proxy(url, concurrency):
+	''':returns: a :py:class:`jsonrpc.asyncproxy.TxJSONRPCProxy` for url, keeping a connection open for each client'''
+	events = type('LoadEvents', (ProxyEvents,), dict(pool_size=concurrency))
+	cls = type('LoadProxy', (TxJSONRPCProxy,), dict(_eventhandler=events))
+	return cls.from_url(url)
+
+def main(argv=None):
+	'''The ``load`` (or ``bench``) command of ``python -m jsonrpc``
+
+	:returns: the exit status, 1 if no call got a result'''
+	parser = argparse.ArgumentParser(prog='python -m jsonrpc load', description=__doc__,
+		formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('url', help='the URL of the JSON-RPC server')
+	parser.add_argument('-m', '--method', default='add', help='the method called, add by default')
+	parser.add_argument('-p', '--params', default='[1, 2]', type=json.loads,
+		help="the params, as JSON.  Strings '$payload' are replaced by the payload")
+	parser.add_argument('-s', '--payload-size', type=int, default=0, help='the length of the payload string')
+	parser.add_argument('-c', '--concurrency', type=int, default=10,
+		help='clients, or for an open loop the most requests in flight')
+	parser.add_argument('-d', '--duration', type=float, default=10, help='seconds to send requests for')
+	parser.add_argument('-r', '--rate', type=float, help='requests per second, for an open loop')
+	parser.add_argument('-b', '--batch-fraction', type=float, default=0, help='the fraction of requests which are batches')
+	parser.add_argument('-n', '--batch-size', type=int, default=10, help='the calls in each batch')
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--json', action='store_true', help='print the results as JSON')
+	args = parser.parse_args(argv)
+
+	proxy = make_proxy(args.url, args.concurrency)
+	generator = LoadGenerator(proxy, args.method, substitute(args.params, 'x' * args.payload_size),
+		args.concurrency, args.duration, args.rate, args.batch_fraction, args.batch_size, args.seed)
+
+	result = []
+	d = generator.run()
+	d.addCallback(lambda stats: result.append(stats.summary()))
+	d.addErrback(lambda failure: failure.printTraceback())
+	d.addBoth(lambda _: proxy.close())
+	d.addBoth(lambda _: reactor.stop())
+	reactor.run()
+
+	if not result: return 1
+	if args.json:
+		print(json.dumps(result[0], indent=2, sort_keys=True))
+	else:
+		report(result[0])
+	return 0 if result[0]['calls'] > sum(result[0]['errors'].values()) else 1
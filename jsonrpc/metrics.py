@@ -0,0 +1,279 @@
+#
+#  Copyright (c) 2011 Edward Langley
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#  Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+#  Redistributions in binary form must reproduce the above copyright
+#  notice, this list of conditions and the following disclaimer in the
+#  documentation and/or other materials provided with the distribution.
+#
+#  Neither the name of the project's author nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+#  TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+#  LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+#  NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#  SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+'''Counts and latency histograms of the calls a :py:class:`jsonrpc.server.JSON_RPC` server handles
+
+The server fills in a :py:class:`Metrics`, see :py:attr:`jsonrpc.server.ServerEvents.metrics`.
+:py:meth:`jsonrpc.server.ServerEvents.stats` reads it, and :py:class:`MetricsResource` serves it
+in the Prometheus text format, e.g.
+
+	root = Resource()
+	rpc = JSON_RPC().customize(MyEvents)
+	root.putChild('jsonrpc', rpc)
+	root.putChild('metrics', MetricsResource(rpc))
+
+Calls are timed in two phases: 'queue', the wait for a thread (and for a
+:py:func:`jsonrpc.server.concurrency_limit`), and 'execute', the method itself, up to the result of an
+asynchronous one.  Requests are timed as a whole, and in the 'parse' and 'encode' phases.  Latencies are in seconds.
+'''
+import bisect
+import threading
+
+from twisted.web.resource import Resource
+
+from jsonrpc.utilities import public
+
+#: the upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+#: the method name recorded for calls to methods which don't exist, so that they don't add a series each
+UNKNOWN = '(unknown)'
+
+class _NoLock(object):
+	def __enter__(self): pass
+	def __exit__(self, *exc_info): pass
+
+@public
+class Histogram(object):
+	'''Counts of observations by bucket, like a Prometheus histogram
+
+	:param bool threadsafe: take a lock for each observation, for histograms updated from several threads'''
+	__slots__ = ('bounds', 'counts', 'sum', '_lock')
+
+	def __init__(self, bounds=BUCKETS, threadsafe=False):
+		self.bounds = tuple(bounds)
+		# the last one counts the observations larger than all the bounds
+		self.counts = [0] * (len(self.bounds) + 1)
+		self.sum = 0.0
+		self._lock = threading.Lock() if threadsafe else _NoLock()
+
+	def observe(self, value):
+		with self._lock:
+			self.counts[bisect.bisect_left(self.bounds, value)] += 1
+			self.sum += value
+
+	def snapshot(self):
+		''':returns: dict(buckets=[(bound, cumulative count), ...], count=, sum=), the last bound is infinite'''
+		with self._lock:
+			counts, total = list(self.counts), self.sum
+		buckets, running = [], 0
+		for bound, count in zip(self.bounds + (float('inf'),), counts):
+			running += count
+			buckets.append( (bound, running) )
+		return dict(buckets=buckets, count=running, sum=total)
+
+
+class _MethodMetrics(object):
+	__slots__ = ('calls', 'errors', 'cache_hits', 'queue', 'execute')
+
+	def __init__(self, bounds):
+		self.calls = self.errors = self.cache_hits = 0
+		self.queue = Histogram(bounds)
+		self.execute = Histogram(bounds)
+
+
+@public
+class Metrics(object):
+	'''Per method counts, in flight gauges and latency histograms
+
+	Apart from :py:meth:`observe`, it is only updated from the reactor thread.
+
+	:param bounds: the bucket bounds of the histograms, in seconds'''
+
+	#: the request phases timed with :py:meth:`observe`
+	phases = ('parse', 'encode', 'total')
+
+	def __init__(self, bounds=BUCKETS):
+		self.bounds = bounds
+		self.requests = 0
+		self.requests_in_flight = 0
+		# decoding and encoding may be timed in a thread
+		self._phases = dict( (phase, Histogram(bounds, threadsafe=True)) for phase in self.phases )
+		self._methods = {}
+		# calls in progress by the name they were made with, a name is dropped when it gets to 0
+		self._in_flight = {}
+
+	def _method(self, name):
+		try:
+			return self._methods[name]
+		except KeyError:
+			result = self._methods[name] = _MethodMetrics(self.bounds)
+			return result
+
+	def request_started(self, txrequest, clock):
+		'''Count a request as in flight until the response is finished or the client goes away
+
+		:param clock: returns the time in seconds'''
+		self.requests += 1
+		self.requests_in_flight += 1
+		start = clock()
+		def _finished(_):
+			self.requests_in_flight -= 1
+			self._phases['total'].observe(clock() - start)
+		txrequest.notifyFinish().addBoth(_finished)
+
+	def observe(self, phase, seconds):
+		'''Add the duration of a request phase, one of :py:attr:`phases`'''
+		self._phases[phase].observe(seconds)
+
+	def call_started(self, method):
+		self._in_flight[method] = self._in_flight.get(method, 0) + 1
+
+	def call_finished(self, method, error=False, queue=None, execute=None, found=True):
+		'''Count a call which was started with :py:meth:`call_started`
+
+		:param queue: seconds spent waiting for a thread, None if the method wasn't called in one
+		:param execute: seconds spent in the method, None if it wasn't called
+		:param found: False if the method doesn't exist, the call is counted under :py:data:`UNKNOWN`
+			so that made up names don't add a series each'''
+		count = self._in_flight[method] - 1
+		if count: self._in_flight[method] = count
+		else: del self._in_flight[method]
+		self._count(self._method(method if found else UNKNOWN), error, queue, execute)
+
+	def call_rejected(self, method):
+		'''Count a call which was answered with an error without being started, e.g. for invalid params'''
+		self._count(self._method(method), True)
+
+	def _count(self, entry, error, queue=None, execute=None):
+		entry.calls += 1
+		if error: entry.errors += 1
+		if queue is not None: entry.queue.observe(queue)
+		if execute is not None: entry.execute.observe(execute)
+
+	def cache_hit(self, method):
+		'''Count a call answered from :py:attr:`jsonrpc.server.ServerEvents.cache`'''
+		self._method(method).cache_hits += 1
+
+	def stats(self):
+		'''All the counts, gauges and histograms, see :py:meth:`jsonrpc.server.ServerEvents.stats`
+
+		:returns: dict'''
+		phases = dict( (phase, histogram.snapshot()) for phase, histogram in self._phases.items() )
+		requests = dict(count=self.requests, in_flight=self.requests_in_flight, phases=phases)
+
+		methods = {}
+		for name in set(self._methods) | set(self._in_flight):
+			entry = self._methods.get(name) or _MethodMetrics(self.bounds)
+			methods[name] = dict(calls=entry.calls, errors=entry.errors, cache_hits=entry.cache_hits,
+				in_flight=self._in_flight.get(name, 0), queue=entry.queue.snapshot(), execute=entry.execute.snapshot())
+		return dict(requests=requests, methods=methods)
+
+
+def _label(value):
+	value = unicode(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+	return value.encode('utf-8')
+
+def _number(value):
+	if value == float('inf'): return '+Inf'
+	return repr(value)
+
+def _histogram(lines, name, labels, histogram):
+	for bound, count in histogram['buckets']:
+		lines.append('%s_bucket{%sle="%s"} %d' % (name, labels, _number(bound), count))
+	lines.append('%s_sum{%s} %s' % (name, labels.rstrip(','), _number(histogram['sum'])))
+	lines.append('%s_count{%s} %d' % (name, labels.rstrip(','), histogram['count']))
+
+@public
+def prometheus(stats):
+	'''Format the result of :py:meth:`jsonrpc.server.ServerEvents.stats` in the Prometheus text format.
+	The 'threadpool' and 'cache' items are optional.
+
+	:returns: str'''
+	lines = []
+	def metric(name, kind, help):
+		lines.append('# HELP %s %s' % (name, help))
+		lines.append('# TYPE %s %s' % (name, kind))
+
+	requests, methods = stats['requests'], sorted(stats['methods'].items())
+
+	metric('jsonrpc_requests_total', 'counter', 'HTTP requests received.')
+	lines.append('jsonrpc_requests_total %d' % requests['count'])
+	metric('jsonrpc_requests_in_flight', 'gauge', 'HTTP requests being handled.')
+	lines.append('jsonrpc_requests_in_flight %d' % requests['in_flight'])
+	metric('jsonrpc_request_seconds', 'histogram', 'Time spent on requests, by phase.')
+	for phase in Metrics.phases:
+		_histogram(lines, 'jsonrpc_request_seconds', 'phase="%s",' % phase, requests['phases'][phase])
+
+	for field, name, kind, help in (
+			('calls', 'jsonrpc_calls_total', 'counter', 'Calls answered, by method.'),
+			('errors', 'jsonrpc_call_errors_total', 'counter', 'Calls answered with an error, by method.'),
+			('cache_hits', 'jsonrpc_call_cache_hits_total', 'counter', 'Calls answered from the cache, by method.'),
+			('in_flight', 'jsonrpc_calls_in_flight', 'gauge', 'Calls in progress, by method.')):
+		metric(name, kind, help)
+		for method, entry in methods:
+			lines.append('%s{method="%s"} %d' % (name, _label(method), entry[field]))
+
+	metric('jsonrpc_call_seconds', 'histogram', 'Time spent on calls, by method and phase.')
+	for method, entry in methods:
+		for phase in ('queue', 'execute'):
+			_histogram(lines, 'jsonrpc_call_seconds', 'method="%s",phase="%s",' % (_label(method), phase), entry[phase])
+
+	pool = stats.get('threadpool')
+	if pool is not None:
+		for field, help in (
+				('threads', 'Threads in the pool.'),
+				('busy', 'Threads running a call.'),
+				('calls', 'THREAD calls handed to the pool, running or waiting for a thread.'),
+				('queued', 'THREAD calls waiting for a thread or a concurrency limit.')):
+			metric('jsonrpc_threadpool_%s' % field, 'gauge', help)
+			lines.append('jsonrpc_threadpool_%s %d' % (field, pool[field]))
+
+	cache = stats.get('cache')
+	if cache is not None:
+		for field, kind, help in (
+				('hits', 'counter', 'Lookups which found a result.'),
+				('misses', 'counter', 'Lookups which found no result.'),
+				('evictions', 'counter', 'Results dropped to make room.'),
+				('expirations', 'counter', 'Results dropped because they expired.'),
+				('entries', 'gauge', 'Results kept.'),
+				('bytes', 'gauge', 'Bytes of results kept.')):
+			name = 'jsonrpc_cache_%s%s' % (field, '_total' if kind == 'counter' else '')
+			metric(name, kind, 'Result cache: ' + help)
+			lines.append('%s %d' % (name, cache[field]))
+
+	return '\n'.join(lines) + '\n'
+
+@public
+class MetricsResource(Resource):
+	'''Serves the stats of a :py:class:`jsonrpc.server.JSON_RPC` server in the Prometheus text format
+
+	:param server: the :py:class:`jsonrpc.server.JSON_RPC` resource'''
+	isLeaf = True
+
+	def __init__(self, server):
+		Resource.__init__(self)
+		self.server = server
+
+	def render_GET(self, request):
+		request.setHeader('content-type', 'text/plain; version=0.0.4; charset=utf-8')
+		return prometheus(self.server.eventhandler.stats())
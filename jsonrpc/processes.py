@@ -0,0 +1,150 @@
+#
+#  Copyright (c) 2011 Edward Langley
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#  Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+#  Redistributions in binary form must reproduce the above copyright
+#  notice, this list of conditions and the following disclaimer in the
+#  documentation and/or other materials provided with the distribution.
+#
+#  Neither the name of the project's author nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+#  TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+#  LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+#  NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#  SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+'''A pool of worker processes for methods with the PROCESS execution policy
+
+Calls and their outcome are shipped to and from the workers with :py:mod:`jsonrpc.jsonutil`,
+so PROCESS methods must be module level functions taking and returning JSON serializable values.
+'''
+import sys
+import signal
+import multiprocessing
+
+from twisted.internet import reactor, defer
+from twisted.python import failure
+
+import jsonrpc.jsonutil
+import jsonrpc.common
+from jsonrpc.utilities import public
+
+@public
+class ProcessError(Exception):
+	'''Raised for an exception in a worker process which isn't a :py:class:`jsonrpc.common.RPCError`'''
+	def __init__(self, message, args=()):
+		Exception.__init__(self, *args)
+		self._message = message
+
+	def __str__(self):
+		return self._message
+
+
+def _initworker():
+	'''Undo the signal handling inherited from the reactor, otherwise Pool.terminate can't stop the workers'''
+	signal.signal(signal.SIGTERM, signal.SIG_DFL)
+	signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+	# interrupting the server shouldn't interrupt the calls in progress
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+	signal.set_wakeup_fd(-1)
+
+def _call(payload):
+	'''Run in a worker: decode the call, make it and encode the outcome.  Nothing is raised,
+	the pool's callback is all that hears of the outcome.'''
+	try:
+		module, name, args, kwargs = jsonrpc.jsonutil.decode(payload)
+		__import__(module)
+		function = getattr(sys.modules[module], name)
+		return jsonrpc.jsonutil.encode(dict(result=function(*args, **kwargs)))
+	except jsonrpc.common.RPCError, e:
+		error = dict(code=e.code, message=e.msg)
+	except Exception, e:
+		error = dict(code=None, message=str(e), data=e.args)
+	try:
+		return jsonrpc.jsonutil.encode(dict(error=error))
+	except Exception:
+		# the args of the exception can be as unencodable as the result
+		return jsonrpc.jsonutil.encode(dict(error=dict(error, data=[repr(arg) for arg in e.args])))
+
+
+@public
+class ProcessPool(object):
+	'''Calls functions in a :py:class:`multiprocessing.Pool`, started on first use
+
+	:param int processes: the number of worker processes, None for one per CPU
+	:param timeout: seconds to wait for a call to finish, None to wait for ever.  A worker which
+		dies takes the call it was running with it, only the timeout ends the wait for that call.
+
+	No thread waits for the calls, the outcome is handed to the reactor by the pool's result handler.'''
+
+	def __init__(self, processes=None, timeout=None):
+		self.processes = processes
+		self.timeout = timeout
+		self.pool = None
+
+	@property
+	def started(self):
+		return self.pool is not None
+
+	def start(self):
+		if self.pool is None:
+			self.pool = multiprocessing.Pool(self.processes, _initworker)
+
+	def stop(self):
+		if self.pool is not None:
+			self.pool.terminate()
+			self.pool.join()
+			self.pool = None
+
+	def call(self, function, args=(), kwargs=None):
+		'''Call function(\*args, \*\*kwargs) in a worker
+
+		:returns: :py:class:`twisted.internet.defer.Deferred` which fires with the result, or fails with
+			:py:class:`ProcessError` if the call times out'''
+		module, name = function.__module__, function.__name__
+		if getattr(sys.modules.get(module), name, None) is not function:
+			raise TypeError('%r is not a module level function, it cannot be called in a worker process' % (function,))
+
+		self.start()
+		payload = jsonrpc.jsonutil.encode([module, name, args, kwargs or {}])
+		d = defer.Deferred()
+		# a call which was cancelled or timed out ignores its late result
+		self.pool.apply_async(_call, (payload,), callback=lambda data: reactor.callFromThread(d.callback, data))
+		if self.timeout is not None:
+			timer = reactor.callLater(self.timeout, d.cancel)
+			d.addBoth(self._timedout, timer, self.timeout)
+		return d.addCallback(self._decode)
+
+	@staticmethod
+	def _timedout(result, timer, timeout):
+		if timer.active():
+			timer.cancel()
+		elif isinstance(result, failure.Failure) and result.check(defer.CancelledError):
+			raise ProcessError('The call did not finish within %s seconds.' % timeout)
+		return result
+
+	def _decode(self, result):
+		result = jsonrpc.jsonutil.decode(result)
+		if 'error' in result:
+			error = result['error']
+			if error['code'] is None:
+				raise ProcessError(error['message'], error['data'])
+			raise jsonrpc.common.codemap.get(error['code'], jsonrpc.common.RPCError).from_dict(error)
+		return result['result']
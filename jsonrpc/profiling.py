@@ -0,0 +1,258 @@
+#
+#  Copyright (c) 2011 Edward Langley
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#  Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+#  Redistributions in binary form must reproduce the above copyright
+#  notice, this list of conditions and the following disclaimer in the
+#  documentation and/or other materials provided with the distribution.
+#
+#  Neither the name of the project's author nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+#  TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+#  LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+#  NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#  SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+'''A sampling profiler for the methods a :py:class:`jsonrpc.server.JSON_RPC` server calls
+
+While a call is being profiled, a background thread looks at the stack of the thread running it every
+:py:attr:`Profiler.interval` seconds.  When the call finishes its samples are kept if it was picked at
+random, see :py:attr:`jsonrpc.server.ServerEvents.profile_sample`, or took longer than
+:py:attr:`jsonrpc.server.ServerEvents.profile_threshold`, and added to those of its method.
+
+The samples can be written as a pstats file, for :py:mod:`pstats` and the tools which read it, or as
+collapsed stacks, one 'caller;callee count' line per stack, the input of flame graph tools.
+Times in the pstats file are estimated from the number of samples, and the call counts are sample counts.
+
+Calls shorter than an interval may not be sampled at all.  Only the part of a method which runs on a
+thread is seen, not what an asynchronous method waits for, and PROCESS methods aren't profiled.
+'''
+import sys
+import time
+import random
+import thread
+import marshal
+import threading
+import collections
+
+from twisted.web.resource import Resource
+
+from jsonrpc.utilities import public
+
+#: the deepest stack recorded, frames nearer the root are dropped
+MAX_DEPTH = 128
+
+class _Call(object):
+	__slots__ = ('method', 'thread', 'frame', 'start', 'sampled', 'samples')
+
+	def __init__(self, method, frame, start, sampled):
+		self.method = method
+		self.thread = thread.get_ident()
+		# the frame of Profiler.call, the stacks recorded start above it
+		self.frame = frame
+		self.start = start
+		self.sampled = sampled
+		self.samples = collections.Counter()
+
+def _label(code):
+	return code.co_filename, code.co_firstlineno, code.co_name
+
+@public
+class Profiler(object):
+	'''Samples the stacks of calls, see the top of this module
+
+	:param sample: the fraction of calls profiled whatever they take, None for none
+	:param threshold: keep the samples of calls which take longer than this many seconds, None to only keep sampled calls
+	:param interval: seconds between samples'''
+
+	def __init__(self, sample=None, threshold=None, interval=0.005):
+		self.sample = sample
+		self.threshold = threshold
+		self.interval = interval
+
+		self._lock = threading.Lock()
+		self._wake = threading.Condition(self._lock)
+		self._active = []
+		self._thread = None
+		self._stopped = False
+		# method -> Counter of stacks, each a tuple of (filename, line, function) from the root
+		self._stacks = {}
+		#: method -> number of calls whose samples were kept
+		self.calls = {}
+
+	def call(self, method, func, args, kwargs):
+		'''Call func(\\*args, \\*\\*kwargs), profiling it if it is picked, and return its result
+
+		:param method: the name the samples are kept under'''
+		sampled = self.sample is not None and random.random() < self.sample
+		if not sampled and self.threshold is None:
+			return func(*args, **kwargs)
+
+		entry = _Call(method, sys._getframe(), time.time(), sampled)
+		self._begin(entry)
+		try:
+			return func(*args, **kwargs)
+		finally:
+			self._end(entry)
+
+	def _begin(self, entry):
+		with self._lock:
+			if self._thread is None:
+				self._thread = threading.Thread(target=self._run, name='jsonrpc-profiler')
+				self._thread.daemon = True
+				self._thread.start()
+			self._active.append(entry)
+			self._wake.notify()
+
+	def _end(self, entry):
+		duration = time.time() - entry.start
+		with self._lock:
+			self._active.remove(entry)
+			if entry.sampled or (self.threshold is not None and duration >= self.threshold):
+				self.calls[entry.method] = self.calls.get(entry.method, 0) + 1
+				self._stacks.setdefault(entry.method, collections.Counter()).update(entry.samples)
+
+	def _run(self):
+		while True:
+			with self._lock:
+				while not self._active and not self._stopped:
+					self._wake.wait()
+				if self._stopped: return
+				self._sample()
+			time.sleep(self.interval)
+
+	def _sample(self):
+		frames = sys._current_frames()
+		for entry in self._active:
+			frame = frames.get(entry.thread)
+			stack = []
+			while frame is not None and frame is not entry.frame:
+				stack.append(_label(frame.f_code))
+				frame = frame.f_back
+			# skip calls which haven't got into func yet, or are on their way out
+			if stack and frame is not None and stack[-1] != _END:
+				del stack[MAX_DEPTH:]
+				stack.reverse()
+				entry.samples[tuple(stack)] += 1
+
+	def stop(self):
+		'''Stop the sampling thread, it is started again by the next profiled call'''
+		with self._lock:
+			self._stopped = True
+			self._wake.notify()
+			sampler, self._thread = self._thread, None
+		if sampler is not None: sampler.join()
+		self._stopped = False
+
+	def reset(self):
+		'''Forget the samples kept so far'''
+		with self._lock:
+			self._stacks.clear()
+			self.calls.clear()
+
+	def stacks(self, method=None):
+		''':returns: a Counter of the stacks sampled for method, or for all methods if it is None'''
+		with self._lock:
+			if method is not None:
+				return collections.Counter(self._stacks.get(method, ()))
+			result = collections.Counter()
+			for stacks in self._stacks.values():
+				result.update(stacks)
+			return result
+
+	def collapsed(self, method=None):
+		'''The samples as collapsed stacks, one 'root;...;leaf count' line per stack
+
+		:returns: str'''
+		lines = []
+		for stack, count in sorted(self.stacks(method).items()):
+			frames = ';'.join('%s (%s:%d)' % (name, filename, line) for filename, line, name in stack)
+			lines.append('%s %d' % (frames, count))
+		return ''.join(line + '\n' for line in lines)
+
+	def pstats(self, method=None):
+		'''The samples in the form of the stats of :py:mod:`cProfile`, what :py:func:`marshal.dump`
+		writes to a pstats file
+
+		:returns: dict'''
+		stats = {}
+		def add(func, calls, own, total):
+			cc, nc, tt, ct, callers = stats.get(func) or (0, 0, 0.0, 0.0, {})
+			stats[func] = (cc + calls, nc + calls, tt + own, ct + total, callers)
+
+		for stack, count in self.stacks(method).items():
+			seconds = count * self.interval
+			# a recursive function counts once towards its cumulative time
+			seen = set()
+			for depth, func in enumerate(stack):
+				leaf = depth == len(stack) - 1
+				add(func, count, seconds if leaf else 0.0, 0.0 if func in seen else seconds)
+				if depth:
+					callers = stats[func][4]
+					nc, cc, tt, ct = callers.get(stack[depth-1], (0, 0, 0.0, 0.0))
+					callers[stack[depth-1]] = (nc + count, cc + count, tt + (seconds if leaf else 0.0), ct + seconds)
+				seen.add(func)
+		return stats
+
+	def dump(self, path, method=None, format='pstats'):
+		'''Write the samples of method, or of all methods, to a file
+
+		:param format: 'pstats' for a file :py:class:`pstats.Stats` can load, 'collapsed' for collapsed stacks'''
+		if format == 'collapsed':
+			with open(path, 'w') as f:
+				f.write(self.collapsed(method))
+		elif format == 'pstats':
+			with open(path, 'wb') as f:
+				marshal.dump(self.pstats(method), f)
+		else:
+			raise ValueError('unknown format: %r' % (format,))
+
+_END = _label(Profiler._end.__func__.__code__)
+
+@public
+class ProfileResource(Resource):
+	'''Serves the samples of the :py:attr:`jsonrpc.server.ServerEvents.profiler` of a server
+
+	GET takes the query arguments 'method', for the samples of one method, and 'format', 'collapsed'
+	(the default) or 'pstats' for the content of a pstats file.
+
+	:param server: the :py:class:`jsonrpc.server.JSON_RPC` resource'''
+	isLeaf = True
+
+	def __init__(self, server):
+		Resource.__init__(self)
+		self.server = server
+
+	def render_GET(self, request):
+		profiler = self.server.eventhandler.profiler
+		if profiler is None:
+			request.setResponseCode(404)
+			return 'profiling is off\n'
+
+		method = request.args.get('method', [None])[0]
+		format = request.args.get('format', ['collapsed'])[0]
+		if format == 'pstats':
+			request.setHeader('content-type', 'application/octet-stream')
+			return marshal.dumps(profiler.pstats(method))
+		elif format == 'collapsed':
+			request.setHeader('content-type', 'text/plain')
+			return profiler.collapsed(method)
+		request.setResponseCode(400)
+		return 'unknown format\n'
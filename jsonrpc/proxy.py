@@ -32,21 +32,29 @@
 #
 import copy
 import cookielib
+import os
+import errno
+import httplib
+import socket
+import threading
+import StringIO
+import urllib
 import urllib2
 import urlparse
 import itertools
 import traceback
-import random
+import sys
+import Queue
 import time
 import UserDict, collections
 collections.Mapping.register(UserDict.DictMixin)
 
-from hashlib import sha1
 import jsonrpc.jsonutil
+import jsonrpc.cache
 from jsonrpc import __version__
 from jsonrpc.common import Response, Request
 
-__all__ = ['JSONRPCProxy', 'ProxyEvents']
+__all__ = ['JSONRPCProxy', 'ProxyEvents', 'IDGen', 'CounterIDGen', 'ConnectionPool', 'KeepAliveHandler']
 
 class NewStyleBaseException(Exception):
     def _get_message(self):
@@ -58,24 +66,74 @@ class NewStyleBaseException(Exception):
 
 
 class IDGen(object):
+	'''Generates short string ids, a random per-process prefix followed by a counter
+
+	e.g. ``'9c0f3e1a.2f'``.  The counter is an :func:`itertools.count`, so ids stay
+	unique across threads without a lock, and a forked child picks a new prefix.
+	'''
+	def __init__(self, prefix=None):
+		self._prefix = prefix
+		self._pid = None
+		self._counter = itertools.count(1)
+
+	def _reset(self):
+		self.prefix = self._prefix or os.urandom(4).encode('hex')
+		self._pid = os.getpid()
+
+	def __get__(self, *_, **__):
+		if self._pid != os.getpid(): self._reset()
+		return '{0}.{1:x}'.format(self.prefix, next(self._counter))
+
+
+class CounterIDGen(object):
+	'''Generates integer ids from a counter
+
+	The cheapest ids to encode, but only unique for a single client, so
+	don't use it when several processes share a server and log or cache by id.
+	'''
 	def __init__(self):
-		self._hasher = sha1()
-		self._id = 0
+		self._counter = itertools.count(1)
+
 	def __get__(self, *_, **__):
-		self._id += 1
-		self._hasher.update(str(self._id))
-		self._hasher.update(time.ctime())
-		self._hasher.update(str(random.random))
-		return self._hasher.hexdigest()
+		return next(self._counter)
+
 
 
+#: stands in for the response to a call a batch response has none for
+NO_RESPONSE = Response(error=dict(code=0, message='No response for this call.'))
 
 class ProxyEvents(object):
 	'''An event handler for JSONRPCProxy'''
 
-	#: an instance of a class which defines a __get__ method, used to generate a request id
+	#: an instance of a class which defines a __get__ method, used to generate a request id,
+	#: see :class:`IDGen` and :class:`CounterIDGen`
 	IDGen = IDGen()
 
+	#: reuse HTTP/1.1 connections to the server between calls
+	keepalive = True
+
+	#: the most idle connections kept open to each host
+	pool_size = 4
+
+	#: seconds an idle connection is kept before it is closed
+	idle_timeout = 30
+
+	#: if set, the asynchronous proxies collect the calls made within this many seconds into one batch request
+	batch_window = None
+
+	#: the most calls the asynchronous proxies put in one batch request
+	batch_size = 100
+
+	#: {method name: ttl} of read only methods whose results the proxy keeps and reuses for identical
+	#: calls, for ttl seconds or, if ttl is None, until they are evicted.  Only successful results are kept.
+	cached_methods = {}
+
+	#: the most results the proxy keeps for :py:attr:`cached_methods`, None for no limit
+	cache_entries = 1024
+
+	#: the most bytes of responses the proxy keeps for :py:attr:`cached_methods`, None for no limit
+	cache_bytes = 4 << 20
+
 
 	def __init__(self, proxy):
 		'''Allow a subclass to do its own initialization, gets any arguments leftover from __init__'''
@@ -103,6 +161,145 @@ class JSONRPCProcessor(urllib2.BaseHandler):
 
 	https_request = http_request
 
+
+class ConnectionPool(object):
+	'''A bounded pool of idle HTTP connections, keyed by (scheme, host, tunnel host)
+
+	:param int maxsize: the most idle connections kept per key, any others are closed
+	:param float idle_timeout: seconds an idle connection may wait before it is discarded
+	:param context: an :class:`ssl.SSLContext` for https connections
+	'''
+	connection_classes = dict(http=httplib.HTTPConnection, https=httplib.HTTPSConnection)
+
+	def __init__(self, maxsize=4, idle_timeout=30, context=None):
+		self.maxsize = maxsize
+		self.idle_timeout = idle_timeout
+		self.context = context
+		self._idle = collections.defaultdict(list)
+		self._lock = threading.Lock()
+
+	def get(self, key, timeout=socket._GLOBAL_DEFAULT_TIMEOUT):
+		'''get a connection for key, opening a new one if none is idle
+
+		:returns: a pair (connection, reused), reused is True if the connection was taken from the pool
+		'''
+		conn, expired = None, []
+		with self._lock:
+			idle = self._idle[key]
+			while idle and conn is None:
+				conn, since = idle.pop()
+				if time.time() - since > self.idle_timeout:
+					expired.append(conn)
+					conn = None
+		for old in expired: old.close()
+
+		if conn is None:
+			return self.connect(key, timeout), False
+
+		conn.timeout = timeout
+		if conn.sock is not None:
+			conn.sock.settimeout(socket.getdefaulttimeout() if timeout is socket._GLOBAL_DEFAULT_TIMEOUT else timeout)
+		return conn, True
+
+	def connect(self, key, timeout=socket._GLOBAL_DEFAULT_TIMEOUT):
+		'''create a new, unconnected, connection for key'''
+		scheme, host, tunnel = key
+		kwargs = dict(timeout=timeout)
+		if scheme == 'https' and self.context is not None:
+			kwargs['context'] = self.context
+		conn = self.connection_classes[scheme](host, **kwargs)
+		if tunnel: conn.set_tunnel(tunnel)
+		return conn
+
+	def put(self, key, conn):
+		'''hand an idle connection back to the pool'''
+		with self._lock:
+			idle = self._idle[key]
+			if len(idle) < self.maxsize:
+				idle.append( (conn, time.time()) )
+				conn = None
+		if conn is not None: conn.close()
+
+	def idle(self, key):
+		''':returns: the number of idle connections kept for key'''
+		with self._lock:
+			return len(self._idle.get(key, ()))
+
+	def close(self):
+		'''close every idle connection'''
+		with self._lock:
+			idle, self._idle = self._idle, collections.defaultdict(list)
+		for conns in idle.values():
+			for conn, _ in conns: conn.close()
+
+
+class KeepAliveHandler(urllib2.BaseHandler):
+	'''A urllib2 handler which keeps connections open in a :class:`ConnectionPool`
+
+	urllib2's own handlers close the connection after every response.  This one
+	reads the whole response, hands the connection back to the pool and, if a
+	pooled connection turns out to have been closed by the server, retries on a
+	new one.  It only retries when the server can't have seen the request, i.e.
+	sending it failed or the connection closed before any of the response came,
+	so that a call is never made twice.
+	'''
+
+	#: errors sending a request on a connection the server has closed
+	closed_errnos = (errno.EPIPE, errno.ECONNRESET)
+	handler_order = 400
+
+	def __init__(self, pool=None):
+		self.pool = pool if pool is not None else ConnectionPool()
+
+	def http_open(self, req):
+		return self.do_open(req)
+
+	https_open = http_open
+
+	def do_open(self, req):
+		host = req.get_host()
+		if not host:
+			raise urllib2.URLError('no host given')
+		key = (req.get_type(), host, getattr(req, '_tunnel_host', None))
+
+		headers = dict(req.unredirected_hdrs)
+		headers.update( (k,v) for k,v in req.headers.items() if k not in headers )
+		headers = dict( (name.title(), val) for name, val in headers.items() )
+		headers['Connection'] = 'keep-alive'
+		tunnel_headers = {}
+		if key[2] and 'Proxy-Authorization' in headers:
+			tunnel_headers['Proxy-Authorization'] = headers.pop('Proxy-Authorization')
+
+		while True:
+			conn, reused = self.pool.get(key, req.timeout)
+			if key[2] and not reused:
+				conn.set_tunnel(key[2], headers=tunnel_headers)
+			try:
+				conn.request(req.get_method(), req.get_selector(), req.data, headers)
+			except (socket.error, httplib.HTTPException), e:
+				conn.close()
+				# the server closed a pooled connection, try again on another one
+				if reused and getattr(e, 'errno', None) in self.closed_errnos: continue
+				raise urllib2.URLError(e)
+			try:
+				resp = conn.getresponse()
+				body = resp.read()
+			except (socket.error, httplib.HTTPException), e:
+				conn.close()
+				# closed before any of the response: the server dropped the connection without reading the request.
+				# BadStatusLine turns the empty line into "''"
+				if reused and isinstance(e, httplib.BadStatusLine) and e.line in ('', "''"): continue
+				raise urllib2.URLError(e)
+			break
+
+		if resp.will_close: conn.close()
+		else: self.pool.put(key, conn)
+
+		result = urllib.addinfourl(StringIO.StringIO(body), resp.msg, req.get_full_url())
+		result.code = resp.status
+		result.msg = resp.reason
+		return result
+
 class JSONRPCProxy(object):
 	'''A class implementing a JSON-RPC Proxy.
 
@@ -117,8 +314,22 @@ class JSONRPCProxy(object):
 
 	#: Override this attribute to customize proxy behavior
 	_eventhandler = ProxyEvents
+
+	#: the :py:class:`jsonrpc.cache.ResultCache` of responses to calls to :py:attr:`ProxyEvents.cached_methods`,
+	#: shared by the method proxies.  None if no methods are cached.
+	cache = None
+
+	#: the most method proxies kept for reuse, the least recently used one is dropped to make room
+	max_stubs = 256
+
 	def customize(self, eventhandler):
+		'''use a :py:class:`ProxyEvents` subclass, setting up the connection pool and cache it asks for'''
+		if '_eventhandler' in self.__dict__:
+			# the connections of the old transport aren't used again
+			self.close()
 		self._eventhandler = eventhandler(self)
+		self._stubs = collections.OrderedDict()
+		self._init_transport()
 		return self
 
 	def _transformURL(self, serviceURL, path):
@@ -150,26 +361,62 @@ class JSONRPCProxy(object):
 		self.serviceURL, self._path = self._transformURL(host, path)
 		self.customize(self._eventhandler)
 
+	def _init_transport(self):
 		cj = cookielib.CookieJar()
 		self._opener = urllib2.build_opener(urllib2.HTTPCookieProcessor(cj))
 		self._opener.add_handler(JSONRPCProcessor())
+		self._pool = None
+		if self._eventhandler.keepalive:
+			self._pool = ConnectionPool(self._eventhandler.pool_size, self._eventhandler.idle_timeout)
+			self._opener.add_handler(KeepAliveHandler(self._pool))
+		self._init_cache()
+
+	def _init_cache(self):
+		self.cache = None
+		if self._eventhandler.cached_methods:
+			self.cache = jsonrpc.cache.ResultCache(self._eventhandler.cache_entries, self._eventhandler.cache_bytes)
 
 
-	def _set_opener(self, opener):
+	def _set_opener(self, opener, pool=None):
 		self._opener  = opener
+		self._pool = pool
+		self._stubs = collections.OrderedDict()
 		return self
 
+	def close(self):
+		'''close the connections kept open to the server'''
+		if self._pool is not None:
+			self._pool.close()
+
 	def __getattr__(self, name):
+		if '_stubs' not in self.__dict__:
+			raise AttributeError(name)
 		if self._serviceName != None:
 			name = "{0}.{1}".format(self._serviceName, name)
-		return self.__class__(self.serviceURL, path=self._path, serviceName=name).customize(type(self._eventhandler))._set_opener(self._opener)
+		return self._stub(name)
 
+	def _stub(self, name):
+		'''the proxy for the method with the full name given, it shares this proxy's opener, pool and
+		event handler, and its cache of method proxies'''
+		stubs = self._stubs
+		try:
+			stub = stubs.pop(name)
+		except KeyError:
+			stub = object.__new__(self.__class__)
+			stub.__dict__.update(self.__dict__)
+			stub._serviceName = name
+			if len(stubs) >= self.max_stubs: stubs.popitem(last=False)
+		stubs[name] = stub
+		return stub
 
-	def _get_postdata(self, args=None, kwargs=None):
+
+	def _get_request(self, args=None, kwargs=None):
 		_args, _kwargs = self._eventhandler.get_params(args, kwargs)
 		id = self._eventhandler.IDGen
-		result = Request(id, self._serviceName, _args, _kwargs)
-		return jsonrpc.jsonutil.encode(result)
+		return Request(id, self._serviceName, _args, _kwargs)
+
+	def _get_postdata(self, args=None, kwargs=None):
+		return jsonrpc.jsonutil.encode(self._get_request(args, kwargs))
 
 	def _get_url(self):
 		result = [self.serviceURL]
@@ -184,10 +431,37 @@ class JSONRPCProxy(object):
 	def __call__(self, *args, **kwargs):
 
 		url = self._get_url()
+		if self.cache is not None and self._serviceName in self._eventhandler.cached_methods:
+			return self._cached_call(url, args, kwargs)
 		postdata = self._get_postdata(args, kwargs)
 		#respdata = urllib2.urlopen(url, postdata).read()
 		respdata = self._post(url, postdata).read()
+		return self._get_result(respdata)
+
+	def _cached_call(self, url, args, kwargs):
+		request = self._get_request(args, kwargs)
+		key = self._get_cachekey(request)
+		respdata = self.cache.get(key)
+		if respdata is not None:
+			return self._get_result(respdata)
+		respdata = self._post(url, jsonrpc.jsonutil.encode(request)).read()
+		return self._get_result(respdata, key)
+
+	def _get_cachekey(self, request):
+		''':returns: the key a call is cached under, None if its method isn't cached'''
+		if self.cache is None or request.method not in self._eventhandler.cached_methods: return None
+		return self.cache.key(request.method, request.args or (), request.kwargs)
+
+	def _cache_response(self, request, response):
+		'''keep the response to a call of one of :py:attr:`ProxyEvents.cached_methods` which succeeded'''
+		key = self._get_cachekey(request)
+		if key is not None and response.error is None:
+			self.cache.set(key, jsonrpc.jsonutil.encode(response), self._eventhandler.cached_methods[key[0]])
+
+	def _get_result(self, respdata, key=None):
 		resp = Response.from_dict(jsonrpc.jsonutil.decode(respdata))
+		if key is not None and resp.error is None:
+			self.cache.set(key, respdata, self._eventhandler.cached_methods[key[0]])
 		resp = self._eventhandler.proc_response(resp)
 
 		return resp.get_result()
@@ -197,27 +471,133 @@ class JSONRPCProxy(object):
 		'''call a JSON-RPC method
 
 		It's better to use instance.<methodname>(\\*args, \\*\\*kwargs),
-		but this version might be useful occasionally
+		but this version might be useful occasionally, e.g. for a method
+		named like one of the proxy's own attributes.  Unlike attribute access,
+		the method name is used as it is, not under this proxy's service name.
 		'''
-		p = self.__class__(self.serviceURL, path=self._path, serviceName=method)
-		return p(*args, **kwargs)
+		return self._stub(method)(*args, **kwargs)
 
 
-	def batch_call(self, methods):
+	def batch_call(self, methods, chunk_size=None, concurrency=1):
 		'''call several methods at once, return a list of (result, error) pairs
 
-		:param names: a dictionary { method: (args, kwargs) }
-		:returns: a list of pairs (result, error) where only one is not None
+		Calls to :py:attr:`ProxyEvents.cached_methods` which are in :py:attr:`cache` are answered from it,
+		and left out of the batch requests.
+
+		:param methods: a dictionary { method: (args, kwargs) } or a list of pairs (method, (args, kwargs))
+		:param int chunk_size: send at most this many calls in each batch request
+		:param int concurrency: the most batch requests in flight at once
+		:returns: a list of pairs (result, error) where only one is not None, in the order of methods
+		'''
+		requests = self._get_batch_requests(methods)
+		result = [None] * len(requests)
+		for index, output in self._iter_batch(requests, chunk_size, concurrency):
+			result[index] = output
+		return result
+
+	def iter_batch_call(self, methods, chunk_size=None, concurrency=1):
+		'''like :py:meth:`batch_call`, but yield the results as each batch request finishes
+
+		:returns: a generator of pairs (index, (result, error)), index is the position of the call in methods
 		'''
-		result = None
+		return self._iter_batch(self._get_batch_requests(methods), chunk_size, concurrency)
+
+	def _get_batch_requests(self, methods):
 		if hasattr(methods, 'items'): methods = methods.items()
-		data = [ getattr(self, k)._get_postdata(*v) for k, v in methods ]
-		postdata = '{0}'.format(','.join(data))
-		respdata = self._post(self._get_url(), postdata).read()
-		resp = Response.from_json(respdata)
-		try:
-			result = resp.get_result()
-		except AttributeError:
-			result = [res.get_output() for res in resp]
+		return [ self.__getattr__(k)._get_request(*v) for k, v in methods ]
 
-		return result
+	def _get_chunks(self, requests, chunk_size=None):
+		''':returns: a list of pairs (offset, requests)'''
+		chunk_size = chunk_size or len(requests) or 1
+		return [ (offset, requests[offset:offset+chunk_size]) for offset in xrange(0, len(requests), chunk_size) ]
+
+	def _match_responses(self, respdata, requests):
+		'''match the responses to a batch request back to its calls by id
+
+		:returns: a list of the response to each request, :py:data:`NO_RESPONSE` where there is none
+		'''
+		responses = Response.from_json(respdata)
+		if not isinstance(responses, list): responses = [responses]
+		byid = dict( (response.id, response) for response in responses )
+		# an error about the batch as a whole comes back with a null id
+		whole = byid.get(None, NO_RESPONSE)
+		return [ byid.get(request.id, whole) for request in requests ]
+
+	def _get_batch_outputs(self, respdata, offset, chunk):
+		'''match the responses to a batch request back to its calls by id
+
+		:returns: a list of pairs (index, (result, error))
+		'''
+		outputs = []
+		for index, request, response in zip(itertools.count(offset), chunk, self._match_responses(respdata, chunk)):
+			if response is NO_RESPONSE:
+				output = response.get_output()
+			else:
+				self._cache_response(request, response)
+				output = self._eventhandler.proc_response(response).get_output()
+			outputs.append( (index, output) )
+		return outputs
+
+	def _send_chunk(self, offset, chunk):
+		respdata = self._post(self._get_url(), jsonrpc.jsonutil.encode(chunk)).read()
+		return self._get_batch_outputs(respdata, offset, chunk)
+
+	def _iter_batch(self, requests, chunk_size, concurrency):
+		if self.cache is None:
+			return self._iter_chunks(requests, chunk_size, concurrency)
+		return self._iter_cached_batch(requests, chunk_size, concurrency)
+
+	def _iter_cached_batch(self, requests, chunk_size, concurrency):
+		'''answer the calls which are cached, then send the others'''
+		positions, pending = [], []
+		for index, request in enumerate(requests):
+			key = self._get_cachekey(request)
+			respdata = self.cache.get(key) if key is not None else None
+			if respdata is not None:
+				yield index, self._eventhandler.proc_response(Response.from_json(respdata)).get_output()
+			else:
+				positions.append(index)
+				pending.append(request)
+
+		if pending:
+			for index, output in self._iter_chunks(pending, chunk_size, concurrency):
+				yield positions[index], output
+
+	def _iter_chunks(self, requests, chunk_size, concurrency):
+		chunks = self._get_chunks(requests, chunk_size)
+		if concurrency <= 1 or len(chunks) <= 1:
+			for offset, chunk in chunks:
+				for output in self._send_chunk(offset, chunk):
+					yield output
+			return
+
+		todo, done = Queue.Queue(), Queue.Queue()
+		for item in chunks: todo.put(item)
+		def worker():
+			while True:
+				try:
+					offset, chunk = todo.get_nowait()
+				except Queue.Empty:
+					return
+				try:
+					done.put( (self._send_chunk(offset, chunk), None) )
+				except Exception:
+					done.put( (None, sys.exc_info()) )
+
+		for _ in xrange(min(concurrency, len(chunks))):
+			thread = threading.Thread(target=worker, name='jsonrpc-batch')
+			thread.daemon = True
+			thread.start()
+
+		try:
+			for _ in chunks:
+				outputs, error = done.get()
+				if error is not None:
+					raise error[0], error[1], error[2]
+				for output in outputs:
+					yield output
+		finally:
+			# don't send the rest if the caller stopped early or a request failed
+			while True:
+				try: todo.get_nowait()
+				except Queue.Empty: break
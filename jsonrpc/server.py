@@ -34,68 +34,583 @@ import traceback
 import jsonrpc.jsonutil
 from jsonrpc.utilities import public
 import jsonrpc.common
+import jsonrpc.processes
+import jsonrpc.cache
+import jsonrpc.metrics
+import jsonrpc.profiling
 
 # Twisted imports
 from twisted.web import server
 from twisted.internet import threads
 from twisted.internet import defer
+from twisted.internet import reactor
+from twisted.python.threadpool import ThreadPool
+from twisted.python import failure
 from twisted.web.resource import Resource
 
 import abc
+import time
+import inspect
+import functools
+import itertools
+import threading
+import weakref
 
-import copy
 import UserDict, collections
 collections.Mapping.register(UserDict.DictMixin)
 
+#: Execution policies, see :py:func:`execution_policy`
+#:
+#: - INLINE: call the method directly on the reactor thread
+#: - THREAD: call the method in a thread, via :py:meth:`ServerEvents.defer`
+#: - ASYNC: call the method on the reactor thread, it returns a :py:class:`twisted.internet.defer.Deferred`
+#: - PROCESS: call the method in a worker process, see :py:mod:`jsonrpc.processes`
+INLINE, THREAD, ASYNC, PROCESS = 'inline', 'thread', 'async', 'process'
+__all__ = ['INLINE', 'THREAD', 'ASYNC', 'PROCESS']
+
+@public
+def execution_policy(policy):
+	'''Decorator which sets how the server should call a method
+
+	for example
+
+		@execution_policy(INLINE)
+		def add(self, a, b):
+			return a+b
+
+	INLINE methods must be fast and never block, since nothing else is served while they run.
+	PROCESS methods must be module level functions.
+	'''
+	if policy not in (INLINE, THREAD, ASYNC, PROCESS):
+		raise ValueError('unknown execution policy: %r' % (policy,))
+	def _inner(method):
+		method.execution_policy = policy
+		return method
+	return _inner
+
+@public
+def concurrency_limit(limit):
+	'''Decorator which limits how many calls of a THREAD method may run at once,
+	further calls wait without holding a thread'''
+	def _inner(method):
+		method.concurrency_limit = limit
+		return method
+	return _inner
+
+@public
+def cacheable(ttl=None):
+	'''Decorator which lets the server cache the results of a method, for methods whose result
+	only depends on their params, like lookups
+
+	for example
+
+		@cacheable(ttl=60)
+		def get_user(self, id):
+			return self.db.get_user(id)
+
+	The encoded results are kept in :py:attr:`ServerEvents.cache`, a call which is found there is
+	answered without calling the method or encoding the result again.
+
+	:param ttl: how many seconds a result is used for, :py:attr:`ServerEvents.cache_ttl` by default
+	'''
+	if callable(ttl):
+		return cacheable()(ttl)
+	def _inner(method):
+		method.cacheable = True
+		method.cache_ttl = ttl
+		return method
+	return _inner
+
+@public
+def expose(name=None, postprocess=False):
+	'''Decorator which adds a method of a :py:class:`ServerEvents` subclass to its dispatch table
+
+	for example
+
+		@expose('math.add')
+		def add(self, a, b):
+			return a+b
+
+	:param str name: the name clients call the method by, its own name by default.  Dotted names
+		like 'service.method' are matched as a whole.
+	:param bool postprocess: pass the method's results through :py:meth:`ServerEvents.postprocess`
+	'''
+	if callable(name):
+		return expose()(name)
+	def _inner(method):
+		method.exposed_as = name or method.__name__
+		method.postprocess_result = postprocess
+		return method
+	return _inner
+
+@public
+class MethodEntry(collections.namedtuple('MethodEntry', 'name method policy postprocess limit signature cacheable ttl')):
+	'''An entry of the dispatch table: a method and what the server needs to know to call it
+
+	:py:attr:`signature` is a :py:class:`Signature`, or None if the method can't be inspected.
+	:py:attr:`ttl` is how long results of a :py:attr:`cacheable` method are kept, None for as long as they fit.'''
+	__slots__ = ()
+
+@public
+class DispatchTable(collections.Mapping):
+	'''A read only mapping from method names to :py:class:`MethodEntry`'''
+	def __init__(self, entries=()):
+		self._entries = dict(entries)
+		# a lookup per request is a single dict lookup
+		self.get = self._entries.get
+
+	def __getitem__(self, name):
+		return self._entries[name]
+
+	def __iter__(self):
+		return iter(self._entries)
+
+	def __len__(self):
+		return len(self._entries)
+
+@public
+class Signature(object):
+	'''The parameters a method accepts, worked out once so that calls can be checked cheaply
+
+	:py:attr:`argspec` is the method's :py:func:`inspect.getargspec`, without self'''
+	__slots__ = ('argspec', 'names', 'required')
+
+	def __init__(self, argspec):
+		self.argspec = argspec
+		self.names = frozenset(argspec.args)
+		self.required = tuple(argspec.args[:len(argspec.args) - len(argspec.defaults or ())])
+
+	@classmethod
+	def of(cls, method):
+		''':returns: the Signature of method, or None if it can't be inspected'''
+		try:
+			argspec = inspect.getargspec(method)
+		except TypeError:
+			return None
+		if inspect.ismethod(method) and method.im_self is not None:
+			argspec = argspec._replace(args=argspec.args[1:])
+		return cls(argspec)
+
+	def check(self, args, kwargs):
+		'''Raise :py:class:`jsonrpc.common.InvalidParams` unless the method can be called with args and kwargs'''
+		params = self.argspec.args
+		if len(args) > len(params) and self.argspec.varargs is None:
+			raise jsonrpc.common.InvalidParams('expected at most %d positional params, got %d' % (len(params), len(args)))
+		for name in kwargs:
+			if name in self.names:
+				if name in params[:len(args)]:
+					raise jsonrpc.common.InvalidParams('got more than one value for %r' % (name,))
+			elif self.argspec.keywords is None:
+				raise jsonrpc.common.InvalidParams('unexpected param %r' % (name,))
+		for name in self.required[len(args):]:
+			if name not in kwargs:
+				raise jsonrpc.common.InvalidParams('missing param %r' % (name,))
+
+	def bind(self, args, kwargs):
+		'''Name the params of a call which :py:meth:`check` accepts, filling in defaults, so that the
+		same call made with positional or keyword params looks the same
+
+		:returns: (the positional params left for \*args, a dict of the others)'''
+		params = self.argspec.args
+		bound = dict(zip(params[len(params) - len(self.argspec.defaults or ()):], self.argspec.defaults or ()))
+		bound.update(zip(params, args))
+		bound.update(kwargs)
+		return tuple(args[len(params):]), bound
+
+def isasync(result):
+	'''True if the result of a method is a Deferred or an awaitable which should be waited on'''
+	return isinstance(result, defer.Deferred) or hasattr(result, '__await__')
+
+class _ThreadResult(object):
+	'''Carries a Deferred or awaitable returned in a pool thread back to the reactor, Deferred.callback
+	won't take one directly.  Deferreds aren't thread safe, so the postprocessing of its result is
+	only added once it is back.'''
+	_local = threading.local()
+
+	def __init__(self, deferred, postprocess=None):
+		self.deferred = deferred
+		self.postprocess = postprocess
+
+	@classmethod
+	def call(cls, method, *a, **kw):
+		cls._local.pooled = True
+		try:
+			result = method(*a, **kw)
+		finally:
+			cls._local.pooled = False
+		if isinstance(result, defer.Deferred): result = cls(result)
+		return result
+
+	@classmethod
+	def pooled(cls):
+		''':returns: True in a pool thread making a THREAD call'''
+		return getattr(cls._local, 'pooled', False)
+
+	@classmethod
+	def unwrap(cls, result):
+		if isinstance(result, cls):
+			d = defer.ensureDeferred(result.deferred)
+			if result.postprocess is not None: d.addCallback(result.postprocess)
+			return d
+		return result
+
+def _estimate(obj, depth=4):
+	'''A rough guess at how many bytes obj takes encoded as JSON, from a few samples of each list and
+	dict, so that it is cheap to make on the reactor however large obj is.  A :py:class:`RawJSON
+	<jsonrpc.jsonutil.RawJSON>` counts for nothing, as it is written out without encoding.'''
+	if isinstance(obj, jsonrpc.jsonutil.RawJSON): return 0
+	if isinstance(obj, basestring): return len(obj) + 2
+	if isinstance(obj, jsonrpc.common.Response):
+		return 40 + _estimate(obj.result if obj.error is None else obj.error, depth)
+	if isinstance(obj, (list, tuple, dict)):
+		if not obj: return 2
+		if depth == 0: return 8 * len(obj)
+		if isinstance(obj, dict):
+			samples = [_estimate(k, 0) + 2 + _estimate(v, depth-1) for k, v in itertools.islice(obj.iteritems(), 3)]
+		else:
+			samples = [_estimate(obj[i], depth-1) + 1 for i in set([0, len(obj) // 2, len(obj) - 1])]
+		return 2 + len(obj) * sum(samples) // len(samples)
+	if isinstance(obj, (int, long, float, bool, type(None))): return len(str(obj))
+	return 8
+
+def _timed(times, method, *a, **kw):
+	'''Call the method in a pool thread, noting when it started'''
+	times.append(time.time())
+	return method(*a, **kw)
+
 @public
 class ServerEvents(object):
 	'''Subclass this and pass to :py:meth:`JSON_RPC.customize` to customize the JSON-RPC server'''
 
 	DEBUG = False
 
-	#: an object defining a 'get' method which contains the methods
+	#: an object defining a 'get' method which contains the methods, and a 'postprocess' method
+	#: if :py:meth:`findmethod` asks for results to be postprocessed.  Consulted for methods not in
+	#: the dispatch table.
 	methods = None
 
+	#: the functions and namespaces added with :py:meth:`register`
+	_registry = {}
+
+	#: the execution policy of methods which don't set one with :py:func:`execution_policy`
+	default_policy = THREAD
+
+	#: (minthreads, maxthreads) of a thread pool owned by the server, None to use the reactor's thread pool
+	threadpool_size = None
+
+	#: how many THREAD calls may wait for a thread before new ones fail
+	#: with :py:class:`jsonrpc.common.ServerBusy`, None for no limit
+	max_queued = None
+
+	#: the number of worker processes for PROCESS methods, None for one per CPU
+	processes = None
+
+	#: seconds a PROCESS call may take before it fails with :py:class:`jsonrpc.processes.ProcessError`,
+	#: None for no limit.  A worker process which dies never answers, so this is what ends its call.
+	process_timeout = 300
+
+	#: write the responses to a batch one by one as the calls finish, rather than all together at the end.
+	#: The response is sent with chunked encoding and :py:meth:`getresponsecode` isn't used.
+	#:
+	#: The batch is also decoded one call at a time, each call starting as soon as it is decoded, so
+	#: :py:meth:`processcontent` gets each call rather than the whole batch.  Invalid calls get their
+	#: own error responses, and if the batch turns out to be malformed or too long, an error response
+	#: is added and no more calls are made.
+	stream_batches = False
+
+	#: when streaming, how many calls of a batch may be in progress at once, None for no limit
+	batch_inflight = None
+
+	#: when streaming, how many calls of a batch are decoded and started before the reactor gets a
+	#: turn, so that a large batch of calls which finish at once doesn't hold it up
+	batch_chunk = 100
+
+	#: the largest request body accepted, in bytes, None for no limit
+	max_body_size = None
+
+	#: the most calls accepted in one batch, None for no limit
+	max_batch_length = None
+
+	#: request bodies larger than this, in bytes, are decoded in a thread, and responses estimated to
+	#: be larger are encoded in one.  Smaller ones are done on the reactor, where they cost less than
+	#: the thread hop.  None to never use a thread.
+	offload_threshold = 1 << 20
+
+	#: the most results of :py:func:`cacheable` methods kept in :py:attr:`cache`, None for no limit
+	cache_entries = 1024
+
+	#: the most bytes of encoded results kept in :py:attr:`cache`, None for no limit
+	cache_bytes = 16 << 20
+
+	#: seconds a cached result is used for, for methods which don't set their own, None for no expiry
+	cache_ttl = 60
+
+	#: record counts and latencies in :py:attr:`metrics`
+	collect_metrics = True
+
+	#: the upper bounds of the buckets of the latency histograms, in seconds
+	metrics_buckets = jsonrpc.metrics.BUCKETS
+
+	#: the fraction of calls to profile, e.g. 0.01, see :py:mod:`jsonrpc.profiling`.  None for none.
+	profile_sample = None
+
+	#: profile the calls which take longer than this many seconds, None for none
+	profile_threshold = None
+
+	#: seconds between the stack samples taken of the calls being profiled
+	profile_interval = 0.005
+
 	def __init__(self, server):
 		#: A link to the JSON-RPC server instance
 		self.server = server
 
+		#: the thread pool used by :py:meth:`defer`, None if it is the reactor's
+		self.threadpool = None
+		if self.threadpool_size is not None:
+			minthreads, maxthreads = self.threadpool_size
+			self.threadpool = ThreadPool(minthreads, maxthreads, name='jsonrpc')
+
+		#: the worker processes used by :py:meth:`defer_to_process`
+		self.processpool = jsonrpc.processes.ProcessPool(self.processes, self.process_timeout)
+
+		#: the :py:class:`jsonrpc.cache.ResultCache` of :py:func:`cacheable` methods,
+		#: see :py:meth:`invalidate` for when the data behind them changes.
+		self.cache = jsonrpc.cache.ResultCache(self.cache_entries, self.cache_bytes)
+
+		#: the :py:class:`jsonrpc.metrics.Metrics` of the server, None if :py:attr:`collect_metrics` is off
+		self.metrics = jsonrpc.metrics.Metrics(self.metrics_buckets) if self.collect_metrics else None
+
+		#: the :py:class:`jsonrpc.profiling.Profiler` of the server, None unless :py:attr:`profile_sample`
+		#: or :py:attr:`profile_threshold` is set
+		self.profiler = None
+		if self.profile_sample is not None or self.profile_threshold is not None:
+			self.profiler = jsonrpc.profiling.Profiler(self.profile_sample, self.profile_threshold, self.profile_interval)
+
+		# signatures of the methods found with findmethod, by underlying function and whether it is bound.
+		# Weakly keyed, so that a findmethod which makes a new function for each call doesn't fill it up
+		self._signatures = weakref.WeakKeyDictionary()
+
+		#: a :py:class:`DispatchTable` of the exposed and registered methods
+		self.dispatch = self.builddispatch()
+
+		# the entries of the calls in progress, see entryfor
+		self._entries = {}
+
+		# THREAD calls handed to defer and calls waiting on a concurrency limit,
+		# only touched from the reactor thread
+		self._pooled = 0
+		self._limited = 0
+		self._semaphores = {}
+
 	def callmethod(self, txrequest, rpcrequest, **extra):
 		'''Find the method and call it with the specified args
 
-		:returns: the result of the method'''
+		If the method returns a :py:class:`twisted.internet.defer.Deferred` or an awaitable,
+		the response is sent when it fires.
+
+		:returns: the result of the method, or a Deferred which fires with it'''
 
 		extra.update(rpcrequest.kwargs)
 
-		method, postprocess_result = self.findmethod(rpcrequest.method, rpcrequest.args, extra), False
-		if hasattr('method', '__iter__'):
-			method, postprocess_result = method
+		entry = self.entryfor(rpcrequest, extra)
+		if entry is None: raise jsonrpc.common.MethodNotFound
+
+		if entry.policy == PROCESS:
+			result = self.defer_to_process(entry.method, rpcrequest.args, extra)
+		elif self.profiler is not None:
+			result = self.profiler.call(rpcrequest.method, entry.method, rpcrequest.args, extra)
+		else:
+			result = entry.method(*rpcrequest.args, **extra)
+
+		if isasync(result):
+			postprocess = None
+			if entry.postprocess:
+				postprocess = lambda r: self.postprocess(rpcrequest.method, r, rpcrequest.args, extra)
+			if _ThreadResult.pooled():
+				# a THREAD method, leave the waiting and postprocessing to the reactor
+				return _ThreadResult(result, postprocess)
+			result = defer.ensureDeferred(result)
+			if postprocess is not None: result.addCallback(postprocess)
+
+		#if the result needs to be adjusted/validated, do it
+		elif entry.postprocess:
+			result = self.postprocess(rpcrequest.method, result, rpcrequest.args, extra)
 
+		return result
+
+	@classmethod
+	def register(cls, name, handler, postprocess=False):
+		'''Add a function to the dispatch table of servers using this class, or an object whose
+		:py:func:`expose`\ d methods are added under the namespace name, as 'name.method'.
+
+		The table is built when the server is created, so register before that.'''
+		if '_registry' not in cls.__dict__:
+			cls._registry = dict(cls._registry)
+		cls._registry[name] = (handler, postprocess)
+
+	def builddispatch(self):
+		'''Build the dispatch table from the methods marked with :py:func:`expose` and those added
+		with :py:meth:`register`
+
+		:returns: :py:class:`DispatchTable`'''
+		entries = dict(
+			(method.exposed_as, self.makeentry(method.exposed_as, method, method.postprocess_result))
+				for method in self._exposed(self)
+		)
+		for name, (handler, postprocess) in self._registry.items():
+			if callable(handler):
+				entries[name] = self.makeentry(name, handler, postprocess)
+			else:
+				for method in self._exposed(handler):
+					qualname = '{0}.{1}'.format(name, method.exposed_as)
+					entries[qualname] = self.makeentry(qualname, method, method.postprocess_result)
+		return DispatchTable(entries)
+
+	@staticmethod
+	def _exposed(obj):
+		# look the markers up on the class, so that properties aren't evaluated
+		source = obj if inspect.ismodule(obj) else type(obj)
+		for attr in dir(source):
+			if getattr(getattr(source, attr, None), 'exposed_as', None) is not None:
+				yield getattr(obj, attr)
+
+	def makeentry(self, name, method, postprocess=False):
+		'''Work out everything needed to call a method
+
+		:returns: :py:class:`MethodEntry`'''
+		policy = self.default_policy
+		if getattr(inspect, 'iscoroutinefunction', lambda _: False)(method):
+			policy = ASYNC
+		policy = getattr(method, 'execution_policy', policy)
+
+		limit = getattr(method, 'concurrency_limit', None)
+
+		cache = getattr(method, 'cacheable', False)
+		ttl = getattr(method, 'cache_ttl', None)
+		if ttl is None: ttl = self.cache_ttl
+		return MethodEntry(name, method, policy, postprocess, limit, self._getsignature(method), cache, ttl)
+
+	def _getsignature(self, method):
+		if not (inspect.isfunction(method) or inspect.ismethod(method)):
+			return Signature.of(method)
+		function, bound = getattr(method, 'im_func', method), getattr(method, 'im_self', None) is not None
+		signatures = self._signatures.get(function)
+		if signatures is None:
+			signatures = self._signatures[function] = {}
+		if bound not in signatures:
+			signatures[bound] = Signature.of(method)
+		return signatures[bound]
+
+	def checkparams(self, rpcrequest, extra):
+		'''Check the params of the request, and the extra keyword arguments the method will be
+		called with, against the method's signature.  This runs on the reactor, so that a call
+		which can't work is turned away before it takes a thread.
+
+		Raises :py:class:`jsonrpc.common.InvalidParams` if they don't fit'''
+		if not isinstance(rpcrequest.args, (list, tuple)):
+			raise jsonrpc.common.InvalidParams('__args must be a list')
+		entry = self.entryfor(rpcrequest)
+		if entry is None or entry.signature is None: return
+
+		kwargs = rpcrequest.kwargs
+		if extra: kwargs = dict(extra, **kwargs)
+		entry.signature.check(rpcrequest.args, kwargs)
+
+	def cachekey(self, rpcrequest, extra):
+		'''Return the key the result of the call is cached under in :py:attr:`cache`, or None if the
+		method isn't :py:func:`cacheable`.  Override to leave out arguments which don't change the result.'''
+		entry = self.entryfor(rpcrequest)
+		if entry is None or not entry.cacheable: return None
+		kwargs = rpcrequest.kwargs
+		if extra: kwargs = dict(extra, **kwargs)
+		return self._cachekey(entry, rpcrequest.args, kwargs)
+
+	def _cachekey(self, entry, args, kwargs):
+		if entry.signature is not None:
+			args, kwargs = entry.signature.bind(args, kwargs)
+		return self.cache.key(entry.name, args, kwargs)
+
+	def invalidate(self, method=None, args=None, kwargs=None):
+		'''Drop results from :py:attr:`cache`: all of them, those of a method, or, if args or kwargs
+		are given, the one for that call
+
+		:returns: the number of results dropped'''
+		if method is None or (args is None and kwargs is None):
+			return self.cache.invalidate(method)
+		entry = self.findentry(method, args, kwargs)
+		if entry is None: return 0
+		return self.cache.invalidate(method, self._cachekey(entry, args or (), kwargs or {}))
+
+	def findentry(self, method_name, args=None, kwargs=None):
+		'''Return the dispatch table entry for the method name, falling back to :py:meth:`findmethod`
+		for methods which aren't in the table
+
+		:returns: :py:class:`MethodEntry` or None if the method is not found'''
+		entry = self.dispatch.get(method_name)
+		if entry is not None: return entry
+
+		method, postprocess = self.findmethod(method_name, args, kwargs), False
+		if isinstance(method, tuple):
+			method, postprocess = method
 		if self.DEBUG:
 			# Debugging: raise AssertionError if type of method is invalid
 			assert method is None or callable(method), 'the returned method is not callable'
+		if not callable(method): return None
+		return self.makeentry(method_name, method, postprocess)
 
-		if not callable(method): raise jsonrpc.common.MethodNotFound
+	def entryfor(self, rpcrequest, kwargs=None):
+		'''Return the dispatch table entry for the method a request calls.  A method found with
+		:py:meth:`findmethod` is only looked up once for each call, when it starts.
 
-		result = method(*rpcrequest.args, **extra)
+		:param kwargs: the keyword arguments passed to :py:meth:`findmethod`, rpcrequest.kwargs by default
+		:returns: :py:class:`MethodEntry` or None if the method is not found'''
+		try:
+			return self._entries[rpcrequest]
+		except KeyError:
+			return self.findentry(rpcrequest.method, rpcrequest.args, rpcrequest.kwargs if kwargs is None else kwargs)
 
-		#if the result needs to be adjusted/validated, do it
-		if postprocess_result:
-			result = self.methods.postprocess(rpcrequest.method, result, rpcrequest.args, extra)
+	def _resolve(self, rpcrequest):
+		'''Find the entry for a call which is starting, for :py:meth:`entryfor`'''
+		try:
+			self._entries[rpcrequest] = self.findentry(rpcrequest.method, rpcrequest.args, rpcrequest.kwargs)
+		except Exception:
+			# let callmethod report the error with the request's id
+			pass
 
+	def _release(self, result, rpcrequest):
+		self._entries.pop(rpcrequest, None)
 		return result
 
 	def findmethod(self, method_name, args=None, kwargs=None):
-		'''Return the callable associated with the method name
+		'''Return the callable associated with the method name, for methods which aren't in the dispatch table
+
+		Return a pair (callable, True) to have its results passed through :py:meth:`postprocess`.
 
 		:returns: a callable or None if the method is not found'''
 		if self.methods is not None:
 			return self.methods.get(method_name)
-		else:
-			raise NotImplementedError
+
+	def postprocess(self, method_name, result, args, kwargs):
+		'''Adjust or validate the result of a method which asks for it, see :py:func:`expose`.
+		Calls methods.postprocess by default.
+
+		:returns: the result to send'''
+		return self.methods.postprocess(method_name, result, args, kwargs)
+
+	def getpolicy(self, rpcrequest):
+		'''Return the execution policy which should be used to call the method named by the request
+
+		:returns: one of :py:data:`INLINE`, :py:data:`THREAD`, :py:data:`ASYNC` or :py:data:`PROCESS`'''
+		entry = self.entryfor(rpcrequest)
+
+		# a missing method is reported without a trip through the thread pool
+		if entry is None: return INLINE
+		return entry.policy
 
 	def processrequest(self, result, args, **kw):
-		'''Override to implement custom handling of the method result and request'''
+		'''Override to implement custom handling of the method result and request.
+
+		The result of a :py:func:`cacheable` method is already encoded, as a :py:class:`jsonrpc.jsonutil.RawJSON`'''
 		return result
 
 	def log(self, response, txrequest, error=False):
@@ -131,10 +646,125 @@ class ServerEvents(object):
 		'''Defer to thread. Override this method if you are using a different ThreadPool, or if you want to return immediately.
 
 		:returns: :py:class:`twisted.internet.defer.Deferred`'''
-		return threads.deferToThread(method, *a, **kw)
+		if self.threadpool is None:
+			return threads.deferToThread(method, *a, **kw)
+
+		if not self.threadpool.started:
+			self.threadpool.start()
+			reactor.addSystemEventTrigger('during', 'shutdown', self.threadpool.stop)
+		return threads.deferToThreadPool(reactor, self.threadpool, method, *a, **kw)
+
+	def defer_to_process(self, method, args, kwargs):
+		'''Call a PROCESS method in a worker process
+
+		:returns: :py:class:`twisted.internet.defer.Deferred`'''
+		if not self.processpool.started:
+			self.processpool.start()
+			reactor.addSystemEventTrigger('during', 'shutdown', self.processpool.stop)
+		return self.processpool.call(method, args, kwargs)
+
+	def stats(self):
+		'''The counts, gauges and latency histograms in :py:attr:`metrics`, along with the state of
+		the thread pool and of the :py:attr:`cache`.  See :py:mod:`jsonrpc.metrics`.
+
+		:returns: dict with 'requests', 'methods', 'threadpool' and 'cache' items'''
+		metrics = self.metrics or jsonrpc.metrics.Metrics(self.metrics_buckets)
+		result = metrics.stats()
+		pool = self.threadpool or reactor.getThreadPool()
+		result['threadpool'] = dict(threads=pool.workers, busy=len(pool.working), calls=self._pooled, queued=self.queued())
+		result['cache'] = self.cache.stats()
+		return result
+
+	def queued(self):
+		'''Return the number of THREAD calls which are waiting, either for a thread or for a concurrency limit
+
+		:returns: :py:class:`int`'''
+		pool = self.threadpool or reactor.getThreadPool()
+		return self._limited + max(0, self._pooled - pool.max)
+
+	def defer_limited(self, rpcrequest, method, *a, **kw):
+		'''Call :py:meth:`defer` for a THREAD call, unless too many calls are already waiting.
+		Calls to a method with a :py:func:`concurrency_limit` wait for their turn here.
+
+		:returns: :py:class:`twisted.internet.defer.Deferred`'''
+		if self.max_queued is not None and self.queued() >= self.max_queued:
+			return defer.fail(jsonrpc.common.ServerBusy())
+
+		def _defer():
+			self._pooled += 1
+			d = self.defer(method, *a, **kw)
+			@d.addBoth
+			def _done(result):
+				self._pooled -= 1
+				return result
+			return d
+
+		semaphore = self._getsemaphore(rpcrequest)
+		if semaphore is None:
+			return _defer()
+
+		def _release(result):
+			semaphore.release()
+			return result
+
+		self._limited += 1
+		d = semaphore.acquire()
+		@d.addCallback
+		def _acquired(_):
+			self._limited -= 1
+			return _defer().addBoth(_release)
+		return d
+
+	def _getsemaphore(self, rpcrequest):
+		entry = self.entryfor(rpcrequest)
+		limit = entry.limit if entry is not None else None
+		if limit is None: return None
+
+		if rpcrequest.method not in self._semaphores:
+			self._semaphores[rpcrequest.method] = defer.DeferredSemaphore(limit)
+		return self._semaphores[rpcrequest.method]
+
+	def defer_inline(self, method, *a, **kw):
+		'''Call the method on the reactor thread, used for the INLINE, ASYNC and PROCESS execution policies
+
+		:returns: :py:class:`twisted.internet.defer.Deferred`'''
+		return defer.maybeDeferred(method, *a, **kw)
+
+	def _measure(self, result, name, times, threaded):
+		# times holds when the call was made and, if it was passed to a thread, when it started there
+		now = time.time()
+		queue = execute = None
+		if not threaded:
+			execute = now - times[0]
+		elif len(times) > 1:
+			queue, execute = times[1] - times[0], now - times[1]
+		error = isinstance(result, failure.Failure)
+		found = not (error and result.check(jsonrpc.common.MethodNotFound))
+		self.metrics.call_finished(name, error, queue, execute, found)
+		return result
 
 	def defer_with_rpcrequest(self, method, rpcrequest, *a, **kw):
-		d = self.defer(method, rpcrequest, *a, **kw)
+		try:
+			policy = self.getpolicy(rpcrequest)
+		except Exception:
+			# let callmethod report the error with the request's id
+			policy = INLINE
+
+		metrics = self.metrics
+		if metrics is not None:
+			metrics.call_started(rpcrequest.method)
+			times = [time.time()]
+
+		if policy == THREAD:
+			if metrics is not None: method = functools.partial(_timed, times, method)
+			d = self.defer_limited(rpcrequest, _ThreadResult.call, method, rpcrequest, *a, **kw)
+			# a method which returned a Deferred from the thread is waited on from the reactor
+			d.addCallback(_ThreadResult.unwrap)
+		else:
+			d = self.defer_inline(method, rpcrequest, *a, **kw)
+
+		if metrics is not None:
+			d.addBoth(self._measure, rpcrequest.method, times, policy == THREAD)
 
 		@d.addCallback
 		def _inner(result):
@@ -172,36 +802,124 @@ class JSON_RPC(Resource):
 
 
 	def render(self, request):
-		result = ''
+		metrics = self.eventhandler.metrics
+		if metrics is not None: metrics.request_started(request, time.time)
+
 		request.content.seek(0, 0)
 		try:
-			try:
-				content = jsonrpc.jsonutil.decode(request.content.read())
-			except ValueError:
-				self.eventhandler.log(None, request, True)
-				raise jsonrpc.common.ParseError
+			size = self._checksize(request)
+
+			if self.eventhandler.stream_batches and self._isbatch(request.content):
+				d = self._stream(request, self._iterbatch(request))
+				d.addErrback(self._ebStream, request)
+				return server.NOT_DONE_YET
+
+			threshold = self.eventhandler.offload_threshold
+			if threshold is not None and size > threshold:
+				d = self.eventhandler.defer(self._decode, request)
+				d.addErrback(self._ebDecode, request)
+				d.addCallback(self._dispatch, request)
+				d.addErrback(self._ebRender, request, None)
+			else:
+				try:
+					content = self._decode(request)
+				except jsonrpc.common.ParseError:
+					self.eventhandler.log(None, request, True)
+					raise
+				self._dispatch(content, request)
+		except BaseException, e:
+			self._ebRender(e, request, None)
 
-			content = self.eventhandler.processcontent(content, request)
+		return server.NOT_DONE_YET
 
-			content = jsonrpc.common.Request.from_json(content)
+	def _decode(self, request):
+		start = time.time()
+		try:
+			content = jsonrpc.jsonutil.decode(request.content.read())
+		except ValueError:
+			raise jsonrpc.common.ParseError
 
-			try:
-				if hasattr(content, 'check'):
-					content.check()
-				else:
-					for item in content: item.check()
+		metrics = self.eventhandler.metrics
+		if metrics is not None: metrics.observe('parse', time.time() - start)
+		return content
+
+	def _ebDecode(self, result, request):
+		if result.check(jsonrpc.common.ParseError):
+			self.eventhandler.log(None, request, True)
+		return result
+
+	def _dispatch(self, content, request):
+		content = self.eventhandler.processcontent(content, request)
+
+		limit = self.eventhandler.max_batch_length
+		if limit is not None and isinstance(content, list) and len(content) > limit:
+			raise jsonrpc.common.RequestTooLarge
 
-			except jsonrpc.common.RPCError, e:
-				self._ebRender(e, request, content.id if hasattr(content, 'id') else None)
+		content = jsonrpc.common.Request.from_json(content)
 
+		try:
+			if hasattr(content, 'check'):
+				content.check()
+			else:
+				for item in content: item.check()
+
+		except jsonrpc.common.RPCError, e:
+			self._ebRender(e, request, content.id if hasattr(content, 'id') else None)
+
+		else:
+			if isinstance(content, list) and self.eventhandler.stream_batches:
+				d = self._stream(request, content)
+				d.addErrback(self._ebStream, request)
 			else:
 				d = self._action(request, content)
 				d.addCallback(self._cbRender, request)
 				d.addErrback(self._ebRender, request, content.id if hasattr(content, 'id') else None)
-		except BaseException, e:
-			self._ebRender(e, request, None)
 
-		return server.NOT_DONE_YET
+	def _checksize(self, request):
+		'''Check the size of the request body against :py:attr:`ServerEvents.max_body_size`
+
+		:returns: the size of the body'''
+		request.content.seek(0, 2)
+		size = request.content.tell()
+		request.content.seek(0, 0)
+
+		limit = self.eventhandler.max_body_size
+		if limit is not None and size > limit: raise jsonrpc.common.RequestTooLarge
+		return size
+
+	def _isbatch(self, content):
+		'''True if the body holds a non-empty array, an empty one is left to the usual error handling'''
+		start = content.read(64).lstrip()
+		content.seek(0, 0)
+		return start.startswith('[') and not start[1:].lstrip().startswith(']')
+
+	def _iterbatch(self, request):
+		'''Decode the calls of a batch one by one, yielding :py:class:`jsonrpc.common.Request` objects
+		or the errors to report in their place'''
+		limit = self.eventhandler.max_batch_length
+		items = jsonrpc.jsonutil.iterarray(request.content)
+		count = 0
+		while True:
+			try:
+				item = next(items)
+			except StopIteration:
+				return
+			except ValueError:
+				self.eventhandler.log(None, request, True)
+				yield jsonrpc.common.ParseError()
+				return
+
+			count += 1
+			if limit is not None and count > limit:
+				yield jsonrpc.common.RequestTooLarge()
+				return
+
+			try:
+				item = self.eventhandler.processcontent(item, request)
+				if not isinstance(item, dict): raise jsonrpc.common.InvalidRequest
+				yield jsonrpc.common.Request.from_dict(item)
+			except Exception, e:
+				yield e
 
 
 
@@ -213,17 +931,9 @@ class JSON_RPC(Resource):
 
 		if contents == []: raise jsonrpc.common.InvalidRequest
 
-		def callmethod(rpcrequest, request, add, **kwargs):
-			add.update(kwargs)
-			result = self.eventhandler.callmethod(request, rpcrequest, **add)
-			return result
-
 		deferreds = []
 		for rpcrequest in contents:
-			res = None
-			add = copy.deepcopy(rpcrequest.extra)
-			add.update(kw)
-			deferreds.append(self.eventhandler.defer_with_rpcrequest(callmethod, rpcrequest, request, add))
+			deferreds.append(self._call(request, rpcrequest, kw))
 		deferreds = defer.DeferredList(deferreds, consumeErrors=True)
 
 		@deferreds.addCallback
@@ -231,19 +941,7 @@ class JSON_RPC(Resource):
 			result = []
 			try:
 				for success, methodresult in deferredresults:
-					res = None
-					if success:
-						methodresult, rpcrequest = methodresult
-						res = jsonrpc.common.Response(id=rpcrequest.id, result=methodresult)
-						res = self.eventhandler.processrequest(res, request.args, **kw)
-					else:
-						rpcrequest = methodresult.rpcrequest
-						try:
-							methodresult.raiseException()
-						except Exception, e:
-							res = self.render_error(e, rpcrequest.id)
-							self.eventhandler.log(res, request, error=True)
-
+					res = self._response(request, success, methodresult, kw)
 					if res.id is not None:
 						result.append(res)
 			except Exception, e:
@@ -257,42 +955,241 @@ class JSON_RPC(Resource):
 
 		return deferreds
 
+	def _stream(self, request, contents, **kw):
+		'''Like :py:meth:`_action` for a batch, but write each response as soon as it is ready.
+		At most :py:attr:`ServerEvents.batch_inflight` calls are in progress at once, and the reactor
+		gets a turn after every :py:attr:`ServerEvents.batch_chunk` calls.
 
-	def _cbRender(self, result, request):
-		@self.eventhandler.defer
-		def _inner(*args, **_):
-			code = self.eventhandler.getresponsecode(result)
-			request.setResponseCode(code)
-			self.eventhandler.log(result, request, error=False)
-			if result is not None:
+		contents may be any iterable of :py:class:`jsonrpc.common.Request`, exceptions in it are
+		written as error responses.'''
+		if contents == []: raise jsonrpc.common.InvalidRequest
+
+		contents = iter(contents)
+		finished = defer.Deferred()
+		state = dict(inflight=0, written=False, exhausted=False, lost=False, dispatching=False, resuming=False)
+
+		def _lost(_):
+			# the client went away, don't start any more calls
+			state['lost'] = True
+		request.notifyFinish().addErrback(_lost)
+
+		def _write(res):
+			self.eventhandler.log(res, request, error=res.error is not None)
+			data = self._encode(res)
+			if state['written']:
+				request.write(',' + data)
+			else:
 				request.setHeader("content-type", 'application/json')
-				result_ = jsonrpc.jsonutil.encode(result).encode('utf-8')
-				request.setHeader("content-length", len(result_))
-				request.write(result_)
-			request.finish()
-		return _inner
+				request.write('[' + data)
+				state['written'] = True
 
-	def _ebRender(self, result, request, id, finish=True):
-		@self.eventhandler.defer
-		def _inner(*args, **_):
-			err = None
-			if not isinstance(result, BaseException):
-				try: result.raiseException()
-				except BaseException, e:
-					err = e
-					self.eventhandler.log(err, request, error=True)
-			else: err = result
-			err = self.render_error(err, id)
+		def _done(result):
+			state['inflight'] -= 1
+			success, methodresult = result
+			rpcrequest = methodresult[1] if success else methodresult.rpcrequest
+			try:
+				res = self._response(request, success, methodresult, kw=kw)
+				if res.id is not None and not state['lost']:
+					_write(res)
+			except Exception, e:
+				traceback.print_exc()
+				# the call still gets a response, e.g. when its result couldn't be encoded
+				if rpcrequest.id is not None and not state['lost']:
+					try: _write(self.render_error(e, rpcrequest.id))
+					except Exception: traceback.print_exc()
+			_next()
+
+		def _resume():
+			state['resuming'] = False
+			_next()
+
+		def _next():
+			# calls which finish straight away come back here, the loop below picks up where it was
+			if state['dispatching']: return
+			state['dispatching'] = True
+			try:
+				limit, chunk = self.eventhandler.batch_inflight, self.eventhandler.batch_chunk
+				started = 0
+				while not state['exhausted'] and not state['lost']:
+					if limit is not None and state['inflight'] >= limit: break
+					if chunk is not None and started >= chunk:
+						# let the reactor run, then carry on
+						if not state['resuming']:
+							state['resuming'] = True
+							reactor.callLater(0, _resume)
+						break
+					started += 1
+					try: rpcrequest = next(contents)
+					except StopIteration:
+						state['exhausted'] = True
+						break
+
+					# a call which couldn't be decoded or is invalid gets an error straight away
+					if isinstance(rpcrequest, Exception):
+						_write(self.render_error(rpcrequest, None))
+						continue
+					try:
+						rpcrequest.check()
+					except jsonrpc.common.RPCError, e:
+						_write(self.render_error(e, rpcrequest.id))
+						continue
+
+					try:
+						d = self._call(request, rpcrequest, kw)
+					except Exception, e:
+						# the call can't be started, answer it and go on to the next
+						traceback.print_exc()
+						if rpcrequest.id is not None: _write(self.render_error(e, rpcrequest.id))
+						continue
+					state['inflight'] += 1
+					d.addCallbacks(lambda r: (True, r), lambda f: (False, f))
+					d.addCallback(_done)
+			finally:
+				state['dispatching'] = False
+
+			if state['inflight'] == 0 and (state['exhausted'] or state['lost']) and not finished.called:
+				if not state['lost']:
+					if state['written']: request.write(']')
+					request.finish()
+				finished.callback(None)
+
+		_next()
+		return finished
+
+	def _call(self, request, rpcrequest, kw):
+		'''Start a call to the method named by rpcrequest
+
+		:returns: a Deferred which fires with (result, rpcrequest), or fails with a Failure that has an rpcrequest attribute'''
+		handler = self.eventhandler
+		handler._resolve(rpcrequest)
+		d = self._callentry(request, rpcrequest, kw)
+		return d.addBoth(handler._release, rpcrequest)
+
+	def _callentry(self, request, rpcrequest, kw):
+		add = rpcrequest.extra
+		if kw: add = dict(add, **kw)
+		try:
+			self.eventhandler.checkparams(rpcrequest, add)
+			key = self.eventhandler.cachekey(rpcrequest, add)
+		except Exception:
+			# only this call fails, the others of a batch are still answered
+			result = failure.Failure()
+			result.rpcrequest = rpcrequest
+			if self.eventhandler.metrics is not None:
+				self.eventhandler.metrics.call_rejected(rpcrequest.method)
+			return defer.fail(result)
+
+		if key is None:
+			return self.eventhandler.defer_with_rpcrequest(self._callmethod, rpcrequest, request, add)
+
+		# a hit is answered without a thread or encoding
+		data = self.eventhandler.cache.get(key)
+		if data is not None:
+			if self.eventhandler.metrics is not None:
+				self.eventhandler.metrics.cache_hit(rpcrequest.method)
+			return defer.succeed((jsonrpc.jsonutil.RawJSON(data), rpcrequest))
+
+		d = self.eventhandler.defer_with_rpcrequest(self._callmethod, rpcrequest, request, add)
+		return d.addCallback(self._store, key)
+
+	def _store(self, result, key):
+		'''Encode the result of a cacheable method and keep it, the response is written from the same data.
+		A large result is encoded in a thread, as in :py:meth:`_cbRender`.'''
+		methodresult, rpcrequest = result
+		# the entry is released once the call is answered, so it is looked up before any thread hop
+		ttl = self.eventhandler.entryfor(rpcrequest).ttl
+		threshold = self.eventhandler.offload_threshold
+		if threshold is not None and _estimate(methodresult) > threshold:
+			d = self.eventhandler.defer(jsonrpc.jsonutil.encode_bytes, methodresult)
+			return d.addCallback(self._keep, key, ttl, rpcrequest)
+		return self._keep(jsonrpc.jsonutil.encode_bytes(methodresult), key, ttl, rpcrequest)
+
+	def _keep(self, data, key, ttl, rpcrequest):
+		self.eventhandler.cache.set(key, data, ttl)
+		return jsonrpc.jsonutil.RawJSON(data), rpcrequest
+
+	def _callmethod(self, rpcrequest, request, add):
+		# unpacking add gives eventhandler.callmethod its own copy to change
+		return self.eventhandler.callmethod(request, rpcrequest, **add)
+
+	def _response(self, request, success, methodresult, kw):
+		'''Turn the outcome of :py:meth:`_call` into a :py:class:`jsonrpc.common.Response`'''
+		if success:
+			methodresult, rpcrequest = methodresult
+			res = jsonrpc.common.Response(id=rpcrequest.id, result=methodresult)
+			res = self.eventhandler.processrequest(res, request.args, **kw)
+		else:
+			rpcrequest = methodresult.rpcrequest
+			try:
+				methodresult.raiseException()
+			except Exception, e:
+				res = self.render_error(e, rpcrequest.id)
+				self.eventhandler.log(res, request, error=True)
+		return res
+
+
+	def _cbRender(self, result, request):
+		if result is None:
+			return self._write(None, result, request)
 
+		threshold = self.eventhandler.offload_threshold
+		if threshold is not None and _estimate(result) > threshold:
+			d = self.eventhandler.defer(self._encoderesult, result)
+			return d.addCallback(self._write, result, request)
+		else:
+			return self._write(self._encoderesult(result), result, request)
+
+	def _encoderesult(self, result):
+		start = time.time()
+		data = self._encode(result)
+		metrics = self.eventhandler.metrics
+		if metrics is not None: metrics.observe('encode', time.time() - start)
+		return data
+
+	def _encode(self, result):
+		'''Encode a response or a list of them, writing results which are already encoded in as they are'''
+		if isinstance(result, list):
+			return jsonrpc.common.Response.encode_list(result)
+		elif isinstance(result, jsonrpc.common.Response):
+			return result.encode()
+		return jsonrpc.jsonutil.encode_bytes(result)
+
+	def _write(self, data, result, request):
+		code = self.eventhandler.getresponsecode(result)
+		request.setResponseCode(code)
+		self.eventhandler.log(result, request, error=False)
+		if data is not None:
+			request.setHeader("content-type", 'application/json')
+			request.setHeader("content-length", str(len(data)))
+			request.write(data)
+		request.finish()
+
+	def _ebRender(self, result, request, id, finish=True):
+		err = None
+		# newer versions of Twisted make Failure a subclass of BaseException
+		if isinstance(result, failure.Failure) or not isinstance(result, BaseException):
+			try: result.raiseException()
+			except BaseException, e:
+				err = e
+				self.eventhandler.log(err, request, error=True)
+		else: err = result
+		err = self.render_error(err, id)
+		result_ = jsonrpc.jsonutil.encode_bytes(err)
+
+		# the status and headers went out with whatever was written already
+		if not getattr(request, 'startedWriting', False):
 			code = self.eventhandler.getresponsecode(result)
 			request.setResponseCode(code)
-
 			request.setHeader("content-type", 'application/json')
-			result_ = jsonrpc.jsonutil.encode(err).encode('utf-8')
-			request.setHeader("content-length", len(result_))
-			request.write(result_)
-			if finish: request.finish()
-		return _inner
+			request.setHeader("content-length", str(len(result_)))
+		request.write(result_)
+		if finish: request.finish()
+
+	def _ebStream(self, result, request):
+		# part of the response may already be written, all that can be done is to end it
+		self.eventhandler.log(result, request, error=True)
+		result.printTraceback()
+		if not request.finished: request.finish()
 
 	def render_error(self, e, id):
 		if isinstance(e, jsonrpc.common.RPCError):
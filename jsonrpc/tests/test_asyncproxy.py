@@ -0,0 +1,294 @@
+import jsonrpc.common
+import jsonrpc.asyncproxy
+import jsonrpc.proxy
+from jsonrpc.asyncproxy import asyncio
+from twisted.trial import unittest
+from twisted.internet import defer
+from twisted.web.client import ResponseNeverReceived, RequestNotSent
+from twisted.python import failure
+import mock
+
+class BatchingEvents(jsonrpc.proxy.ProxyEvents):
+	batch_window = 0.01
+	batch_size = 3
+
+class CachingEvents(jsonrpc.proxy.ProxyEvents):
+	cached_methods = {'add': None}
+
+class CachingBatchEvents(BatchingEvents):
+	cached_methods = {'add': None}
+
+# Run example server before tests
+
+class TestTxJSONRPCProxy(unittest.TestCase):
+
+	def setUp(self):
+		self.proxy = jsonrpc.asyncproxy.TxJSONRPCProxy('http://localhost:8007', path='aaa')
+		self.addCleanup(self.proxy.close)
+
+	@defer.inlineCallbacks
+	def test_call(self):
+		self.assertEqual((yield self.proxy.add(1,2)), 3)
+		self.assertEqual((yield self.proxy.call('subtract', 2, 1)), 1)
+
+	@defer.inlineCallbacks
+	def test_concurrent(self):
+		results = yield defer.gatherResults([self.proxy.add(i, 1) for i in range(100)])
+		self.assertEqual(results, [i+1 for i in range(100)])
+
+	@defer.inlineCallbacks
+	def test_batchcall(self):
+		batch = [
+			('add',      [ (1,2), {} ]),
+			('subtract', [ (), dict(a=2,b=1) ]),
+		]
+		self.assertEqual((yield self.proxy.batch_call(batch)), [(3, None), (1, None)])
+
+	@defer.inlineCallbacks
+	def test_batchcall_chunks(self):
+		batch = [ ('add', [ (i,1), {} ]) for i in range(7) ]
+		results = yield self.proxy.batch_call(batch, chunk_size=2, concurrency=2)
+		self.assertEqual(results, [ (i+1, None) for i in range(7) ])
+
+	@defer.inlineCallbacks
+	def test_error(self):
+		with self.assertRaises(jsonrpc.common.MethodNotFound):
+			yield self.proxy.missingmethod()
+
+	@defer.inlineCallbacks
+	def test_stale(self):
+		self.assertEqual((yield self.proxy.add(1,2)), 3)
+		yield self.proxy.close()
+		self.assertEqual((yield self.proxy.add(1,3)), 4)
+
+	@defer.inlineCallbacks
+	def test_retry_unsent(self):
+		request = self.proxy._request
+		outcomes = [defer.fail(RequestNotSent([failure.Failure(IOError())]))]
+		with mock.patch.object(self.proxy, '_request', side_effect=lambda *a: outcomes.pop() if outcomes else request(*a)) as post:
+			self.assertEqual((yield self.proxy.add(1,2)), 3)
+		self.assertEqual(post.call_count, 2)
+
+	@defer.inlineCallbacks
+	def test_no_replay(self):
+		with mock.patch.object(self.proxy, '_request', return_value=defer.fail(ResponseNeverReceived([failure.Failure(IOError())]))) as post:
+			with self.assertRaises(ResponseNeverReceived):
+				yield self.proxy.add(1,2)
+		self.assertEqual(post.call_count, 1)
+
+	@defer.inlineCallbacks
+	def test_customize(self):
+		self.proxy.customize(BatchingEvents)
+		self.addCleanup(self.proxy.close)
+		with mock.patch.object(self.proxy, '_post', wraps=self.proxy._post) as post:
+			calls = [self.proxy.add(1,2), self.proxy.subtract(2,1)]
+			self.assertEqual((yield defer.gatherResults(calls)), [3, 1])
+		self.assertEqual(post.call_count, 1)
+
+	def test_stubs(self):
+		self.assertIs(self.proxy.add, self.proxy.add)
+		self.assertIs(self.proxy.add._agent, self.proxy._agent)
+
+	@defer.inlineCallbacks
+	def test_cache(self):
+		cls = jsonrpc.asyncproxy.TxJSONRPCProxy
+		for events in (CachingEvents, CachingBatchEvents):
+			self.proxy.customize(events)
+			self.assertIsNot(self.proxy.cache, None)
+			with mock.patch.object(cls, '_post', autospec=True, side_effect=cls._post) as post:
+				self.assertEqual((yield self.proxy.add(1,2)), 3)
+				self.assertEqual((yield self.proxy.add(1,2)), 3)
+				self.assertEqual((yield self.proxy.subtract(2,1)), 1)
+			self.assertEqual(post.call_count, 2)
+			self.assertEqual(len(self.proxy.cache), 1)
+
+
+class TestTxBatching(unittest.TestCase):
+
+	def setUp(self):
+		proxy = type('Proxy', (jsonrpc.asyncproxy.TxJSONRPCProxy,), dict(_eventhandler=BatchingEvents))
+		self.proxy = proxy('http://localhost:8007', path='aaa')
+		self.addCleanup(self.proxy.close)
+
+	@defer.inlineCallbacks
+	def test_window(self):
+		with mock.patch.object(self.proxy, '_post', wraps=self.proxy._post) as post:
+			calls = [self.proxy.add(1,2), self.proxy.subtract(2,1)]
+			self.assertFalse(post.called)
+			self.assertEqual((yield defer.gatherResults(calls)), [3, 1])
+		self.assertEqual(post.call_count, 1)
+
+	@defer.inlineCallbacks
+	def test_size(self):
+		with mock.patch.object(self.proxy, '_post', wraps=self.proxy._post) as post:
+			calls = [self.proxy.add(i,1) for i in range(4)]
+			self.assertEqual(post.call_count, 1)
+			self.assertEqual((yield defer.gatherResults(calls)), [1, 2, 3, 4])
+		self.assertEqual(post.call_count, 2)
+
+	@defer.inlineCallbacks
+	def test_error(self):
+		add, missing = self.proxy.add(1,2), self.proxy.missingmethod()
+		self.proxy.flush()
+		self.assertEqual((yield add), 3)
+		with self.assertRaises(jsonrpc.common.MethodNotFound):
+			yield missing
+
+
+class TestAsyncioJSONRPCProxy(unittest.TestCase):
+	if asyncio is None:
+		skip = 'asyncio is not available'
+
+	def setUp(self):
+		self.loop = asyncio.new_event_loop()
+		self.addCleanup(self.loop.close)
+		proxy = type('Proxy', (jsonrpc.asyncproxy.AsyncioJSONRPCProxy,), dict(loop=self.loop))
+		self.proxy = proxy('http://localhost:8007', path='aaa')
+		self.addCleanup(self.proxy.close)
+
+	def wait(self, future):
+		return self.loop.run_until_complete(future)
+
+	def test_call(self):
+		self.assertEqual(self.wait(self.proxy.add(1,2)), 3)
+		self.assertEqual(self.wait(self.proxy.call('subtract', 2, 1)), 1)
+
+	def test_concurrent(self):
+		results = self.wait(asyncio.gather(*[self.proxy.add(i, 1) for i in range(100)], loop=self.loop))
+		self.assertEqual(results, [i+1 for i in range(100)])
+
+	def test_keepalive(self):
+		self.assertEqual(self.wait(self.proxy.add(1,2)), 3)
+		protocol = self.proxy._pool._idle[('http', 'localhost', 8007)][0][0]
+		self.assertEqual(self.wait(self.proxy.add(1,3)), 4)
+		self.assertIs(self.proxy._pool._idle[('http', 'localhost', 8007)][0][0], protocol)
+
+	def test_stale(self):
+		self.assertEqual(self.wait(self.proxy.add(1,2)), 3)
+		protocol = self.proxy._pool._idle[('http', 'localhost', 8007)][0][0]
+		protocol.transport.close()
+		self.assertEqual(self.wait(self.proxy.add(1,3)), 4)
+
+	def test_no_replay(self):
+		self.assertEqual(self.wait(self.proxy.add(1,2)), 3)
+		protocol = self.proxy._pool._idle[('http', 'localhost', 8007)][0][0]
+		# the request is written, then the connection drops before any response
+		self.addCleanup(protocol.transport.close)
+		protocol.transport = mock.Mock()
+		protocol.transport.write.side_effect = lambda data: self.loop.call_soon(protocol.connection_lost, None)
+		with mock.patch.object(self.proxy._pool, 'get', wraps=self.proxy._pool.get) as get:
+			self.assertRaises(jsonrpc.asyncproxy.ConnectionClosed, self.wait, self.proxy.add(1,3))
+		self.assertEqual(get.call_count, 1)
+
+	def test_batchcall(self):
+		batch = [
+			('add',      [ (1,2), {} ]),
+			('subtract', [ (), dict(a=2,b=1) ]),
+		]
+		self.assertEqual(self.wait(self.proxy.batch_call(batch)), [(3, None), (1, None)])
+
+	def test_batchcall_chunks(self):
+		batch = [ ('add', [ (i,1), {} ]) for i in range(7) ]
+		results = self.wait(self.proxy.batch_call(batch, chunk_size=2, concurrency=2))
+		self.assertEqual(results, [ (i+1, None) for i in range(7) ])
+
+	def test_error(self):
+		self.assertRaises(jsonrpc.common.MethodNotFound, self.wait, self.proxy.missingmethod())
+
+	def test_cache(self):
+		cls = jsonrpc.asyncproxy.AsyncioJSONRPCProxy
+		for events in (CachingEvents, CachingBatchEvents):
+			self.proxy.customize(events)
+			self.assertIsNot(self.proxy.cache, None)
+			with mock.patch.object(cls, '_post', autospec=True, side_effect=cls._post) as post:
+				self.assertEqual(self.wait(self.proxy.add(1,2)), 3)
+				self.assertEqual(self.wait(self.proxy.add(1,2)), 3)
+				self.assertEqual(self.wait(self.proxy.subtract(2,1)), 1)
+			self.assertEqual(post.call_count, 2)
+			self.assertEqual(len(self.proxy.cache), 1)
+
+
+class TestAsyncioBatching(unittest.TestCase):
+	if asyncio is None:
+		skip = 'asyncio is not available'
+
+	def setUp(self):
+		self.loop = asyncio.new_event_loop()
+		self.addCleanup(self.loop.close)
+		proxy = type('Proxy', (jsonrpc.asyncproxy.AsyncioJSONRPCProxy,), dict(loop=self.loop, _eventhandler=BatchingEvents))
+		self.proxy = proxy('http://localhost:8007', path='aaa')
+		self.addCleanup(self.proxy.close)
+
+	def wait(self, *futures):
+		return self.loop.run_until_complete(asyncio.gather(*futures, loop=self.loop, return_exceptions=True))
+
+	def test_window(self):
+		with mock.patch.object(self.proxy, '_post', wraps=self.proxy._post) as post:
+			self.assertEqual(self.wait(self.proxy.add(1,2), self.proxy.subtract(2,1)), [3, 1])
+		self.assertEqual(post.call_count, 1)
+
+	def test_size(self):
+		with mock.patch.object(self.proxy, '_post', wraps=self.proxy._post) as post:
+			calls = [self.proxy.add(i,1) for i in range(4)]
+			self.assertEqual(post.call_count, 1)
+			self.assertEqual(self.wait(*calls), [1, 2, 3, 4])
+		self.assertEqual(post.call_count, 2)
+
+	def test_error(self):
+		add, missing = self.wait(self.proxy.add(1,2), self.proxy.missingmethod())
+		self.assertEqual(add, 3)
+		self.assertIsInstance(missing, jsonrpc.common.MethodNotFound)
+
+
+class TestHTTPClientProtocol(unittest.TestCase):
+	if asyncio is None:
+		skip = 'asyncio is not available'
+
+	def setUp(self):
+		self.loop = asyncio.new_event_loop()
+		self.addCleanup(self.loop.close)
+		self.protocol = jsonrpc.asyncproxy.HTTPClientProtocol(self.loop)
+		self.protocol.connection_made(mock.Mock())
+
+	def feed(self, *pieces):
+		response = self.protocol.request(b'request')
+		for piece in pieces:
+			self.assertFalse(response.done())
+			self.protocol.data_received(piece)
+		self.assertTrue(response.done())
+		return response.result()
+
+	def test_content_length(self):
+		self.assertEqual(
+			self.feed(b'HTTP/1.1 200 OK\r\nContent-Length: 5\r\n', b'\r\nab', b'cde'),
+			(200, b'abcde')
+		)
+		self.assertFalse(self.protocol.closed)
+
+	def test_chunked(self):
+		self.assertEqual(
+			self.feed(b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n3\r\nabc\r\n', b'2\r\nde\r\n0\r\n', b'\r\n'),
+			(200, b'abcde')
+		)
+		self.assertFalse(self.protocol.closed)
+
+	def test_close(self):
+		self.assertEqual(
+			self.feed(b'HTTP/1.1 500 Error\r\nConnection: close\r\nContent-Length: 2\r\n\r\nab'),
+			(500, b'ab')
+		)
+		self.assertTrue(self.protocol.closed)
+
+	def test_lost(self):
+		response = self.protocol.request(b'request')
+		self.protocol.connection_lost(None)
+		self.assertRaises(jsonrpc.asyncproxy.ConnectionClosed, response.result)
+		self.assertTrue(self.protocol.sent)
+		self.assertFalse(self.protocol.received)
+
+	def test_closed(self):
+		self.protocol.closed = True
+		response = self.protocol.request(b'request')
+		self.assertRaises(jsonrpc.asyncproxy.ConnectionClosed, response.result)
+		self.assertFalse(self.protocol.sent)
+		self.assertFalse(self.protocol.transport.write.called)
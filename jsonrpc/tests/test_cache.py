@@ -0,0 +1,102 @@
+#
+#  Copyright (c) 2011 Edward Langley
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#  Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+#  Redistributions in binary form must reproduce the above copyright
+#  notice, this list of conditions and the following disclaimer in the
+#  documentation and/or other materials provided with the distribution.
+#
+#  Neither the name of the project's author nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+#  TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+#  LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+#  NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#  SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+from twisted.trial import unittest
+
+import jsonrpc.cache
+
+class TestResultCache(unittest.TestCase):
+	def setUp(self):
+		self.now = 0
+		self.cache = jsonrpc.cache.ResultCache(3, 1000, clock=lambda: self.now)
+
+	def test_key(self):
+		key = jsonrpc.cache.ResultCache.key
+		self.assertEqual(key('m', [1], {'b': 1, 'a': [2, 3]}), key('m', (1,), dict(a=[2, 3], b=1)))
+		self.assertEqual(key('m', [], None), key('m'))
+		self.assertNotEqual(key('m', [1]), key('m', ['1']))
+		self.assertNotEqual(key('m', [1]), key('n', [1]))
+
+	def test_get(self):
+		key = self.cache.key('m', [1])
+		self.assertIs(self.cache.get(key), None)
+		self.cache.set(key, '"a"')
+		self.assertEqual(self.cache.get(key), '"a"')
+		self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+		self.cache.set(key, '"bb"')
+		self.assertEqual(self.cache.get(key), '"bb"')
+		self.assertEqual(self.cache.size, len('m') + len(key[1]) + len('"bb"'))
+
+	def test_ttl(self):
+		key = self.cache.key('m')
+		self.cache.set(key, '1', ttl=5)
+		self.now = 4.9
+		self.assertEqual(self.cache.get(key), '1')
+		self.now = 5
+		self.assertIs(self.cache.get(key), None)
+		self.assertEqual(self.cache.stats(), dict(hits=1, misses=1, evictions=0, expirations=1, entries=0, bytes=0))
+
+	def test_lru(self):
+		keys = [self.cache.key('m', [i]) for i in range(4)]
+		for key in keys[:3]: self.cache.set(key, '1')
+		# the first becomes the most recently used, so the second goes
+		self.cache.get(keys[0])
+		self.cache.set(keys[3], '1')
+		self.assertEqual(len(self.cache), 3)
+		self.assertIs(self.cache.get(keys[1]), None)
+		self.assertEqual(self.cache.get(keys[0]), '1')
+		self.assertEqual(self.cache.evictions, 1)
+
+	def test_bytes(self):
+		small, large = self.cache.key('m', [1]), self.cache.key('m', [2])
+		self.cache.set(small, 'x' * 400)
+		self.cache.set(large, 'x' * 700)
+		self.assertIs(self.cache.get(small), None)
+		self.assertTrue(self.cache.size <= 1000)
+
+		# too large to ever fit
+		self.cache.set(small, 'x' * 1000)
+		self.assertIs(self.cache.get(small), None)
+		self.assertEqual(self.cache.get(large), 'x' * 700)
+
+	def test_invalidate(self):
+		for method in 'mn':
+			self.cache.set(self.cache.key(method, [1]), '1')
+		self.cache.set(self.cache.key('m', [], dict(a=1)), '1')
+
+		self.assertEqual(self.cache.invalidate('m', self.cache.key('m', [], dict(a=1))), 1)
+		self.assertEqual(self.cache.invalidate('m', self.cache.key('m', [5])), 0)
+		self.assertEqual(self.cache.invalidate('m'), 1)
+		self.assertEqual(len(self.cache), 1)
+		self.assertEqual(self.cache.invalidate(), 1)
+		self.assertEqual((len(self.cache), self.cache.size), (0, 0))
@@ -0,0 +1,100 @@
+#
+#  Copyright (c) 2011 Edward Langley
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#  Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+#  Redistributions in binary form must reproduce the above copyright
+#  notice, this list of conditions and the following disclaimer in the
+#  documentation and/or other materials provided with the distribution.
+#
+#  Neither the name of the project's author nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+#  TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+#  LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+#  NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#  SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+from twisted.trial import unittest
+
+import jsonrpc.common
+import jsonrpc.jsonutil
+from jsonrpc.common import Request, Response
+from jsonrpc.jsonutil import RawJSON
+
+class TestRequest(unittest.TestCase):
+	def test_slots(self):
+		request = Request(1, 'add', (1, 2))
+		self.assertFalse(hasattr(request, '__dict__'))
+		with self.assertRaises(AttributeError):
+			request.other = 1
+
+	def test_from_dict(self):
+		params = dict(a=1, b=2)
+		content = dict(jsonrpc='2.0', id=1, method='add', params=params)
+		request = Request.from_dict(content)
+		self.assertEqual((request.version, request.id, request.method), ('2.0', 1, 'add'))
+		self.assertEqual(request.args, ())
+		self.assertIs(request.kwargs, params)
+		self.assertEqual(request.extra, {})
+		self.assertEqual(content, dict(jsonrpc='2.0', id=1, method='add', params=dict(a=1, b=2)))
+
+	def test_from_dict_unicode(self):
+		params = {u'a': 1, u'\xe9': 2}
+		request = Request.from_dict(dict(jsonrpc='2.0', id=1, method='add', params=params))
+		self.assertIs(request.kwargs, params)
+
+	def test_from_dict_args(self):
+		content = dict(jsonrpc='2.0', id=1, method='add', params={'__args': [1], 'b': 2}, other=3)
+		request = Request.from_dict(content)
+		self.assertEqual(request.args, [1])
+		self.assertEqual(request.kwargs, dict(b=2))
+		self.assertEqual(request.extra, dict(other=3))
+		self.assertIn('__args', content['params'])
+
+		request = Request.from_dict(dict(jsonrpc='2.0', id=1, method='add', params=[1, 2]))
+		self.assertEqual((request.args, request.kwargs), ((1, 2), {}))
+
+	def test_json_equivalent(self):
+		request = Request(1, 'add', (1,), dict(b=2))
+		self.assertEqual(request.json_equivalent()['params'], {'__args': (1,), 'b': 2})
+		self.assertEqual(request.json_equivalent()['params'], {'__args': (1,), 'b': 2})
+		self.assertEqual(request.kwargs, dict(b=2))
+
+class TestResponse(unittest.TestCase):
+	def test_slots(self):
+		self.assertFalse(hasattr(Response(1, 3), '__dict__'))
+
+	def test_encode(self):
+		response = Response(1, dict(a=[1, 2]))
+		self.assertEqual(jsonrpc.jsonutil.decode(response.encode()), dict(jsonrpc='2.0', id=1, result=dict(a=[1, 2])))
+		response = Response(1, error=dict(code=1, message='no'))
+		self.assertEqual(jsonrpc.jsonutil.decode(response.encode()), dict(jsonrpc='2.0', id=1, error=dict(code=1, message='no')))
+
+	def test_encode_raw(self):
+		response = Response('a', RawJSON('{"a":[1,2]}'))
+		self.assertEqual(response.encode(), '{"jsonrpc": "2.0", "id": "a", "result": {"a":[1,2]}}')
+
+	def test_encode_list(self):
+		responses = [Response(1, 3), Response(2, RawJSON('[4]')), Response(3, error=dict(code=1, message='no'))]
+		self.assertEqual(jsonrpc.jsonutil.decode(Response.encode_list(responses)), [
+			dict(jsonrpc='2.0', id=1, result=3),
+			dict(jsonrpc='2.0', id=2, result=[4]),
+			dict(jsonrpc='2.0', id=3, error=dict(code=1, message='no')),
+		])
+		self.assertEqual(jsonrpc.jsonutil.decode(Response.encode_list(responses[:1])), [dict(jsonrpc='2.0', id=1, result=3)])
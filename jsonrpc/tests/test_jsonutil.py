@@ -31,6 +31,7 @@
 #  
 #
 import json
+import StringIO
 from twisted.trial import unittest
 import collections
 
@@ -94,5 +95,106 @@ class TestJSONUTIL(unittest.TestCase):
 
 		self.assertEqual(jsonutil.decode(jsonutil.encode(self.obj3)), self.obj3_roundtrip)
 
+	def test_iterarray(self):
+		data = [self.obj1, self.lis, self.int, self.str, self.none, self.obj2]
+		text = json.dumps(data)
+		for chunksize in (1, 7, 65536):
+			result = list(jsonutil.iterarray(StringIO.StringIO(text), chunksize))
+			self.assertEqual(result, json.loads(text))
+
+		for text in ['', '{}', '[1, 2', '[1 2]', '[1,]', '[1] 2']:
+			self.assertRaises(ValueError, list, jsonutil.iterarray(StringIO.StringIO(text), 2))
+
+class mapping(object):
+	def __init__(self, **kw): self.data = kw
+	def items(self): return self.data.items()
+
+class iterable(object):
+	def __iter__(self): return iter([1, 2])
+
+class opaque(object):
+	def __str__(self): return 'opaque'
+
+class point(object):
+	def __init__(self, x, y): self.x, self.y = x, y
+
+class point3(point):
+	z = 0
+
+class dynamic(object):
+	def __getattr__(self, name):
+		if name == 'json_equivalent': return lambda: 'dynamic'
+		raise AttributeError(name)
+
+class TestEncoders(unittest.TestCase):
+
+	def setUp(self):
+		jsonutil.register_encoder(point, lambda p: dict(x=p.x, y=p.y))
+		self.addCleanup(jsonutil._encoders.pop, point)
+		self.addCleanup(jsonutil._cache.clear)
+
+	def test_register(self):
+		self.assertEqual(json.loads(jsonutil.encode([point(1, testobj())])), [dict(x=1, y=testobj.value)])
+
+	def test_subclass(self):
+		self.assertEqual(json.loads(jsonutil.encode(point3(1, 2))), dict(x=1, y=2))
+
+	def test_dynamic(self):
+		self.assertEqual(json.loads(jsonutil.encode([dynamic(), dynamic()])), ['dynamic', 'dynamic'])
+
+	def test_native(self):
+		self.assertEqual(jsonutil.to_native(dict(a=(point(1, 2),), b=set([1]))), dict(a=[dict(x=1, y=2)], b=[1]))
+
+class BackendConformance(object):
+	'''Every backend registered with jsonutil must pass these'''
+	backend = None
+
+	def setUp(self):
+		previous = jsonutil.get_backend().name
+		try:
+			jsonutil.set_backend(self.backend)
+		except ImportError, e:
+			raise unittest.SkipTest('%s is not available: %s' % (self.backend, e))
+		self.addCleanup(jsonutil.set_backend, previous)
+
+	def roundtrip(self, obj):
+		return json.loads(jsonutil.encode(obj))
+
+	def test_native(self):
+		obj = dict(a=[1, 2.5, 0.1+0.2, 2**62, -3], b=None, c=True, d=u'unicod\xe9', e={'f': []})
+		self.assertEqual(self.roundtrip(obj), obj)
+		self.assertEqual(jsonutil.decode(json.dumps(obj)), obj)
+
+	def test_keys(self):
+		self.assertEqual(self.roundtrip({2: 2}), {'2': 2})
+
+	def test_containers(self):
+		obj = dict(a=(1, 2), b=set([3]), c=frozenset([4]))
+		self.assertEqual(self.roundtrip(obj), dict(a=[1, 2], b=[3], c=[4]))
+
+	def test_json_equivalent(self):
+		self.assertEqual(self.roundtrip([testobj(), dict(a=testobj())]), [testobj.value, dict(a=testobj.value)])
+
+	def test_items(self):
+		self.assertEqual(self.roundtrip([mapping(a=1, b=testobj())]), [dict(a=1, b=testobj.value)])
+
+	def test_iterable(self):
+		self.assertEqual(self.roundtrip(dict(a=iterable())), dict(a=[1, 2]))
+
+	def test_str(self):
+		self.assertEqual(self.roundtrip([opaque()]), ['opaque'])
+
+	def test_bytes(self):
+		obj = dict(a=u'\xe9\u20ac', b=[testobj()])
+		result = jsonutil.encode_bytes(obj)
+		self.assertTrue(isinstance(result, str))
+		self.assertEqual(json.loads(result.decode('utf-8')), dict(a=u'\xe9\u20ac', b=[testobj.value]))
+
+for _name in jsonutil.backends():
+	_test = type('TestBackend_%s' % _name, (BackendConformance, unittest.TestCase), dict(backend=_name))
+	globals()[_test.__name__] = _test
+# otherwise trial finds the last class twice
+del _test, _name
+
 if __name__ == '__main__':
 	unittest.main()
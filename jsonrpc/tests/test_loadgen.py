@@ -0,0 +1,107 @@
+#
+#  Copyright (c) 2011 Edward Langley
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#  Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+#  Redistributions in binary form must reproduce the above copyright
+#  notice, this list of conditions and the following disclaimer in the
+#  documentation and/or other materials provided with the distribution.
+#
+#  Neither the name of the project's author nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+#  TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+#  LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+#  NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#  SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+from twisted.trial import unittest
+from twisted.internet import defer
+
+import jsonrpc.loadgen
+
+# Run example server before tests
+
+class TestStats(unittest.TestCase):
+	def test_percentile(self):
+		values = range(1, 1001)
+		self.assertEqual(jsonrpc.loadgen.percentile(values, 50), 500)
+		self.assertEqual(jsonrpc.loadgen.percentile(values, 99), 990)
+		self.assertEqual(jsonrpc.loadgen.percentile(values, 99.9), 999)
+		self.assertEqual(jsonrpc.loadgen.percentile([3], 99.9), 3)
+		self.assertIs(jsonrpc.loadgen.percentile([], 50), None)
+
+	def test_summary(self):
+		stats = jsonrpc.loadgen.LoadStats()
+		stats.start, stats.end = 10, 12
+		for latency in (0.1, 0.2, 0.3):
+			stats.record('call', latency, 1)
+		stats.record('batch', 0.4, 10, [-32601, -32601])
+		stats.failures['ConnectionRefusedError'] += 1
+		summary = stats.summary()
+		self.assertEqual(summary['requests'], 4)
+		self.assertEqual(summary['calls'], 13)
+		self.assertEqual(summary['requests_per_second'], 2)
+		self.assertEqual(summary['errors'], {-32601: 2})
+		self.assertEqual(summary['failures'], {'ConnectionRefusedError': 1})
+		self.assertEqual(summary['latency']['call']['p50'], 0.2)
+		self.assertEqual(summary['latency']['batch']['count'], 1)
+		self.assertEqual(summary['latency']['all']['max'], 0.4)
+
+	def test_substitute(self):
+		params = [1, '$payload', dict(a=['$payload'])]
+		self.assertEqual(jsonrpc.loadgen.substitute(params, 'xx'), [1, 'xx', dict(a=['xx'])])
+
+class TestLoadGenerator(unittest.TestCase):
+	def setUp(self):
+		self.proxy = jsonrpc.loadgen.make_proxy('http://localhost:8007/aaa', 4)
+		self.addCleanup(self.proxy.close)
+
+	@defer.inlineCallbacks
+	def test_closed(self):
+		generator = jsonrpc.loadgen.LoadGenerator(self.proxy, 'add', [1, 2], concurrency=4, duration=0.2,
+			batch_fraction=0.5, batch_size=5)
+		summary = (yield generator.run()).summary()
+		self.assertGreater(summary['latency']['call']['count'], 0)
+		self.assertGreater(summary['latency']['batch']['count'], 0)
+		self.assertEqual(summary['calls'], summary['latency']['call']['count'] + 5 * summary['latency']['batch']['count'])
+		self.assertEqual(summary['errors'], {})
+		self.assertEqual(summary['failures'], {})
+
+	@defer.inlineCallbacks
+	def test_open(self):
+		generator = jsonrpc.loadgen.LoadGenerator(self.proxy, 'add', dict(a=1, b=2), concurrency=4, duration=0.2, rate=50)
+		summary = (yield generator.run()).summary()
+		self.assertTrue(5 <= summary['requests'] + summary['dropped'] <= 15)
+		self.assertEqual(generator._inflight, 0)
+
+	@defer.inlineCallbacks
+	def test_errors(self):
+		generator = jsonrpc.loadgen.LoadGenerator(self.proxy, 'missingmethod', concurrency=2, duration=0.1,
+			batch_fraction=0.5, batch_size=3)
+		summary = (yield generator.run()).summary()
+		self.assertEqual(summary['errors'], {-32601: summary['calls']})
+
+	@defer.inlineCallbacks
+	def test_failures(self):
+		proxy = jsonrpc.loadgen.make_proxy('http://localhost:1/', 1)
+		self.addCleanup(proxy.close)
+		generator = jsonrpc.loadgen.LoadGenerator(proxy, 'add', [1, 2], concurrency=1, duration=0.05)
+		summary = (yield generator.run()).summary()
+		self.assertEqual(summary['calls'], 0)
+		self.assertGreater(sum(summary['failures'].values()), 0)
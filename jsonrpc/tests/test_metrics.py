@@ -0,0 +1,110 @@
+#
+#  Copyright (c) 2011 Edward Langley
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#  Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+#  Redistributions in binary form must reproduce the above copyright
+#  notice, this list of conditions and the following disclaimer in the
+#  documentation and/or other materials provided with the distribution.
+#
+#  Neither the name of the project's author nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+#  TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+#  LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+#  NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#  SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+from twisted.trial import unittest
+from twisted.internet import defer
+
+import jsonrpc.metrics
+
+class FakeRequest(object):
+	def __init__(self):
+		self.finished = defer.Deferred()
+
+	def notifyFinish(self):
+		return self.finished
+
+class TestHistogram(unittest.TestCase):
+	def test_observe(self):
+		histogram = jsonrpc.metrics.Histogram((1, 2))
+		for value in (0.5, 1, 1.5, 3):
+			histogram.observe(value)
+		snapshot = histogram.snapshot()
+		self.assertEqual(snapshot['buckets'], [(1, 2), (2, 3), (float('inf'), 4)])
+		self.assertEqual((snapshot['count'], snapshot['sum']), (4, 6.0))
+
+class TestMetrics(unittest.TestCase):
+	def setUp(self):
+		self.metrics = jsonrpc.metrics.Metrics((1, 2))
+
+	def test_calls(self):
+		self.metrics.call_started('add')
+		self.metrics.call_started('add')
+		self.assertEqual(self.metrics.stats()['methods']['add']['in_flight'], 2)
+
+		self.metrics.call_finished('add', queue=0.5, execute=1.5)
+		self.metrics.call_finished('add', error=True, execute=3)
+		self.metrics.call_rejected('add')
+		self.metrics.cache_hit('add')
+
+		add = self.metrics.stats()['methods']['add']
+		self.assertEqual((add['calls'], add['errors'], add['cache_hits'], add['in_flight']), (3, 2, 1, 0))
+		self.assertEqual(add['queue']['count'], 1)
+		self.assertEqual(add['execute']['buckets'], [(1, 0), (2, 1), (float('inf'), 2)])
+
+	def test_unknown(self):
+		self.metrics.call_started('made up')
+		self.assertEqual(self.metrics.stats()['methods']['made up']['in_flight'], 1)
+		self.metrics.call_finished('made up', error=True, execute=0.5, found=False)
+		methods = self.metrics.stats()['methods']
+		self.assertEqual(methods.keys(), [jsonrpc.metrics.UNKNOWN])
+		self.assertEqual(methods[jsonrpc.metrics.UNKNOWN]['errors'], 1)
+
+	def test_requests(self):
+		now = [10]
+		request = FakeRequest()
+		self.metrics.request_started(request, lambda: now[0])
+		self.metrics.observe('parse', 0.5)
+		self.assertEqual(self.metrics.stats()['requests']['in_flight'], 1)
+
+		now[0] = 11.5
+		request.finished.callback(None)
+		requests = self.metrics.stats()['requests']
+		self.assertEqual((requests['count'], requests['in_flight']), (1, 0))
+		self.assertEqual(requests['phases']['parse']['sum'], 0.5)
+		self.assertEqual(requests['phases']['total']['sum'], 1.5)
+		self.assertEqual(requests['phases']['encode']['count'], 0)
+
+	def test_prometheus(self):
+		self.metrics.call_started('say "hi"')
+		self.metrics.call_finished('say "hi"', execute=0.5)
+		stats = self.metrics.stats()
+		stats['threadpool'] = dict(threads=10, busy=1, calls=2, queued=1)
+		text = jsonrpc.metrics.prometheus(stats)
+
+		self.assertIn('# TYPE jsonrpc_calls_total counter\n', text)
+		self.assertIn('jsonrpc_calls_total{method="say \\"hi\\""} 1\n', text)
+		self.assertIn('jsonrpc_call_seconds_bucket{method="say \\"hi\\"",phase="execute",le="1"} 1\n', text)
+		self.assertIn('jsonrpc_call_seconds_bucket{method="say \\"hi\\"",phase="execute",le="+Inf"} 1\n', text)
+		self.assertIn('jsonrpc_call_seconds_count{method="say \\"hi\\"",phase="queue"} 0\n', text)
+		self.assertIn('jsonrpc_request_seconds_sum{phase="parse"} 0.0\n', text)
+		self.assertIn('jsonrpc_threadpool_queued 1\n', text)
+		self.assertNotIn('jsonrpc_cache_', text)
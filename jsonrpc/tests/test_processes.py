@@ -0,0 +1,129 @@
+#
+#  Copyright (c) 2011 Edward Langley
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#  Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+#  Redistributions in binary form must reproduce the above copyright
+#  notice, this list of conditions and the following disclaimer in the
+#  documentation and/or other materials provided with the distribution.
+#
+#  Neither the name of the project's author nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+#  TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+#  LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+#  NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#  SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+import os
+import time
+from twisted.trial import unittest
+import StringIO
+
+import jsonrpc.server
+import jsonrpc.processes
+import jsonrpc.common
+import jsonrpc.jsonutil
+
+from twisted.web.test.test_web import DummyRequest
+from twisted.internet import reactor, task
+
+@jsonrpc.server.execution_policy(jsonrpc.server.PROCESS)
+def pid(a, b=0):
+	return [os.getpid(), a+b]
+
+def fail(kind):
+	if kind == 'rpc': raise jsonrpc.common.InvalidRequest
+	raise ValueError('bad value', 1)
+
+def circular():
+	result = []
+	result.append(result)
+	return result
+
+def die():
+	os._exit(1)
+
+def nap(seconds):
+	time.sleep(seconds)
+	return seconds
+
+class ProcessEventHandler(jsonrpc.server.ServerEvents):
+	processes = 2
+	def log(self, result, request, error=False): pass
+
+	def findmethod(self, method, *_, **__):
+		if method == 'pid': return pid
+
+class TestProcessPool(unittest.TestCase):
+
+	def setUp(self):
+		self.pool = jsonrpc.processes.ProcessPool(1)
+		self.addCleanup(self.pool.stop)
+
+	def test_call(self):
+		d = self.pool.call(pid, (1,), dict(b=2))
+		@d.addCallback
+		def _check(result):
+			self.assertNotEqual(result[0], os.getpid())
+			self.assertEqual(result[1], 3)
+		return d
+
+	def test_error(self):
+		return self.assertFailure(self.pool.call(fail, ('value',)), jsonrpc.processes.ProcessError)
+
+	def test_rpcerror(self):
+		return self.assertFailure(self.pool.call(fail, ('rpc',)), jsonrpc.common.InvalidRequest)
+
+	def test_unencodable(self):
+		return self.assertFailure(self.pool.call(circular), jsonrpc.processes.ProcessError)
+
+	def test_timeout(self):
+		self.pool.timeout = 0.5
+		return self.assertFailure(self.pool.call(die), jsonrpc.processes.ProcessError)
+
+	def test_nothread(self):
+		d = self.pool.call(nap, (0.2,))
+		# waiting for the call doesn't hold one of the reactor's threads
+		checked = task.deferLater(reactor, 0.1, lambda: self.assertEqual(reactor.getThreadPool().working, []))
+		return checked.addCallback(lambda _: d).addCallback(self.assertEqual, 0.2)
+
+	def test_notmodulelevel(self):
+		self.assertRaises(TypeError, self.pool.call, lambda: None)
+		self.assertFalse(self.pool.started)
+
+class TestProcessPolicy(unittest.TestCase):
+
+	def test_server(self):
+		resource = jsonrpc.server.JSON_RPC().customize(ProcessEventHandler)
+		self.addCleanup(resource.eventhandler.processpool.stop)
+
+		request = DummyRequest([''])
+		request.content = StringIO.StringIO('{"jsonrpc": "2.0", "params": {"a": 1, "b": 2}, "method": "pid", "id": 1}')
+		d = request.notifyFinish()
+		resource.render(request)
+
+		@d.addCallback
+		def _check(_):
+			data = jsonrpc.jsonutil.decode(request.written[0])
+			self.assertEqual(data['result'][1], 3)
+			self.assertNotEqual(data['result'][0], os.getpid())
+		return d
+
+if __name__ == '__main__':
+	unittest.main()
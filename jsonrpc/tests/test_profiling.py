@@ -0,0 +1,155 @@
+#
+#  Copyright (c) 2011 Edward Langley
+#  All rights reserved.
+#
+#  Redistribution and use in source and binary forms, with or without
+#  modification, are permitted provided that the following conditions
+#  are met:
+#
+#  Redistributions of source code must retain the above copyright notice,
+#  this list of conditions and the following disclaimer.
+#
+#  Redistributions in binary form must reproduce the above copyright
+#  notice, this list of conditions and the following disclaimer in the
+#  documentation and/or other materials provided with the distribution.
+#
+#  Neither the name of the project's author nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+#  HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+#  SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED
+#  TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+#  LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+#  NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+#  SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+#
+import time
+import pstats
+import marshal
+import StringIO
+
+from twisted.trial import unittest
+from twisted.internet import defer
+from twisted.web.test.test_web import DummyRequest
+
+import jsonrpc.server
+import jsonrpc.profiling
+
+def spin(seconds):
+	end = time.time() + seconds
+	while time.time() < end:
+		pass
+
+def slow(seconds):
+	spin(seconds)
+	return 'done'
+
+class TestProfiler(unittest.TestCase):
+	def tearDown(self):
+		self.profiler.stop()
+
+	def test_threshold(self):
+		self.profiler = jsonrpc.profiling.Profiler(threshold=0.02, interval=0.001)
+		self.assertEqual(self.profiler.call('slow', slow, (0.1,), {}), 'done')
+		self.assertEqual(self.profiler.call('fast', slow, (0,), {}), 'done')
+		self.assertEqual(self.profiler.calls, dict(slow=1))
+
+		stacks = self.profiler.stacks('slow')
+		self.assertTrue(sum(stacks.values()) > 10)
+		# the stacks start at the function called
+		self.assertEqual(set(stack[0][2] for stack in stacks), set(['slow']))
+		self.assertIn(('slow', 'spin'), set(tuple(name for _, _, name in stack[:2]) for stack in stacks))
+		self.assertEqual(self.profiler.stacks('fast'), {})
+
+	def test_sample(self):
+		self.profiler = jsonrpc.profiling.Profiler(sample=1, interval=0.001)
+		self.profiler.call('slow', slow, (0.02,), {})
+		self.profiler.call('slow', slow, (0,), {})
+		self.assertEqual(self.profiler.calls, dict(slow=2))
+
+		self.profiler.reset()
+		self.assertEqual((self.profiler.calls, self.profiler.stacks()), ({}, {}))
+
+		self.profiler.sample = 0
+		self.profiler.call('slow', slow, (0.02,), {})
+		self.assertEqual(self.profiler.calls, {})
+
+	def test_exception(self):
+		self.profiler = jsonrpc.profiling.Profiler(sample=1, interval=0.001)
+		self.assertRaises(ZeroDivisionError, self.profiler.call, 'div', lambda: 1/0, (), {})
+		self.assertEqual(self.profiler.calls, dict(div=1))
+		self.assertEqual(self.profiler._active, [])
+
+	def test_output(self):
+		self.profiler = jsonrpc.profiling.Profiler(interval=0.01)
+		slowcode, spincode = slow.__code__, spin.__code__
+		slowkey = (slowcode.co_filename, slowcode.co_firstlineno, 'slow')
+		spinkey = (spincode.co_filename, spincode.co_firstlineno, 'spin')
+		self.profiler._stacks['slow'] = jsonrpc.profiling.collections.Counter({(slowkey,): 2, (slowkey, spinkey): 3})
+
+		lines = self.profiler.collapsed().splitlines()
+		self.assertEqual(len(lines), 2)
+		self.assertTrue(lines[1].startswith('slow (%s:%d);spin (' % (slowcode.co_filename, slowcode.co_firstlineno)))
+		self.assertTrue(lines[1].endswith(' 3'))
+
+		stats = self.profiler.pstats('slow')
+		cc, nc, tt, ct, callers = stats[slowkey]
+		self.assertEqual((nc, round(tt, 6), round(ct, 6)), (5, 0.02, 0.05))
+		self.assertEqual(round(stats[spinkey][2], 6), 0.03)
+		self.assertEqual(stats[spinkey][4].keys(), [slowkey])
+
+		path = self.mktemp()
+		self.profiler.dump(path)
+		self.assertEqual(pstats.Stats(path).total_calls, 8)
+		self.profiler.dump(path, format='collapsed')
+		self.assertEqual(open(path).read(), self.profiler.collapsed())
+		self.assertRaises(ValueError, self.profiler.dump, path, format='svg')
+
+
+class ProfiledEventHandler(jsonrpc.server.ServerEvents):
+	profile_threshold = 0.02
+	profile_interval = 0.001
+
+	@jsonrpc.server.expose
+	def slow(self, seconds):
+		return slow(seconds)
+
+class TestProfiledServer(unittest.TestCase):
+	def _call(self, resource, method, params):
+		request = DummyRequest([''])
+		request.content = StringIO.StringIO(jsonrpc.jsonutil.encode(dict(jsonrpc='2.0', id=1, method=method, params=params)))
+		d = request.notifyFinish()
+		resource.render(request)
+		return d.addCallback(lambda _: jsonrpc.jsonutil.decode(request.written[0]))
+
+	@defer.inlineCallbacks
+	def test_server(self):
+		resource = jsonrpc.server.JSON_RPC().customize(ProfiledEventHandler)
+		profiler = resource.eventhandler.profiler
+		self.addCleanup(profiler.stop)
+		self.assertEqual((yield self._call(resource, 'slow', [0.1]))['result'], 'done')
+		self.assertEqual((yield self._call(resource, 'slow', [0]))['result'], 'done')
+		self.assertEqual(profiler.calls, dict(slow=1))
+
+		request = DummyRequest([''])
+		request.args = dict(method=['slow'])
+		text = jsonrpc.profiling.ProfileResource(resource).render_GET(request)
+		self.assertIn('slow (', text)
+
+		request.args = dict(format=['pstats'])
+		data = jsonrpc.profiling.ProfileResource(resource).render_GET(request)
+		self.assertEqual(marshal.loads(data), profiler.pstats())
+
+	def test_off(self):
+		resource = jsonrpc.server.JSON_RPC().customize(jsonrpc.server.ServerEvents)
+		self.assertIs(resource.eventhandler.profiler, None)
+		request = DummyRequest([''])
+		jsonrpc.profiling.ProfileResource(resource).render_GET(request)
+		self.assertEqual(request.responseCode, 404)
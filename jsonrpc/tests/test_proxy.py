@@ -3,6 +3,9 @@ import jsonrpc.proxy
 from twisted.trial import unittest
 import mock
 import urllib
+import urllib2
+import socket
+import threading
 import StringIO
 
 # Run example server before tests
@@ -64,8 +67,262 @@ class TestJSONRPCProxy(unittest.TestCase):
 		self.assertEqual(self.proxy.batch_call(batch), [(3, None), (1, None), (4, None)])
 
 
+	def test_batchcall_chunks(self):
+		batch = [ ('add', [ (i,1), {} ]) for i in range(7) ]
+		expected = [ (i+1, None) for i in range(7) ]
+		with mock.patch.object(self.proxy, '_post', wraps=self.proxy._post) as post:
+			self.assertEqual(self.proxy.batch_call(batch, chunk_size=3), expected)
+		self.assertEqual(post.call_count, 3)
+		self.assertEqual(self.proxy.batch_call(batch, chunk_size=2, concurrency=3), expected)
+
+	def test_iter_batchcall(self):
+		batch = [ ('add', [ (i,1), {} ]) for i in range(7) ]
+		results = list(self.proxy.iter_batch_call(batch, chunk_size=2, concurrency=2))
+		self.assertEqual(sorted(results), [ (i, (i+1, None)) for i in range(7) ])
+
+	def test_batch_outputs(self):
+		chunk = [ jsonrpc.common.Request(id, 'add', (1,2)) for id in ('a', 'b', 'c') ]
+		respdata = '[{"jsonrpc": "2.0", "id": "c", "result": 3}, {"jsonrpc": "2.0", "id": "a", "result": 1}]'
+		outputs = self.proxy._get_batch_outputs(respdata, 10, chunk)
+		self.assertEqual([index for index, _ in outputs], [10, 11, 12])
+		self.assertEqual(outputs[0][1], (1, None))
+		self.assertEqual(outputs[1][1][1]['message'], 'No response for this call.')
+		self.assertEqual(outputs[2][1], (3, None))
+
+		respdata = '{"jsonrpc": "2.0", "id": null, "error": {"code": -32600, "message": "Invalid Request."}}'
+		outputs = self.proxy._get_batch_outputs(respdata, 0, chunk)
+		self.assertEqual([output[1]['code'] for _, output in outputs], [-32600]*3)
+
+	def test_stubs(self):
+		add = self.proxy.add
+		self.assertIs(self.proxy.add, add)
+		self.assertEqual(add._serviceName, 'add')
+		self.assertIs(add._opener, self.proxy._opener)
+		self.assertIs(add._pool, self.proxy._pool)
+		self.assertIs(add._eventhandler, self.proxy._eventhandler)
+		self.assertEqual(self.proxy.math.add._serviceName, 'math.add')
+		self.assertIs(self.proxy.math.add, self.proxy.math.add)
+
+	def test_stubs_bounded(self):
+		self.proxy.max_stubs = 4
+		add = self.proxy.add
+		for i in range(10):
+			getattr(self.proxy, 'method%d' % i)
+			self.assertIs(self.proxy.add, add)
+		self.assertEqual(len(self.proxy._stubs), 4)
+		self.assertEqual(list(self.proxy._stubs)[-2:], ['method9', 'add'])
+
+	def test_call_name(self):
+		# call uses the name as it is, the stub it makes is shared with attribute access
+		math = self.proxy.math
+		self.assertEqual(math.call('add', 1, 2), 3)
+		self.assertIs(math.call.__self__, math)
+		self.assertIs(self.proxy._stubs['add'], self.proxy.add)
+		self.assertEqual(math.add._serviceName, 'math.add')
+
+	def test_call_shares_transport(self):
+		self.assertEqual(self.proxy.call('add', 1, 2), 3)
+		self.assertIs(self.proxy.call.__self__, self.proxy)
+		self.assertIs(self.proxy._stubs['add'], self.proxy.add)
+		self.assertEqual(self.proxy._pool.idle(('http', 'localhost:8007', None)), 1)
+
+	def test_keepalive(self):
+		key = ('http', 'localhost:8007', None)
+		self.assertEqual(self.proxy.add(1,2), 3)
+		self.assertEqual(self.proxy._pool.idle(key), 1)
+		conn = self.proxy._pool._idle[key][0][0]
+
+		self.assertEqual(self.proxy.subtract(2,1), 1)
+		self.assertEqual(self.proxy._pool.idle(key), 1)
+		self.assertIs(self.proxy._pool._idle[key][0][0], conn)
+
+		self.proxy.close()
+		self.assertEqual(self.proxy._pool.idle(key), 0)
+
+	def test_keepalive_stale(self):
+		key = ('http', 'localhost:8007', None)
+		self.assertEqual(self.proxy.add(1,2), 3)
+		conn = self.proxy._pool._idle[key][0][0]
+		conn.sock.shutdown(socket.SHUT_RDWR)
+
+		self.assertEqual(self.proxy.add(1,3), 4)
+		self.assertEqual(self.proxy._pool.idle(key), 1)
+		self.assertIsNot(self.proxy._pool._idle[key][0][0], conn)
+
+	def test_keepalive_no_replay(self):
+		key = ('http', 'localhost:8007', None)
+		self.assertEqual(self.proxy.add(1,2), 3)
+		conn = self.proxy._pool._idle[key][0][0]
+		with mock.patch.object(conn, 'request', wraps=conn.request) as request:
+			with mock.patch.object(conn, 'getresponse', side_effect=socket.timeout('timed out')):
+				self.assertRaises(urllib2.URLError, self.proxy.add, 1, 3)
+		self.assertEqual(request.call_count, 1)
+		self.assertEqual(self.proxy._pool.idle(key), 0)
+
+	def test_keepalive_default_timeout(self):
+		key = ('http', 'localhost:8007', None)
+		self.assertEqual(self.proxy.add(1,2), 3)
+		self.addCleanup(socket.setdefaulttimeout, socket.getdefaulttimeout())
+		socket.setdefaulttimeout(0.5)
+		conn, reused = self.proxy._pool.get(key)
+		self.assertTrue(reused)
+		self.assertEqual(conn.sock.gettimeout(), 0.5)
+
+	def test_keepalive_disabled(self):
+		class Events(jsonrpc.proxy.ProxyEvents):
+			keepalive = False
+		class Proxy(jsonrpc.proxy.JSONRPCProxy):
+			_eventhandler = Events
+		proxy = Proxy('http://localhost:8007', path='aaa')
+		self.assertIs(proxy._pool, None)
+		self.assertEqual(proxy.add(1,2), 3)
+
+	def test_customize(self):
+		class Events(jsonrpc.proxy.ProxyEvents):
+			keepalive = False
+			cached_methods = {'add': None}
+		proxy = jsonrpc.proxy.JSONRPCProxy('http://localhost:8007', path='aaa')
+		self.assertEqual(proxy.add(1,2), 3)
+		self.assertIs(proxy.customize(Events), proxy)
+		self.assertIs(proxy._pool, None)
+		self.assertIsNot(proxy.cache, None)
+		self.assertEqual(proxy.add(1,2), 3)
+		self.assertEqual(len(proxy.cache), 1)
+
+		proxy.customize(jsonrpc.proxy.ProxyEvents)
+		self.assertIs(proxy.cache, None)
+		self.assertIsNot(proxy._pool, None)
+
+	def _cachingproxy(self, **cached):
+		class Events(jsonrpc.proxy.ProxyEvents):
+			cached_methods = cached
+		class Proxy(jsonrpc.proxy.JSONRPCProxy):
+			_eventhandler = Events
+		return Proxy('http://localhost:8007', path='aaa')
+
+	def test_cache(self):
+		proxy = self._cachingproxy(add=None, subtract=0)
+		self.assertIsNot(proxy.cache, None)
+		self.assertIs(proxy.add.cache, proxy.cache)
+		self.assertIs(self.proxy.cache, None)
+
+		with mock.patch.object(jsonrpc.proxy.JSONRPCProxy, '_post', autospec=True, side_effect=jsonrpc.proxy.JSONRPCProxy._post) as post:
+			self.assertEqual(proxy.add(1,2), 3)
+			self.assertEqual(proxy.add(1,2), 3)
+			self.assertEqual(proxy.call('add', 1, 2), 3)
+			self.assertEqual(proxy.add(a=1, b=2), 3)
+			self.assertEqual(post.call_count, 2)
+
+			# expired straight away
+			self.assertEqual(proxy.subtract(2,1), 1)
+			self.assertEqual(proxy.subtract(2,1), 1)
+			self.assertEqual(post.call_count, 4)
+
+			# errors aren't kept
+			self.assertRaises(jsonrpc.common.RPCError, proxy.add, 1, '2')
+			self.assertRaises(jsonrpc.common.RPCError, proxy.add, 1, '2')
+			self.assertEqual(post.call_count, 6)
+		self.assertEqual(proxy.cache.hits, 2)
+
+	def test_cache_batch(self):
+		proxy = self._cachingproxy(add=None)
+		self.assertEqual(proxy.add(1,1), 2)
+		batch = [ ('add', [ (i,1), {} ]) for i in range(4) ] + [ ('subtract', [ (2,1), {} ]) ]
+		expected = [ (i+1, None) for i in range(4) ] + [ (1, None) ]
+
+		with mock.patch.object(proxy, '_send_chunk', wraps=proxy._send_chunk) as send:
+			self.assertEqual(proxy.batch_call(batch, chunk_size=2), expected)
+			# add(1,1) is left out of the batch requests
+			chunks = [ args[1] for args, _ in send.call_args_list ]
+			self.assertEqual([ [ (request.method, request.args) for request in chunk ] for chunk in chunks ],
+				[ [ ('add', (0,1)), ('add', (2,1)) ], [ ('add', (3,1)), ('subtract', (2,1)) ] ])
+
+			# now all the adds are cached
+			self.assertEqual(proxy.batch_call(batch[:4], concurrency=2), expected[:4])
+			self.assertEqual(send.call_count, 2)
+
+
 	#def test_<testname here>(self):
 	#	pass
 
+class TestIDGen(unittest.TestCase):
+
+	def test_ids(self):
+		class Holder(object):
+			id = jsonrpc.proxy.IDGen()
+		holder = Holder()
+		first, second = holder.id, holder.id
+		self.assertNotEqual(first, second)
+		self.assertEqual(first.split('.')[0], second.split('.')[0])
+		self.assertLessEqual(len(first), 12)
+
+	def test_threads(self):
+		class Holder(object):
+			id = jsonrpc.proxy.IDGen()
+		holder = Holder()
+		ids = []
+		def worker():
+			ids.extend([holder.id for _ in range(1000)])
+		threads = [threading.Thread(target=worker) for _ in range(8)]
+		for thread in threads: thread.start()
+		for thread in threads: thread.join()
+		self.assertEqual(len(set(ids)), 8000)
+
+	def test_fork(self):
+		class Holder(object):
+			id = jsonrpc.proxy.IDGen()
+		holder = Holder()
+		parent = holder.id.split('.')[0]
+		with mock.patch('os.getpid', return_value=-1):
+			child = holder.id.split('.')[0]
+		self.assertNotEqual(parent, child)
+
+	def test_pluggable(self):
+		class Events(jsonrpc.proxy.ProxyEvents):
+			IDGen = jsonrpc.proxy.CounterIDGen()
+		class Proxy(jsonrpc.proxy.JSONRPCProxy):
+			_eventhandler = Events
+		proxy = Proxy('http://localhost:8007', path='aaa')
+		self.assertEqual([proxy.add._get_request().id for _ in range(2)], [1, 2])
+		self.assertEqual(proxy.add(1,2), 3)
+
+
+class TestConnectionPool(unittest.TestCase):
+	key = ('http', 'localhost:8007', None)
+
+	def setUp(self):
+		self.pool = jsonrpc.proxy.ConnectionPool(maxsize=2, idle_timeout=30)
+
+	def test_reuse(self):
+		conn, reused = self.pool.get(self.key)
+		self.assertFalse(reused)
+		self.pool.put(self.key, conn)
+		self.assertEqual(self.pool.get(self.key), (conn, True))
+		self.assertEqual(self.pool.idle(self.key), 0)
+
+	def test_maxsize(self):
+		conns = [mock.Mock() for _ in range(3)]
+		for conn in conns: self.pool.put(self.key, conn)
+		self.assertEqual(self.pool.idle(self.key), 2)
+		self.assertTrue(conns[2].close.called)
+		self.assertFalse(conns[0].close.called)
+
+	def test_idle_timeout(self):
+		conn = mock.Mock()
+		self.pool.put(self.key, conn)
+		self.pool._idle[self.key][0] = (conn, 0)
+		fresh, reused = self.pool.get(self.key)
+		self.assertFalse(reused)
+		self.assertIsNot(fresh, conn)
+		self.assertTrue(conn.close.called)
+
+	def test_close(self):
+		conn = mock.Mock()
+		self.pool.put(self.key, conn)
+		self.pool.close()
+		self.assertTrue(conn.close.called)
+		self.assertEqual(self.pool.idle(self.key), 0)
+
+
 if __name__ == '__main__':
 	unittest.main()
@@ -30,17 +30,24 @@
 #  SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #
 #
+import gc
 import functools
+import operator
+import threading
+import time
 from twisted.trial import unittest
 import StringIO
 
 import mock
 
 import jsonrpc.server
+import jsonrpc.common
 import jsonrpc.jsonutil
+import jsonrpc.metrics
 
 from twisted.web.test.test_web import DummyRequest
 from twisted.internet.defer import succeed, DeferredList
+from twisted.internet import reactor, task, defer
 from twisted.web.static import server
 
 def _render(resource, request):
@@ -61,7 +68,7 @@ class SimpleEventHandler(jsonrpc.server.ServerEvents):
 	def log(self, result, request, error=False): pass
 
 	def findmethod(self, method, *_, **__):
-		if method in set(['echo', 'add']):
+		if method in set(['echo', 'add', 'inline_echo', 'async_echo', 'deferred_echo', 'delayed_echo']):
 			return getattr(self, method)
 
 	def add(self, a,b):
@@ -69,6 +76,123 @@ class SimpleEventHandler(jsonrpc.server.ServerEvents):
 
 	def echo(self, v): return v
 
+	@jsonrpc.server.execution_policy(jsonrpc.server.INLINE)
+	def inline_echo(self, v): return v
+
+	@jsonrpc.server.execution_policy(jsonrpc.server.ASYNC)
+	def async_echo(self, v): return succeed(v)
+
+	def deferred_echo(self, v): return succeed(v)
+
+	@jsonrpc.server.execution_policy(jsonrpc.server.ASYNC)
+	def delayed_echo(self, v): return task.deferLater(reactor, 0.01, lambda: v)
+
+class PooledEventHandler(SimpleEventHandler):
+	threadpool_size = (2, 2)
+	max_queued = 1
+
+	def __init__(self, server):
+		SimpleEventHandler.__init__(self, server)
+		self.release = threading.Event()
+		self.running = 0
+		self.most_running = 0
+		self.lock = threading.Lock()
+
+	def findmethod(self, method, *_, **__):
+		if method in set(['block', 'limited']):
+			return getattr(self, method)
+
+	def block(self, v):
+		self.release.wait(5)
+		return v
+
+	@jsonrpc.server.concurrency_limit(1)
+	def limited(self, v):
+		with self.lock:
+			self.running += 1
+			self.most_running = max(self.most_running, self.running)
+		time.sleep(0.01)
+		with self.lock:
+			self.running -= 1
+		return v
+
+class StreamingEventHandler(SimpleEventHandler):
+	stream_batches = True
+	batch_inflight = 2
+
+	def __init__(self, server):
+		SimpleEventHandler.__init__(self, server)
+		self.running = 0
+		self.most_running = 0
+
+	def findmethod(self, method, *_, **__):
+		if method in set(['slow', 'inline_echo']):
+			return getattr(self, method)
+
+	@jsonrpc.server.execution_policy(jsonrpc.server.ASYNC)
+	def slow(self, v):
+		self.running += 1
+		self.most_running = max(self.most_running, self.running)
+		def _done():
+			self.running -= 1
+			return v
+		return task.deferLater(reactor, 0.001, _done)
+
+class Maths(object):
+	@jsonrpc.server.expose
+	def add(self, a, b): return a+b
+
+	@jsonrpc.server.expose('sub')
+	def subtract(self, a, b): return a-b
+
+	def hidden(self): pass
+
+class DispatchEventHandler(jsonrpc.server.ServerEvents):
+	def log(self, result, request, error=False): pass
+
+	@jsonrpc.server.expose
+	def echo(self, v): return v
+
+	@jsonrpc.server.expose('text.upper', postprocess=True)
+	@jsonrpc.server.execution_policy(jsonrpc.server.INLINE)
+	def upper(self, v): return v.upper()
+
+	def postprocess(self, method, result, args, kwargs):
+		return result + '!'
+
+	def findmethod(self, method, *_, **__):
+		if method == 'legacy_upper':
+			return self.upper, True
+
+DispatchEventHandler.register('maths', Maths())
+DispatchEventHandler.register('neg', operator.neg)
+
+class CachingEventHandler(jsonrpc.server.ServerEvents):
+	def log(self, result, request, error=False): pass
+	cache_ttl = 10
+
+	def __init__(self, server):
+		jsonrpc.server.ServerEvents.__init__(self, server)
+		self.calls = 0
+
+	@jsonrpc.server.expose
+	@jsonrpc.server.cacheable
+	def lookup(self, key, upper=False):
+		self.calls += 1
+		return dict(key=key.upper() if upper else key, values=[1, 2])
+
+	@jsonrpc.server.expose
+	@jsonrpc.server.cacheable(ttl=0)
+	def expired(self):
+		self.calls += 1
+		return self.calls
+
+	@jsonrpc.server.expose
+	@jsonrpc.server.cacheable
+	def fail(self):
+		self.calls += 1
+		raise ValueError('not cached')
+
 def TestResource(setup):
 	def _inner1(tests):
 		@functools.wraps(setup)
@@ -106,7 +230,6 @@ class TestJSONRPCServer(unittest.TestCase):
 		self.assertTrue( resource.eventhandler.processcontent.called )
 		self.assertTrue( resource.eventhandler.defer_with_rpcrequest.called )
 		self.assertTrue( resource.eventhandler.callmethod.called )
-		self.assertTrue( resource.eventhandler.defer.called )
 		self.assertTrue( resource.eventhandler.getresponsecode.called )
 		self.assertTrue( resource.eventhandler.log.called )
 
@@ -247,6 +370,17 @@ class TestJSONRPCServer(unittest.TestCase):
 
 		self.assertEqual(data['result'], self.param)
 
+	def test_extra(self):
+		resource = jsonrpc.server.JSON_RPC().customize(SimpleEventHandler)
+		rpcrequest = jsonrpc.common.Request.from_json('{"jsonrpc": "2.0", "params": {"a": [1]}, "method": "add", "id": 1, "b": [2]}')
+		d = resource._action(DummyRequest(['']), rpcrequest)
+
+		@d.addCallback
+		def _check(response):
+			self.assertEqual(response.result, [1, 2])
+			self.assertEqual(rpcrequest.extra, {"b": [2]})
+		return d
+
 	@TestResource
 	def test_err(self, request, resource):
 		request.content = StringIO.StringIO('{"jsonrpc": "2.0", "params": [1, "sss"], "method": "add", "id": "%s"}' % self.id_)
@@ -260,6 +394,596 @@ class TestJSONRPCServer(unittest.TestCase):
 		self.assertEqual(data['id'], self.id_)
 		self.assertTrue(data.get('error', False))
 
+	def test_inline(self):
+		resource = jsonrpc.server.JSON_RPC().customize(SimpleEventHandler)
+		request = DummyRequest([''])
+		request.content = StringIO.StringIO('{"jsonrpc": "2.0", "params": [1], "method": "inline_echo", "id": "%s"}' % self.id_)
+		resource.render(request)
+
+		# the whole request is served before render returns
+		self.assertTrue(request.finished)
+		data = jsonrpc.jsonutil.decode(request.written[0])
+		self.assertEqual(data['result'], 1)
+
+	@TestResource
+	def test_async(self, request, resource):
+		request.content = StringIO.StringIO('{"jsonrpc": "2.0", "params": [1], "method": "async_echo", "id": "%s"}' % self.id_)
+
+	@test_async
+	def test_async(ignored, self, request, resource):
+		data = jsonrpc.jsonutil.decode(request.written[0])
+		self.assertEqual(data['result'], 1)
+
+	@TestResource
+	def test_threaded_deferred(self, request, resource):
+		request.content = StringIO.StringIO('{"jsonrpc": "2.0", "params": [1], "method": "deferred_echo", "id": "%s"}' % self.id_)
+
+	@test_threaded_deferred
+	def test_threaded_deferred(ignored, self, request, resource):
+		data = jsonrpc.jsonutil.decode(request.written[0])
+		self.assertEqual(data['result'], 1)
+
+	@TestResource
+	def _test_delayed(self, request, resource):
+		request.content = StringIO.StringIO(
+			'[{"jsonrpc": "2.0", "params": [1], "method": "delayed_echo", "id": "1"},'
+				'{"jsonrpc": "2.0", "params": [2], "method": "delayed_echo", "id": "2"}]'
+		)
+
+	@_test_delayed
+	def test_delayed(ignored, self, request, resource):
+		data = jsonrpc.jsonutil.decode(request.written[0])
+		self.assertEqual(sorted(x['result'] for x in data), [1, 2])
+
+	def _render_batch(self, resource, method, count):
+		request = DummyRequest([''])
+		request.content = StringIO.StringIO(jsonrpc.jsonutil.encode([
+			dict(jsonrpc='2.0', method=method, params=[i], id=i) for i in range(count)
+		]))
+		d = request.notifyFinish()
+		resource.render(request)
+		return d.addCallback(lambda _: jsonrpc.jsonutil.decode(request.written[0]))
+
+	def test_serverbusy(self):
+		resource = jsonrpc.server.JSON_RPC().customize(PooledEventHandler)
+		handler = resource.eventhandler
+		self.addCleanup(handler.threadpool.stop)
+
+		# 2 calls run, 1 waits and the last is turned away
+		d = self._render_batch(resource, 'block', 4)
+		self.assertEqual(handler.queued(), 1)
+		handler.release.set()
+
+		@d.addCallback
+		def _check(data):
+			errors = [x['error']['code'] for x in data if 'error' in x]
+			self.assertEqual(errors, [jsonrpc.common.ServerBusy.code])
+			self.assertEqual(sorted(x['result'] for x in data if 'result' in x), [0, 1, 2])
+			self.assertEqual(handler.queued(), 0)
+		return d
+
+	def test_concurrency_limit(self):
+		resource = jsonrpc.server.JSON_RPC().customize(PooledEventHandler)
+		handler = resource.eventhandler
+		handler.max_queued = None
+		self.addCleanup(handler.threadpool.stop)
+
+		d = self._render_batch(resource, 'limited', 4)
+		@d.addCallback
+		def _check(data):
+			self.assertEqual(sorted(x['result'] for x in data), [0, 1, 2, 3])
+			self.assertEqual(handler.most_running, 1)
+		return d
+
+	def _stream(self, body, handler=StreamingEventHandler):
+		resource = jsonrpc.server.JSON_RPC().customize(handler)
+		request = DummyRequest([''])
+		if not isinstance(body, str): body = jsonrpc.jsonutil.encode(body)
+		request.content = StringIO.StringIO(body)
+		d = request.notifyFinish()
+		resource.render(request)
+		return d.addCallback(lambda _: (resource.eventhandler, request))
+
+	def test_stream(self):
+		d = self._stream([dict(jsonrpc='2.0', method='slow', params=[i], id=i) for i in range(10)])
+		@d.addCallback
+		def _check((handler, request)):
+			self.assertTrue(len(request.written) > 1)
+			data = jsonrpc.jsonutil.decode(''.join(request.written))
+			self.assertEqual(sorted(x['result'] for x in data), range(10))
+			self.assertEqual(handler.most_running, 2)
+		return d
+
+	def test_stream_inline(self):
+		# calls which finish at once don't nest
+		d = self._stream([dict(jsonrpc='2.0', method='inline_echo', params=[i], id=i) for i in range(5000)])
+		@d.addCallback
+		def _check((handler, request)):
+			data = jsonrpc.jsonutil.decode(''.join(request.written))
+			self.assertEqual(len(data), 5000)
+		return d
+
+	def test_stream_chunks(self):
+		class Handler(StreamingEventHandler):
+			batch_inflight = None
+			batch_chunk = 100
+		resource = jsonrpc.server.JSON_RPC().customize(Handler)
+		request = DummyRequest([''])
+		request.content = StringIO.StringIO(jsonrpc.jsonutil.encode(
+			[dict(jsonrpc='2.0', method='inline_echo', params=[i], id=i) for i in range(250)]))
+		d = request.notifyFinish()
+		resource.render(request)
+		# the reactor gets a turn before the rest of the batch
+		self.assertFalse(d.called)
+		self.assertEqual(len(request.written), 100)
+
+		@d.addCallback
+		def _check(_):
+			data = jsonrpc.jsonutil.decode(''.join(request.written))
+			self.assertEqual([x['result'] for x in data], range(250))
+		return d
+
+	def test_stream_notifications(self):
+		d = self._stream([dict(jsonrpc='2.0', method='slow', params=[i]) for i in range(3)])
+		@d.addCallback
+		def _check((handler, request)):
+			self.assertEqual(request.written, [])
+		return d
+
+	def test_stream_errors(self):
+		d = self._stream([dict(jsonrpc='2.0', method='slow', params=[1], id=1), dict(jsonrpc='2.0', method='missing', id=2)])
+		@d.addCallback
+		def _check((handler, request)):
+			data = jsonrpc.jsonutil.decode(''.join(request.written))
+			self.assertEqual(sorted(x.get('result') for x in data), [None, 1])
+			self.assertEqual([x['error']['code'] for x in data if 'error' in x], [jsonrpc.common.MethodNotFound.code])
+		return d
+
+	def test_stream_unencodable(self):
+		class Handler(StreamingEventHandler):
+			@jsonrpc.server.expose
+			@jsonrpc.server.execution_policy(jsonrpc.server.INLINE)
+			def circular(self):
+				result = []
+				result.append(result)
+				return result
+		d = self._stream([dict(jsonrpc='2.0', method='circular', id=1), dict(jsonrpc='2.0', method='inline_echo', params=[2], id=2)], Handler)
+		@d.addCallback
+		def _check((handler, request)):
+			data = dict( (x['id'], x) for x in jsonrpc.jsonutil.decode(''.join(request.written)) )
+			self.assertEqual(data[2]['result'], 2)
+			self.assertEqual(data[1]['error']['code'], 0)
+		return d
+
+	def test_stream_uncallable(self):
+		class Handler(StreamingEventHandler):
+			batch_inflight = 1
+			def findmethod(self, method, *_, **__):
+				if method == 'echo': return self.echo
+				return StreamingEventHandler.findmethod(self, method)
+			def defer(self, method, *a, **kw):
+				raise RuntimeError('no threads')
+		body = [dict(jsonrpc='2.0', method='slow', params=[0], id=0), dict(jsonrpc='2.0', method='echo', params=[1], id=1),
+			dict(jsonrpc='2.0', method='slow', params=[2], id=2)]
+		d = self._stream(body, Handler)
+		@d.addCallback
+		def _check((handler, request)):
+			data = sorted(jsonrpc.jsonutil.decode(''.join(request.written)), key=lambda item: item['id'])
+			self.assertEqual([item['id'] for item in data], [0, 1, 2])
+			self.assertEqual(data[1]['error']['message'], 'no threads')
+			self.assertEqual(data[2]['result'], 2)
+		return d
+
+	def test_stream_malformed(self):
+		d = self._stream('[{"jsonrpc": "2.0", "method": "slow", "params": [1], "id": 1}, 5, {"jsonrpc": "2.0", "method": "slow", "params": [2], "id": 2}, {"jsonrpc": "2.')
+		@d.addCallback
+		def _check((handler, request)):
+			data = jsonrpc.jsonutil.decode(''.join(request.written))
+			self.assertEqual(sorted(x['result'] for x in data if 'result' in x), [1, 2])
+			self.assertEqual(sorted(x['error']['code'] for x in data if 'error' in x),
+				[jsonrpc.common.ParseError.code, jsonrpc.common.InvalidRequest.code])
+		return d
+
+	def test_stream_batchlength(self):
+		class Handler(StreamingEventHandler):
+			max_batch_length = 3
+		d = self._stream([dict(jsonrpc='2.0', method='slow', params=[i], id=i) for i in range(10)], Handler)
+		@d.addCallback
+		def _check((handler, request)):
+			data = jsonrpc.jsonutil.decode(''.join(request.written))
+			self.assertEqual(len(data), 4)
+			self.assertEqual([x['error']['code'] for x in data if 'error' in x], [jsonrpc.common.RequestTooLarge.code])
+		return d
+
+	def test_batchlength(self):
+		class Handler(SimpleEventHandler):
+			max_batch_length = 1
+		d = self._stream([dict(jsonrpc='2.0', method='echo', params=[i], id=i) for i in range(2)], Handler)
+		@d.addCallback
+		def _check((handler, request)):
+			data = jsonrpc.jsonutil.decode(''.join(request.written))
+			self.assertEqual(data['error']['code'], jsonrpc.common.RequestTooLarge.code)
+		return d
+
+	def test_bodysize(self):
+		class Handler(StreamingEventHandler):
+			max_body_size = 100
+		d = self._stream([dict(jsonrpc='2.0', method='slow', params=[i], id=i) for i in range(10)], Handler)
+		@d.addCallback
+		def _check((handler, request)):
+			data = jsonrpc.jsonutil.decode(''.join(request.written))
+			self.assertEqual(data['error']['code'], jsonrpc.common.RequestTooLarge.code)
+			self.assertEqual(handler.most_running, 0)
+		return d
+
+	def test_offload(self):
+		class Handler(SimpleEventHandler):
+			offload_threshold = 10
+		resource = jsonrpc.server.JSON_RPC().customize(Handler)
+		resource.eventhandler.defer = mock.Mock(wraps=resource.eventhandler.defer)
+
+		request = DummyRequest([''])
+		request.content = StringIO.StringIO('{"jsonrpc": "2.0", "params": [1], "method": "inline_echo", "id": 1}')
+		d = request.notifyFinish()
+		resource.render(request)
+
+		@d.addCallback
+		def _check(_):
+			data = jsonrpc.jsonutil.decode(request.written[0])
+			self.assertEqual(data['result'], 1)
+			# the decode and the encode
+			self.assertEqual(resource.eventhandler.defer.call_count, 2)
+		return d
+
+	@defer.inlineCallbacks
+	def test_offload_response(self):
+		class Handler(SimpleEventHandler):
+			offload_threshold = 10000
+			def findmethod(self, method, *_, **__):
+				if method == 'numbers': return self.numbers
+			@jsonrpc.server.execution_policy(jsonrpc.server.INLINE)
+			def numbers(self, count):
+				return [dict(n=i, name='number %d' % i) for i in range(count)]
+		resource = jsonrpc.server.JSON_RPC().customize(Handler)
+		handler = resource.eventhandler
+		handler.defer = mock.Mock(wraps=handler.defer)
+
+		# a small request whose response is large
+		data = yield self._call(resource, 'numbers', [1000])
+		self.assertEqual(len(data['result']), 1000)
+		self.assertEqual(handler.defer.call_count, 1)
+
+		data = yield self._call(resource, 'numbers', [10])
+		self.assertEqual(len(data['result']), 10)
+		self.assertEqual(handler.defer.call_count, 1)
+
+	def test_estimate(self):
+		for obj in ([], {}, 'text', [1, 2, 3], [dict(a=i, b='x' * 10) for i in range(1000)], dict(a=[[1, 2]] * 50)):
+			size = len(jsonrpc.jsonutil.encode(obj, separators=(',', ':')))
+			self.assertTrue(size / 2 <= jsonrpc.server._estimate(obj) <= size * 2, obj)
+
+	def test_offload_parseerror(self):
+		class Handler(SimpleEventHandler):
+			offload_threshold = 10
+		resource = jsonrpc.server.JSON_RPC().customize(Handler)
+
+		request = DummyRequest([''])
+		request.content = StringIO.StringIO('{"jsonrpc": "2.0", "params": [1], "method": "inline_echo"')
+		d = request.notifyFinish()
+		resource.render(request)
+
+		resource.eventhandler.log = mock.Mock()
+		@d.addCallback
+		def _check(_):
+			data = jsonrpc.jsonutil.decode(request.written[0])
+			self.assertEqual(data['error']['code'], jsonrpc.common.ParseError.code)
+			resource.eventhandler.log.assert_any_call(None, request, True)
+		return d
+
+	def test_policy(self):
+		handler = SimpleEventHandler(None)
+		rpcrequest = lambda method: jsonrpc.common.Request(1, method)
+		self.assertEqual(handler.getpolicy(rpcrequest('echo')), jsonrpc.server.THREAD)
+		self.assertEqual(handler.getpolicy(rpcrequest('inline_echo')), jsonrpc.server.INLINE)
+		self.assertEqual(handler.getpolicy(rpcrequest('async_echo')), jsonrpc.server.ASYNC)
+		self.assertEqual(handler.getpolicy(rpcrequest('non_existent')), jsonrpc.server.INLINE)
+		self.assertRaises(ValueError, jsonrpc.server.execution_policy, 'nonsense')
+
+	def _call(self, resource, method, params):
+		request = DummyRequest([''])
+		request.content = StringIO.StringIO(jsonrpc.jsonutil.encode(dict(jsonrpc='2.0', id=1, method=method, params=params)))
+		d = request.notifyFinish()
+		resource.render(request)
+		return d.addCallback(lambda _: jsonrpc.jsonutil.decode(request.written[0]))
+
+	def test_dispatch(self):
+		handler = DispatchEventHandler(None)
+		self.assertEqual(set(handler.dispatch), set(['echo', 'text.upper', 'maths.add', 'maths.sub', 'neg']))
+		self.assertRaises(TypeError, operator.setitem, handler.dispatch, 'other', None)
+
+		entry = handler.dispatch['text.upper']
+		self.assertEqual(entry.policy, jsonrpc.server.INLINE)
+		self.assertTrue(entry.postprocess)
+		self.assertEqual(entry.signature.argspec.args, ['v'])
+		self.assertEqual(handler.dispatch['echo'].policy, jsonrpc.server.THREAD)
+		self.assertIs(handler.findentry('echo'), handler.dispatch['echo'])
+		self.assertIs(handler.findentry('hidden'), None)
+
+		# registrations belong to the class they were made on
+		self.assertEqual(jsonrpc.server.ServerEvents._registry, {})
+
+	@defer.inlineCallbacks
+	def test_dispatch_call(self):
+		resource = jsonrpc.server.JSON_RPC().customize(DispatchEventHandler)
+		self.assertEqual((yield self._call(resource, 'echo', [1]))['result'], 1)
+		self.assertEqual((yield self._call(resource, 'maths.add', [1, 2]))['result'], 3)
+		self.assertEqual((yield self._call(resource, 'maths.sub', dict(a=3, b=1)))['result'], 2)
+		self.assertEqual((yield self._call(resource, 'neg', [1]))['result'], -1)
+		self.assertEqual((yield self._call(resource, 'maths.hidden', []))['error']['code'], jsonrpc.common.MethodNotFound.code)
+
+	def test_signature(self):
+		def method(a, b=1, *args, **kwargs): pass
+		signature = jsonrpc.server.Signature.of(method)
+		signature.check((1, 2, 3), {})
+		signature.check((), dict(a=1, c=2))
+		self.assertRaises(jsonrpc.common.InvalidParams, signature.check, (), {})
+		self.assertRaises(jsonrpc.common.InvalidParams, signature.check, (1,), dict(a=1))
+
+		signature = jsonrpc.server.Signature.of(Maths().add)
+		self.assertEqual(signature.argspec.args, ['a', 'b'])
+		signature.check((1,), dict(b=2))
+		self.assertRaises(jsonrpc.common.InvalidParams, signature.check, (1, 2, 3), {})
+		self.assertRaises(jsonrpc.common.InvalidParams, signature.check, (1, 2), dict(c=3))
+		self.assertIs(jsonrpc.server.Signature.of(object()), None)
+
+		signature = jsonrpc.server.Signature.of(lambda a, b=1, *args: None)
+		self.assertEqual(signature.bind((1,), {}), ((), dict(a=1, b=1)))
+		self.assertEqual(signature.bind((1, 2, 3), {}), ((3,), dict(a=1, b=2)))
+		self.assertEqual(signature.bind((), dict(a=1, b=2)), ((), dict(a=1, b=2)))
+
+	@defer.inlineCallbacks
+	def test_invalid_params(self):
+		resource = jsonrpc.server.JSON_RPC().customize(DispatchEventHandler)
+		resource.eventhandler.defer = mock.Mock(wraps=resource.eventhandler.defer)
+		code = jsonrpc.common.InvalidParams.code
+		self.assertEqual((yield self._call(resource, 'maths.add', [1, 2, 3]))['error']['code'], code)
+		self.assertEqual((yield self._call(resource, 'maths.add', [1]))['error']['code'], code)
+		self.assertEqual((yield self._call(resource, 'maths.add', dict(a=1, c=2)))['error']['code'], code)
+		self.assertEqual((yield self._call(resource, 'echo', []))['error']['code'], code)
+		# turned away before taking a thread
+		self.assertFalse(resource.eventhandler.defer.called)
+
+		error = (yield self._call(resource, 'maths.add', [1]))['error']
+		self.assertEqual(error['message'], "Invalid params. missing param 'b'")
+
+		error = (yield self._call(resource, 'maths.add', {u'\xe9': 1}))['error']
+		self.assertEqual(error['code'], code)
+
+	@defer.inlineCallbacks
+	def test_unicode_kwargs(self):
+		class Handler(DispatchEventHandler):
+			@jsonrpc.server.expose
+			def options(self, name, **options):
+				return dict(options, name=name)
+		resource = jsonrpc.server.JSON_RPC().customize(Handler)
+		# the names are decoded as unicode and passed to the method as they are
+		data = yield self._call(resource, 'options', {u'name': u'x', u'caf\xe9': 1, u'\u540d': 2})
+		self.assertEqual(data['result'], {u'name': u'x', u'caf\xe9': 1, u'\u540d': 2})
+
+	@defer.inlineCallbacks
+	def test_invalid_args(self):
+		body = jsonrpc.jsonutil.encode([
+			dict(jsonrpc='2.0', method='maths.add', params=dict(__args=5), id=1),
+			dict(jsonrpc='2.0', method='maths.add', params=[1, 2], id=2),
+		])
+		for handler in (DispatchEventHandler, type('Streaming', (DispatchEventHandler,), dict(stream_batches=True))):
+			resource = jsonrpc.server.JSON_RPC().customize(handler)
+			request = DummyRequest([''])
+			request.content = StringIO.StringIO(body)
+			d = request.notifyFinish()
+			resource.render(request)
+			yield d
+
+			data = sorted(jsonrpc.jsonutil.decode(''.join(request.written)), key=lambda item: item['id'])
+			self.assertEqual([item['id'] for item in data], [1, 2])
+			self.assertEqual(data[0]['error']['code'], jsonrpc.common.InvalidParams.code)
+			self.assertEqual(data[1]['result'], 3)
+
+	@defer.inlineCallbacks
+	def test_invalid_params_findmethod(self):
+		resource = jsonrpc.server.JSON_RPC().customize(SimpleEventHandler)
+		self.assertEqual((yield self._call(resource, 'echo', [1, 2]))['error']['code'], jsonrpc.common.InvalidParams.code)
+		self.assertEqual((yield self._call(resource, 'echo', [1]))['result'], 1)
+
+	@defer.inlineCallbacks
+	def test_postprocess_thread_deferred(self):
+		class Handler(DispatchEventHandler):
+			@jsonrpc.server.expose(postprocess=True)
+			def later(self, v):
+				self.called_in = threading.current_thread()
+				return defer.succeed(v)
+
+			def postprocess(self, method, result, args, kwargs):
+				self.postprocessed_in = threading.current_thread()
+				return result + '!'
+		resource = jsonrpc.server.JSON_RPC().customize(Handler)
+		self.assertEqual((yield self._call(resource, 'later', ['a']))['result'], 'a!')
+		self.assertIsNot(resource.eventhandler.called_in, threading.current_thread())
+		self.assertIs(resource.eventhandler.postprocessed_in, threading.current_thread())
+
+	@defer.inlineCallbacks
+	def test_findmethod_once(self):
+		resource = jsonrpc.server.JSON_RPC().customize(SimpleEventHandler)
+		handler = resource.eventhandler
+		with mock.patch.object(handler, 'findmethod', wraps=handler.findmethod) as findmethod:
+			self.assertEqual((yield self._call(resource, 'add', [1, 2]))['result'], 3)
+			self.assertEqual(findmethod.call_count, 1)
+			self.assertEqual((yield self._call(resource, 'echo', ['a']))['result'], 'a')
+			self.assertEqual(findmethod.call_count, 2)
+		self.assertEqual(handler._entries, {})
+
+	@defer.inlineCallbacks
+	def test_signature_cache_closures(self):
+		class Handler(SimpleEventHandler):
+			def findmethod(self, method, *_, **__):
+				def add(a, b): return a+b
+				return add
+		resource = jsonrpc.server.JSON_RPC().customize(Handler)
+		for i in range(20):
+			self.assertEqual((yield self._call(resource, 'add', [i, 1]))['result'], i+1)
+		gc.collect()
+		self.assertLessEqual(len(resource.eventhandler._signatures), 1)
+
+	@defer.inlineCallbacks
+	def test_postprocess(self):
+		resource = jsonrpc.server.JSON_RPC().customize(DispatchEventHandler)
+		self.assertEqual((yield self._call(resource, 'text.upper', ['a']))['result'], 'A!')
+		# findmethod can still ask for postprocessing by returning a pair
+		self.assertEqual((yield self._call(resource, 'legacy_upper', ['a']))['result'], 'A!')
+
+	@defer.inlineCallbacks
+	def test_cache(self):
+		resource = jsonrpc.server.JSON_RPC().customize(CachingEventHandler)
+		handler = resource.eventhandler
+		self.assertTrue(handler.dispatch['lookup'].cacheable)
+		self.assertEqual(handler.dispatch['lookup'].ttl, 10)
+		self.assertEqual(handler.dispatch['expired'].ttl, 0)
+
+		first = yield self._call(resource, 'lookup', ['a'])
+		handler.defer = mock.Mock(wraps=handler.defer)
+		# the same call, made with keyword params in any order and with the default spelled out
+		second = yield self._call(resource, 'lookup', {'upper': False, 'key': 'a'})
+		third = yield self._call(resource, 'lookup', dict(key='a', upper=False))
+		self.assertEqual(first, dict(jsonrpc='2.0', id=1, result=dict(key='a', values=[1, 2])))
+		self.assertEqual(second, first)
+		self.assertEqual(third, first)
+		self.assertEqual(handler.calls, 1)
+		# hits don't take a thread
+		self.assertEqual(handler.defer.call_count, 0)
+
+		self.assertEqual((yield self._call(resource, 'lookup', ['a', True]))['result']['key'], 'A')
+		self.assertEqual(handler.calls, 2)
+
+		stats = handler.cache.stats()
+		self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (2, 2, 2))
+
+	@defer.inlineCallbacks
+	def test_cache_expiry(self):
+		resource = jsonrpc.server.JSON_RPC().customize(CachingEventHandler)
+		self.assertEqual((yield self._call(resource, 'expired', []))['result'], 1)
+		self.assertEqual((yield self._call(resource, 'expired', []))['result'], 2)
+
+		# errors aren't cached
+		self.assertEqual((yield self._call(resource, 'fail', []))['error']['message'], 'not cached')
+		self.assertEqual((yield self._call(resource, 'fail', []))['error']['message'], 'not cached')
+		self.assertEqual(resource.eventhandler.calls, 4)
+
+	@defer.inlineCallbacks
+	def test_cache_invalidate(self):
+		resource = jsonrpc.server.JSON_RPC().customize(CachingEventHandler)
+		handler = resource.eventhandler
+		yield self._call(resource, 'lookup', ['a'])
+		yield self._call(resource, 'lookup', ['b'])
+		self.assertEqual(handler.invalidate('lookup', ['a']), 1)
+		yield self._call(resource, 'lookup', ['a'])
+		yield self._call(resource, 'lookup', ['b'])
+		self.assertEqual(handler.calls, 3)
+
+		self.assertEqual(handler.invalidate('lookup'), 2)
+		yield self._call(resource, 'lookup', ['b'])
+		self.assertEqual(handler.calls, 4)
+
+	@defer.inlineCallbacks
+	def test_cache_offload(self):
+		class Handler(CachingEventHandler):
+			offload_threshold = 10000
+			@jsonrpc.server.expose
+			@jsonrpc.server.cacheable
+			@jsonrpc.server.execution_policy(jsonrpc.server.INLINE)
+			def numbers(self, count):
+				self.calls += 1
+				return range(count)
+		resource = jsonrpc.server.JSON_RPC().customize(Handler)
+		handler = resource.eventhandler
+		handler.defer = mock.Mock(wraps=handler.defer)
+
+		# the large result is encoded for the cache in a thread, and written without encoding it again
+		self.assertEqual((yield self._call(resource, 'numbers', [5000]))['result'], range(5000))
+		self.assertEqual(handler.defer.call_count, 1)
+		self.assertEqual((yield self._call(resource, 'numbers', [5000]))['result'], range(5000))
+		self.assertEqual(handler.defer.call_count, 1)
+		self.assertEqual(handler.calls, 1)
+
+		self.assertEqual((yield self._call(resource, 'numbers', [5]))['result'], range(5))
+		self.assertEqual(handler.defer.call_count, 1)
+
+	@defer.inlineCallbacks
+	def test_cache_batch(self):
+		body = ('[{"jsonrpc": "2.0", "params": ["a"], "method": "lookup", "id": 1},'
+			'{"jsonrpc": "2.0", "params": ["a"], "method": "lookup", "id": 2},'
+			'{"jsonrpc": "2.0", "params": [], "method": "fail", "id": 3}]')
+		for handler in (CachingEventHandler, type('Streaming', (CachingEventHandler,), dict(stream_batches=True))):
+			resource = jsonrpc.server.JSON_RPC().customize(handler)
+			yield self._call(resource, 'lookup', ['a'])
+
+			request = DummyRequest([''])
+			request.content = StringIO.StringIO(body)
+			d = request.notifyFinish()
+			resource.render(request)
+			yield d
+
+			data = jsonrpc.jsonutil.decode(''.join(request.written))
+			self.assertEqual([item['id'] for item in data], [1, 2, 3])
+			self.assertEqual(data[0]['result'], data[1]['result'])
+			self.assertEqual(data[0]['result'], dict(key='a', values=[1, 2]))
+			self.assertEqual(data[2]['error']['message'], 'not cached')
+			self.assertEqual(resource.eventhandler.calls, 2)
+
+	@defer.inlineCallbacks
+	def test_metrics(self):
+		resource = jsonrpc.server.JSON_RPC().customize(DispatchEventHandler)
+		yield self._call(resource, 'echo', [1])
+		yield self._call(resource, 'text.upper', ['a'])
+		yield self._call(resource, 'echo', [])
+		yield self._call(resource, 'missing', [])
+		yield self._call(resource, 'other', [])
+		# the server hears that the last request finished after this test does
+		yield task.deferLater(reactor, 0, lambda: None)
+
+		stats = resource.eventhandler.stats()
+		methods = stats['methods']
+		self.assertEqual(set(methods), set(['echo', 'text.upper', jsonrpc.metrics.UNKNOWN]))
+
+		echo = methods['echo']
+		self.assertEqual((echo['calls'], echo['errors'], echo['in_flight']), (2, 1, 0))
+		# the invalid call was turned away before it was queued
+		self.assertEqual((echo['queue']['count'], echo['execute']['count']), (1, 1))
+
+		upper = methods['text.upper']
+		self.assertEqual((upper['calls'], upper['errors']), (1, 0))
+		self.assertEqual((upper['queue']['count'], upper['execute']['count']), (0, 1))
+		self.assertEqual(methods[jsonrpc.metrics.UNKNOWN]['errors'], 2)
+
+		requests = stats['requests']
+		self.assertEqual((requests['count'], requests['in_flight']), (5, 0))
+		self.assertEqual([requests['phases'][phase]['count'] for phase in ('parse', 'encode', 'total')], [5, 5, 5])
+		self.assertEqual(stats['threadpool']['calls'], 0)
+		self.assertEqual(stats['cache']['entries'], 0)
+
+		request = DummyRequest([''])
+		text = jsonrpc.metrics.MetricsResource(resource).render_GET(request)
+		self.assertIn('jsonrpc_calls_total{method="echo"} 2\n', text)
+		self.assertIn('jsonrpc_threadpool_calls 0\n', text)
+		self.assertIn('jsonrpc_cache_entries 0\n', text)
+
+	@defer.inlineCallbacks
+	def test_metrics_disabled(self):
+		handler = type('Handler', (DispatchEventHandler,), dict(collect_metrics=False))
+		resource = jsonrpc.server.JSON_RPC().customize(handler)
+		self.assertIs(resource.eventhandler.metrics, None)
+		self.assertEqual((yield self._call(resource, 'echo', [1]))['result'], 1)
+		self.assertEqual(resource.eventhandler.stats()['methods'], {})
+
 	@TestResource
 	def _test_batchcall(self, request, resource):
 		request.content = StringIO.StringIO(